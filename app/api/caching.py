@@ -0,0 +1,321 @@
+"""Conditional GraphQL requests and persisted queries.
+
+The products catalog only changes when a scraper finishes, so a query's
+response is identified by the catalog version, the query itself and the cost
+budget it ran with. Responses carry that as their ETag, and requests whose
+If-None-Match matches are answered with 304 before any context is built or
+SQL is run. Such requests are not charged to the rate limits either.
+
+Anonymous clients all get the same budget, so their GET responses can be
+cached by CDNs. Responses to authenticated clients depend on their tier and
+are only cached privately, responses clamped to a budget are never
+revalidated, and responses with errors are not cached at all.
+
+Queries can also be sent as persisted queries (Apollo's protocol): the client
+sends the sha256 of the document, and the document itself only when the
+server answers PERSISTED_QUERY_NOT_FOUND. With GET the URL stays short and
+stable, so CDNs can cache the responses. Documents that clients register are
+kept in memory for a while, clients send them again when an instance doesn't
+know them. Documents registered with scripts.persisted_queries are stored in
+the database and known to every instance.
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Iterable
+from urllib.parse import parse_qsl, urlencode
+
+from graphql import GraphQLError, OperationDefinitionNode, OperationType, parse, print_ast
+from sqlmodel import Session
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app import settings
+from app.catalog import CatalogVersionCache, get_catalog_version_cache
+from app.db.dependencies import engine
+from app.db.models import PersistedQuery
+from app.ratelimit.buckets import query_cost_budget
+
+# Persisted queries kept in memory, the least recently used are dropped.
+max_persisted_queries = 10_000
+# How long an instance keeps a document a client registered.
+persisted_query_ttl_seconds = 24 * 3600
+# Longer documents are run but not registered.
+max_persisted_query_length = 20_000
+
+
+@lru_cache(maxsize=1024)
+def normalize_query(query: str) -> str | None:
+    """Reprints a document without formatting and comments.
+
+    Returns None for documents that don't parse or that contain mutations or
+    subscriptions, which are never answered from a cache.
+    """
+    try:
+        document = parse(query)
+    except GraphQLError:
+        return None
+    for definition in document.definitions:
+        if (
+            isinstance(definition, OperationDefinitionNode)
+            and definition.operation != OperationType.QUERY
+        ):
+            return None
+    return print_ast(document)
+
+
+def query_etag(
+    catalog_version: int,
+    normalized_query: str,
+    operation_name: str | None,
+    variables: Dict[str, Any] | None,
+    caller: str,
+) -> str:
+    key = json.dumps(
+        [normalized_query, operation_name, variables or {}, caller],
+        sort_keys=True,
+        default=str,
+    )
+    digest = hashlib.sha256(key.encode()).hexdigest()[:32]
+    # Weak, since the body is the same JSON whatever the content encoding.
+    return f'W/"{catalog_version}-{digest}"'
+
+
+def caller_key(authenticated: bool) -> str:
+    """What a response depends on besides the query and the catalog version."""
+    if authenticated:
+        return "authenticated"
+    return f"anonymous-{query_cost_budget(None):g}"
+
+
+def cache_control(method: str, private: bool) -> str:
+    if method != "GET":
+        return "no-cache"
+    visibility = "private" if private else "public"
+    return f"{visibility}, max-age={settings.graphql_cache_max_age}"
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires."""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(
+        tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(",")
+    )
+
+
+class PersistedQueryStore:
+    """Persisted queries in memory, read through from the database.
+
+    Clients can register any document, so theirs are only kept in memory, up
+    to max_persisted_queries for persisted_query_ttl_seconds.
+    """
+
+    def __init__(self, ttl: float = persisted_query_ttl_seconds):
+        self.ttl = ttl
+        # sha256 -> (query, expiry).
+        self._queries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sha256_hash: str) -> str | None:
+        with self._lock:
+            entry = self._queries.get(sha256_hash)
+            if entry is not None and entry[1] > time.monotonic():
+                self._queries.move_to_end(sha256_hash)
+                return entry[0]
+        with Session(engine) as session:
+            row = session.get(PersistedQuery, sha256_hash)
+        if row is None:
+            return None
+        self._store(sha256_hash, row.query)
+        return row.query
+
+    def add(self, sha256_hash: str, query: str) -> bool:
+        """Keeps a client's query, if it's a query that parses and isn't too
+        long. Returns whether it was kept.
+        """
+        if len(query) > max_persisted_query_length or normalize_query(query) is None:
+            return False
+        self._store(sha256_hash, query)
+        return True
+
+    def _store(self, sha256_hash: str, query: str):
+        with self._lock:
+            self._queries[sha256_hash] = (query, time.monotonic() + self.ttl)
+            self._queries.move_to_end(sha256_hash)
+            while len(self._queries) > max_persisted_queries:
+                self._queries.popitem(last=False)
+
+
+def graphql_error(message: str, code: str, status_code: int = 200) -> Response:
+    return JSONResponse(
+        {"data": None, "errors": [{"message": message, "extensions": {"code": code}}]},
+        status_code=status_code,
+    )
+
+
+class ConditionalGraphQLMiddleware:
+    """Adds ETags to GraphQL query responses on `paths` and answers 304s.
+
+    Also resolves persisted queries before the request reaches strawberry.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        paths: Iterable[str],
+        catalog_versions: CatalogVersionCache | None = None,
+        persisted_queries: PersistedQueryStore | None = None,
+    ):
+        self.app = app
+        self.paths = set(paths)
+        self.catalog_versions = catalog_versions or get_catalog_version_cache()
+        self.persisted_queries = persisted_queries or PersistedQueryStore()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (
+            scope["type"] != "http"
+            or scope["path"].rstrip("/") not in self.paths
+            or scope["method"] not in ("GET", "POST")
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        body = b""
+        if scope["method"] == "POST":
+            body = await read_body(receive)
+            try:
+                data = json.loads(body)
+            except ValueError:
+                data = None
+        else:
+            data = dict(parse_qsl(scope["query_string"].decode()))
+            try:
+                for name in ("variables", "extensions"):
+                    if data.get(name):
+                        data[name] = json.loads(data[name])
+            except ValueError:
+                data = None
+        if not isinstance(data, dict):
+            # Strawberry reports the malformed request.
+            await self.app(scope, replay(body, receive), send)
+            return
+
+        persisted = (data.get("extensions") or {}).get("persistedQuery")
+        if isinstance(persisted, dict) and persisted.get("sha256Hash"):
+            sha256_hash = persisted["sha256Hash"]
+            query = data.get("query")
+            if query:
+                if hashlib.sha256(query.encode()).hexdigest() != sha256_hash:
+                    await graphql_error(
+                        "Provided sha256Hash does not match the query",
+                        "PERSISTED_QUERY_HASH_MISMATCH",
+                        400,
+                    )(scope, receive, send)
+                    return
+                # Documents that aren't kept still run, strawberry reports
+                # the ones that don't parse.
+                self.persisted_queries.add(sha256_hash, query)
+            else:
+                query = await asyncio.to_thread(self.persisted_queries.get, sha256_hash)
+                if query is None:
+                    # Clients send the query along when they get this error.
+                    await graphql_error(
+                        "PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND"
+                    )(scope, receive, send)
+                    return
+                data["query"] = query
+                scope, body = with_query(scope, body, data, query)
+
+        normalized = (
+            normalize_query(data["query"]) if isinstance(data.get("query"), str) else None
+        )
+        if normalized is None:
+            await self.app(scope, replay(body, receive), send)
+            return
+
+        request_headers = Headers(scope=scope)
+        authenticated = "authorization" in request_headers
+        version = await asyncio.to_thread(self.catalog_versions.get)
+        etag = query_etag(
+            version,
+            normalized,
+            data.get("operationName"),
+            data.get("variables"),
+            caller_key(authenticated),
+        )
+        method = scope["method"]
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and etag_matches(if_none_match, etag):
+            await Response(
+                status_code=304,
+                headers={
+                    "ETag": etag,
+                    "Cache-Control": cache_control(method, authenticated),
+                    "Vary": "Authorization",
+                },
+            )(scope, receive, send)
+            return
+
+        async def send_with_etag(message: Message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                headers = MutableHeaders(scope=message)
+                # Set by ApiGraphQLRouter for responses that aren't the same
+                # for every caller.
+                marked = headers.get("cache-control")
+                if marked != "no-store":
+                    headers.append("Vary", "Authorization")
+                    if marked == "private":
+                        headers["Cache-Control"] = cache_control(method, private=True)
+                    else:
+                        headers["ETag"] = etag
+                        headers["Cache-Control"] = cache_control(method, authenticated)
+            await send(message)
+
+        await self.app(scope, replay(body, receive), send_with_etag)
+
+
+async def read_body(receive: Receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            return body
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            return body
+
+
+def replay(body: bytes, receive: Receive) -> Receive:
+    """Receive that returns the already read body first."""
+    sent = False
+
+    async def receive_body() -> Message:
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return receive_body
+
+
+def with_query(
+    scope: Scope, body: bytes, data: Dict[str, Any], query: str
+) -> tuple[Scope, bytes]:
+    """Adds the query of a persisted query to the request strawberry receives."""
+    if scope["method"] == "GET":
+        params = parse_qsl(scope["query_string"].decode())
+        params = [(k, v) for k, v in params if k != "query"] + [("query", query)]
+        return {**scope, "query_string": urlencode(params).encode()}, body
+    body = json.dumps(data).encode()
+    headers = MutableHeaders(scope=scope)
+    headers["content-length"] = str(len(body))
+    return scope, body
@@ -0,0 +1,204 @@
+"""Static cost estimates for GraphQL documents.
+
+Fields register a function that estimates their cost from their arguments and
+the names of the fields selected below them. The estimate only needs the
+parsed document and variables, so it can be computed before execution.
+"""
+
+import json
+import logging
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Iterable, List, Set
+
+from graphql import (
+    DocumentNode,
+    GraphQLError,
+    FieldNode,
+    FragmentDefinitionNode,
+    FragmentSpreadNode,
+    InlineFragmentNode,
+    OperationDefinitionNode,
+    SelectionNode,
+    value_from_ast_untyped,
+)
+from strawberry.extensions import SchemaExtension
+from strawberry.types import ExecutionResult
+
+from app import settings
+from app.instrumentation import current_metrics
+
+logger = logging.getLogger("app.cost")
+
+# Arguments of the field and names of all fields selected below it.
+FieldCost = Callable[[Dict[str, Any], Set[str]], float]
+
+# Cost of top-level fields without a registered estimate.
+default_field_cost = 1.0
+
+field_costs: Dict[str, FieldCost] = {}
+
+
+def field_cost(name: str) -> Callable[[FieldCost], FieldCost]:
+    """Registers the cost estimate of the top-level field `name`."""
+
+    def register(fn: FieldCost) -> FieldCost:
+        field_costs[name] = fn
+        return fn
+
+    return register
+
+
+@dataclass
+class FieldEstimate:
+    name: str
+    alias: str
+    arguments: Dict[str, Any]
+    cost: float
+
+
+@dataclass
+class QueryCost:
+    fields: List[FieldEstimate]
+
+    @property
+    def total(self) -> float:
+        return sum(f.cost for f in self.fields)
+
+
+def estimate_cost(
+    document: DocumentNode,
+    operation_name: str | None = None,
+    variables: Dict[str, Any] | None = None,
+) -> QueryCost:
+    fragments = {
+        d.name.value: d
+        for d in document.definitions
+        if isinstance(d, FragmentDefinitionNode)
+    }
+    operations = [
+        d
+        for d in document.definitions
+        if isinstance(d, OperationDefinitionNode)
+        and (operation_name is None or (d.name and d.name.value == operation_name))
+    ]
+    if not operations:
+        return QueryCost(fields=[])
+
+    estimates = []
+    for node in _fields(operations[0].selection_set.selections, fragments):
+        name = node.name.value
+        if name.startswith("__"):
+            continue
+        arguments = {
+            arg.name.value: value_from_ast_untyped(arg.value, variables)
+            for arg in node.arguments
+        }
+        estimate = field_costs.get(name)
+        cost = (
+            estimate(arguments, _selected_names(node, fragments))
+            if estimate
+            else default_field_cost
+        )
+        alias = node.alias.value if node.alias else name
+        estimates.append(FieldEstimate(name, alias, arguments, cost))
+    return QueryCost(fields=estimates)
+
+
+def _fields(
+    selections: Iterable[SelectionNode], fragments: Dict[str, FragmentDefinitionNode]
+) -> Iterable[FieldNode]:
+    """Flattens fragments into the fields they select."""
+    for selection in selections:
+        if isinstance(selection, FieldNode):
+            yield selection
+        elif isinstance(selection, InlineFragmentNode):
+            yield from _fields(selection.selection_set.selections, fragments)
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = fragments.get(selection.name.value)
+            if fragment is not None:
+                yield from _fields(fragment.selection_set.selections, fragments)
+
+
+def _selected_names(
+    node: FieldNode, fragments: Dict[str, FragmentDefinitionNode]
+) -> Set[str]:
+    names: Set[str] = set()
+    if node.selection_set is None:
+        return names
+    for child in _fields(node.selection_set.selections, fragments):
+        names.add(child.name.value)
+        names |= _selected_names(child, fragments)
+    return names
+
+
+class QueryCostExtension(SchemaExtension):
+    """Estimates the cost of each validated operation before it's executed.
+
+    Operations over the budget are rejected, or with QUERY_COST_MODE set to
+    "clamp", run with limit_scale in the context, which resolvers apply to
+    their limits so the result fits the budget. The budget is
+    query_cost_budget from the context, or else QUERY_COST_BUDGET.
+    The estimate is stored as query_cost in the context, added to the request
+    log and returned in the response extensions.
+    """
+
+    def on_execute(self):
+        self.check()
+        yield
+
+    def check(self):
+        execution_context = self.execution_context
+        assert execution_context.graphql_document
+        estimate = estimate_cost(
+            execution_context.graphql_document,
+            execution_context.operation_name,
+            execution_context.variables,
+        )
+        total = estimate.total
+        context = execution_context.context
+        budget = context.get("query_cost_budget", settings.query_cost_budget)
+        self.result: Dict[str, Any] = {"estimated": round(total, 2), "budget": budget}
+        action = "accepted"
+        if total > budget and settings.query_cost_mode == "clamp":
+            context["limit_scale"] = budget / total
+            self.result["limitScale"] = round(context["limit_scale"], 4)
+            total = budget
+            action = "clamped"
+        elif total > budget:
+            action = "rejected"
+            execution_context.result = ExecutionResult(
+                data=None,
+                errors=[
+                    GraphQLError(
+                        f"Query cost {total:.0f} is over the budget of {budget:.0f}, "
+                        "add filters, select fewer fields or split the query",
+                        extensions={"code": "QUERY_TOO_EXPENSIVE", "cost": self.result},
+                    )
+                ],
+            )
+        context["query_cost"] = total
+
+        metrics = current_metrics()
+        if metrics is not None:
+            metrics.query_cost = {
+                "action": action,
+                "total": round(estimate.total, 2),
+                "fields": [asdict(f) for f in estimate.fields],
+            }
+        if action != "accepted":
+            logger.warning(
+                json.dumps(
+                    {
+                        "event": f"query_{action}",
+                        "operation": execution_context.operation_name,
+                        "cost": round(estimate.total, 2),
+                        "budget": budget,
+                        "fields": [asdict(f) for f in estimate.fields],
+                    },
+                    default=str,
+                )
+            )
+
+    def get_results(self) -> Dict[str, Any]:
+        result = getattr(self, "result", None)
+        return {"cost": result} if result else {}
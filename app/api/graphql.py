@@ -0,0 +1,93 @@
+from typing import Any, AsyncIterator, Dict
+
+import orjson
+from fastapi import Response, status
+from fastapi.responses import StreamingResponse
+from strawberry.fastapi import GraphQLRouter
+from strawberry.http import GraphQLHTTPResponse
+
+from app.instrumentation import timed_serialization
+
+
+# Responses with a top-level list longer than this are streamed, this many
+# items at a time.
+stream_chunk_size = 100
+
+
+def response_cache_control(response_data: GraphQLHTTPResponse) -> str | None:
+    """Cache-Control of responses that ConditionalGraphQLMiddleware must not
+    cache as usual: errors can depend on the caller's budget and rate limit,
+    clamped results on their budget.
+    """
+    if response_data.get("errors"):
+        return "no-store"
+    extensions = response_data.get("extensions") or {}
+    if "limitScale" in (extensions.get("cost") or {}):
+        return "private"
+    return None
+
+
+def should_stream(response_data: GraphQLHTTPResponse) -> bool:
+    data = response_data.get("data")
+    return isinstance(data, dict) and any(
+        isinstance(value, list) and len(value) > stream_chunk_size
+        for value in data.values()
+    )
+
+
+async def iter_json(response_data: GraphQLHTTPResponse) -> AsyncIterator[bytes]:
+    """Encodes the response like orjson.dumps, but yields long lists in chunks."""
+    yield b"{"
+    for i, (key, value) in enumerate(response_data.items()):
+        with timed_serialization():
+            chunk = (b"," if i else b"") + orjson.dumps(key) + b":"
+            if key != "data" or not isinstance(value, dict):
+                chunk += orjson.dumps(value)
+        yield chunk
+        if key == "data" and isinstance(value, dict):
+            async for chunk in iter_data(value):
+                yield chunk
+    yield b"}"
+
+
+async def iter_data(data: Dict[str, Any]) -> AsyncIterator[bytes]:
+    yield b"{"
+    for i, (key, value) in enumerate(data.items()):
+        prefix = (b"," if i else b"") + orjson.dumps(key) + b":"
+        if not isinstance(value, list):
+            with timed_serialization():
+                chunk = prefix + orjson.dumps(value)
+            yield chunk
+            continue
+        yield prefix + b"["
+        for start in range(0, len(value), stream_chunk_size):
+            with timed_serialization():
+                # Strips the brackets so the chunks can be joined into one list.
+                chunk = orjson.dumps(value[start : start + stream_chunk_size])[1:-1]
+            yield (b"," if start else b"") + chunk
+        yield b"]"
+    yield b"}"
+
+
+class ApiGraphQLRouter(GraphQLRouter):
+    """Encodes responses with orjson and streams large result lists."""
+
+    def encode_json(self, data: object) -> bytes:  # type: ignore[override]
+        with timed_serialization():
+            return orjson.dumps(data)
+
+    def create_response(
+        self, response_data: GraphQLHTTPResponse, sub_response: Response
+    ) -> Response:
+        cache_control = response_cache_control(response_data)
+        if cache_control is not None:
+            sub_response.headers["Cache-Control"] = cache_control
+        if not should_stream(response_data):
+            return super().create_response(response_data, sub_response)
+        response = StreamingResponse(
+            iter_json(response_data),
+            media_type="application/json",
+            status_code=sub_response.status_code or status.HTTP_200_OK,
+        )
+        response.headers.raw.extend(sub_response.headers.raw)
+        return response
@@ -1,26 +1,30 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from sqlmodel import Session, select
-from svix.webhooks import Webhook
+from svix.webhooks import Webhook, WebhookVerificationError
 import json
 from propelauth_fastapi import User as PropelUser
 import stripe
 
 from app import settings
-from app.cloudflare import CloudflareClient, get_cloudflare_client
 from app.db.dependencies import get_db_session
 from app.db.models import User, UserType
+from app.entitlements import EntitlementCache, get_entitlement_cache
 from app.propel.auth import auth
+from app.webhooks import WebhookQueue, get_webhook_queue, record_event
 
 router = APIRouter(prefix="/integrations", tags=["integrations"])
 
 propel_wh = Webhook(settings.propel_auth_webhook_secret)
 stripe.api_key = settings.stripe_api_key
+stripe.api_base = settings.stripe_api_base
 
 
 @router.post("/stripe/webhook")
 async def stripe_webhook(
     request: Request,
     db: Session = Depends(get_db_session),
+    queue: WebhookQueue = Depends(get_webhook_queue),
 ):
     sig_header = request.headers["stripe-signature"]
     payload = await request.body()
@@ -29,67 +33,38 @@ async def stripe_webhook(
         event = stripe.Webhook.construct_event(
             payload, sig_header, settings.stripe_webhook_signing_secret
         )
-    except ValueError as e:
-        raise e
-    if event.type == "checkout.session.completed":
-        # The customer completed signing up for a subscription
-        session = event["data"]["object"]
-        user_id = session["client_reference_id"]
-        user = db.get(User, user_id)
-        if user is None:
-            raise HTTPException(status_code=404, detail=f"User not found: {user_id}")
-        subscription = stripe.Subscription.retrieve(session["subscription"])
-        for line_item in subscription["items"]["data"]:
-            if line_item["price"]["id"] == settings.stripe_price_id:
-                user.user_type = UserType.PRO
-                user.stripe_customer_id = subscription["customer"]
-                db.commit()
-                break
-    elif event.type == "customer.subscription.deleted":
-        # The customer canceled their subscription
-        subscription = event["data"]["object"]
-        customer = subscription["customer"]
-        stmt = select(User).where(User.stripe_customer_id == customer)
-        user = db.exec(stmt).first()
-        if user is None:
-            raise HTTPException(
-                status_code=404,
-                detail=f"User not found for stripe customer: {customer}",
-            )
-        for line_item in subscription["items"]["data"]:
-            if line_item["price"]["id"] == settings.stripe_price_id:
-                user.user_type = UserType.FREE
-                db.commit()
-                break
-    elif event.type == "invoice.payment_failed":
-        # The payment failed for an invoice
-        customer = event["data"]["customer"]
-        raise HTTPException(
-            status_code=400, detail=f"Payment failed for customer: {customer}"
-        )
-
+    except (ValueError, stripe.SignatureVerificationError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if await run_in_threadpool(
+        record_event, db, "stripe", event.id, event.type, json.loads(payload)
+    ):
+        queue.enqueue("stripe", event.id)
     return {"message": "Stripe Webhook Received"}
 
 
+def stripe_customer_id(db: Session, user_id: str) -> str | None:
+    return db.exec(select(User.stripe_customer_id).where(User.id == user_id)).first()
+
+
 @router.get("/stripe/checkout")
 async def checkout(
     user: PropelUser = Depends(auth.require_user),
     db: Session = Depends(get_db_session),
+    entitlements: EntitlementCache = Depends(get_entitlement_cache),
 ):
-    db_user = db.get(User, user.user_id)
-    if db_user is None:
+    # In the threadpool, a user that isn't cached is read from the database.
+    user_type = await run_in_threadpool(entitlements.get, db, user.user_id)
+    if user_type is None:
         raise HTTPException(status_code=404, detail="User not found")
-    if db_user.user_type != UserType.FREE:
+    if user_type != UserType.FREE:
         raise HTTPException(status_code=400, detail="User already upgraded")
 
-    customer_email = None
-    customer = None
-    if db_user.stripe_customer_id is not None:
-        customer = db_user.stripe_customer_id
-    else:
-        customer_email = user.email
+    # Users who subscribed before are billed as the same Stripe customer.
+    customer = await run_in_threadpool(stripe_customer_id, db, user.user_id)
+    customer_email = None if customer is not None else user.email
 
-    checkout_session = stripe.checkout.Session.create(
+    checkout_session = await run_in_threadpool(
+        stripe.checkout.Session.create,
         line_items=[
             {
                 "price": settings.stripe_price_id,
@@ -97,7 +72,7 @@ async def checkout(
             }
         ],
         payment_method_types=["card"],
-        client_reference_id=db_user.id,
+        client_reference_id=user.user_id,
         mode="subscription",
         success_url=f"{settings.stripe_redirect_url}/billing",
         cancel_url=settings.stripe_redirect_url,
@@ -112,26 +87,18 @@ async def checkout(
 async def propel_webhook(
     request: Request,
     db: Session = Depends(get_db_session),
-    cf_client: CloudflareClient = Depends(get_cloudflare_client),
+    queue: WebhookQueue = Depends(get_webhook_queue),
 ):
     payload = await request.body()
     headers = dict(request.headers)
-    propel_wh.verify(payload, headers)
+    try:
+        propel_wh.verify(payload, headers)
+    except WebhookVerificationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     json_payload = json.loads(payload.decode("utf-8"))
-    event_type = json_payload["event_type"]
-    if event_type == "user.created":
-        user = User(
-            id=json_payload["user_id"],
-            stripe_customer_id=None,
-            user_type=UserType.FREE,
-        )
-        db.add(user)
-        db.commit()
-        cf_client.put_user_type(user.id, user.user_type)
-    elif event_type == "user.deleted":
-        user = db.get(User, json_payload["user_id"])
-        if user:
-            db.delete(user)
-            db.commit()
-            cf_client.remote_user_type(user.id)
+    event_id = headers["svix-id"]
+    if await run_in_threadpool(
+        record_event, db, "propel", event_id, json_payload["event_type"], json_payload
+    ):
+        queue.enqueue("propel", event_id)
     return {"message": "Propel Webhook Received"}
@@ -1,23 +1,57 @@
-from typing import NewType
+import asyncio
+import base64
+import binascii
+import json
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, NewType
 from fastapi import Depends
-from sqlmodel import Session, and_, func, select
+from propelauth_fastapi import User as PropelUser
+from sqlalchemy import Engine
+from sqlmodel import Session, and_, func, or_, select
 import strawberry
-from strawberry.fastapi import GraphQLRouter
+from strawberry.types.nodes import SelectedField, Selection
+from strawberry.utils.str_converters import to_camel_case
 import re
 
-from app.db.dependencies import get_db_session
-from app.db.models import Price, Product
+from app import settings
+from app.api import cost
+from app.catalog import Facets, get_facet_cache
+from app.db.dependencies import get_db_session, get_read_engine, read_catalog
+from app.db.models import Price, PriceVersion, Product
+from app.db.search import search_match
+from app.api.graphql import ApiGraphQLRouter
+from app.entitlements import EntitlementCache, get_entitlement_cache
+from app.instrumentation import InstrumentationExtension, normalize
+from app.propel import auth
+from app.ratelimit import RateLimitExtension
+from app.ratelimit.buckets import query_cost_budget
 
 
 product_limit = 1000
+# Products per page of search results, by default and at most.
+search_page_size = 20
+search_limit = 100
 
 
 async def get_context(
     db: Session = Depends(get_db_session),
-    # TODO: ensure the user is authenticated
+    read_engine: Engine = Depends(get_read_engine),
+    user: PropelUser | None = Depends(auth.optional_user),
+    entitlements: EntitlementCache = Depends(get_entitlement_cache),
 ):
+    # In a thread, a user that isn't cached is read from the database.
+    user_type = await asyncio.to_thread(entitlements.get, db, user.user_id) if user else None
+    # Anonymous requests are allowed, but get the smallest rate limit.
+    # db is the primary, which rate limits are written to, products are read
+    # from read_engine.
     return {
         "db": db,
+        "user": user,
+        "user_type": user_type,
+        "query_cost_budget": query_cost_budget(user_type),
+        "products": ProductLoader(read_engine, settings.graphql_field_concurrency),
     }
 
 
@@ -43,7 +77,7 @@ class ApiPrice:
     start_usage_amount: str | None = None
 
     @classmethod
-    def from_storage(cls, price: Price) -> "ApiPrice":
+    def from_storage(cls, price: Any) -> "ApiPrice":
         return cls(
             usd=price.usd,
             purchase_option=price.purchase_option,
@@ -96,28 +130,48 @@ class ApiProduct:
     region: str | None = None
     service: str
     product_family: str = ""
-    attributes: JSON
-    db_prices: strawberry.Private[list[Price]]
+    db_attributes: strawberry.Private[Dict[str, Any]]
+    # Loaded prices by the time they're as of, None for the current ones.
+    db_prices: strawberry.Private[Dict[datetime | None, list[Any]]]
+    # asOf of the products query, the default of prices.
+    as_of: strawberry.Private[datetime | None] = None
 
     @classmethod
-    def from_storage(cls, product: Product) -> "ApiProduct":
+    def from_row(
+        cls,
+        row: Any,
+        attributes: Dict[str, Any],
+        prices: Dict[datetime | None, list[Any]],
+        as_of: datetime | None = None,
+    ) -> "ApiProduct":
+        """Builds a product from a row with only the selected columns."""
         return cls(
-            product_hash=product.product_hash,
-            sku=product.sku,
-            vendor_name=product.vendor_name,
-            region=product.region,
-            service=product.service,
-            product_family=product.product_family,
-            attributes=product.attributes,  # type: ignore
-            db_prices=product.prices,
+            product_hash=row.product_hash,
+            sku=getattr(row, "sku", None),  # type: ignore
+            vendor_name=getattr(row, "vendor_name", None),  # type: ignore
+            region=getattr(row, "region", None),
+            service=getattr(row, "service", None),  # type: ignore
+            product_family=getattr(row, "product_family", ""),
+            db_attributes=attributes,
+            db_prices=prices,
+            as_of=as_of,
         )
 
+    @strawberry.field
+    def attributes(self, keys: list[str] | None = None) -> JSON:
+        if keys is None:
+            return self.db_attributes
+        return {k: self.db_attributes[k] for k in keys if k in self.db_attributes}
+
     @strawberry.field
     async def prices(
-        self, info: strawberry.Info, filter: PriceFilter | None = None
+        self,
+        info: strawberry.Info,
+        filter: PriceFilter | None = None,
+        as_of: datetime | None = None,
     ) -> list[ApiPrice]:
         prices_with_filter = []
-        for price in self.db_prices:
+        for price in self.db_prices.get(utc(as_of) or self.as_of, []):
             if filter:
                 if (
                     filter.purchase_option
@@ -193,6 +247,307 @@ def str_to_regex(s: str) -> re.Pattern:
 #             price.USD = str(usd)
 
 
+# GraphQL field name -> column, for the columns that can be projected.
+product_columns = {
+    to_camel_case(name): getattr(Product, name)
+    for name in ["sku", "vendor_name", "region", "service", "product_family"]
+}
+price_columns = {
+    to_camel_case(name): getattr(Price, name)
+    for name in PriceFilter.__annotations__
+}
+# Loaded for every selected price, since ApiPrice.from_storage reads them.
+api_price_columns = [Price.usd, Price.purchase_option, Price.unit, Price.start_usage_amount]
+
+
+def selected_fields(selections: Iterable[Selection]) -> Iterator[SelectedField]:
+    """Flattens fragments into the fields they select."""
+    for selection in selections:
+        if isinstance(selection, SelectedField):
+            yield selection
+        else:
+            yield from selected_fields(selection.selections)
+
+
+def utc(value: datetime | str | None) -> datetime | None:
+    """An asOf time in UTC, naive times are taken to be UTC."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def price_load_columns(
+    price_selections: list[SelectedField], as_of: datetime | None = None
+) -> Dict[datetime | None, list[Any]]:
+    """Columns the price selections need, the displayed ones and the filtered
+    ones, by the time the prices are as of.
+    """
+    loads: Dict[datetime | None, Dict[str, Any]] = {}
+    for selection in price_selections:
+        columns = loads.setdefault(
+            utc(selection.arguments.get("asOf")) or as_of,
+            {c.key: c for c in api_price_columns},
+        )
+        for name, value in (selection.arguments.get("filter") or {}).items():
+            if value and name in price_columns:
+                columns[price_columns[name].key] = price_columns[name]
+    return {t: list(columns.values()) for t, columns in loads.items()}
+
+
+def load_prices(
+    session: Session,
+    product_hashes: list[str],
+    columns: list[Any],
+    as_of: datetime | None = None,
+) -> Dict[str, list[Any]]:
+    """Loads the given price columns, grouped by product, of the current prices
+    or of the price versions valid at `as_of`.
+    """
+    prices: Dict[str, list[Any]] = {h: [] for h in product_hashes}
+    if as_of is None:
+        stmt = select(Price.product_hash, *columns).where(
+            Price.product_hash.in_(product_hashes)  # type: ignore
+        )
+    else:
+        # One range of idx_price_version_product_range per product.
+        stmt = select(
+            PriceVersion.product_hash, *[getattr(PriceVersion, c.key) for c in columns]
+        ).where(
+            PriceVersion.product_hash.in_(product_hashes),  # type: ignore
+            PriceVersion.valid_from <= as_of,
+            or_(PriceVersion.valid_to.is_(None), PriceVersion.valid_to > as_of),  # type: ignore
+        )
+    for row in session.execute(stmt):
+        prices[row.product_hash].append(row)
+    return prices
+
+
+@dataclass
+class Projection:
+    """What a products query loads for the selected fields."""
+
+    columns: list[Any]
+    all_attributes: bool
+    attribute_keys: list[str]
+    price_loads: Dict[datetime | None, list[Any]]
+    as_of: datetime | None = None
+
+    def key(self) -> Hashable:
+        return (
+            tuple(c.key for c in self.columns),
+            self.all_attributes,
+            tuple(self.attribute_keys),
+            tuple(
+                (t and t.isoformat(), tuple(c.key for c in columns))
+                for t, columns in self.price_loads.items()
+            ),
+            self.as_of and self.as_of.isoformat(),
+        )
+
+
+def product_projection(
+    fields: list[SelectedField], as_of: datetime | None = None
+) -> Projection:
+    """Only the selected columns are loaded, and of attributes only the
+    requested keys unless some selection asks for all of them. Prices are
+    loaded as of the time selected for them, or else `as_of`.
+    """
+    columns = [Product.product_hash] + [
+        product_columns[f.name] for f in fields if f.name in product_columns
+    ]
+    attribute_selections = [f for f in fields if f.name == "attributes"]
+    all_attributes = any(f.arguments.get("keys") is None for f in attribute_selections)
+    attribute_keys = sorted(
+        {k for f in attribute_selections for k in f.arguments.get("keys") or []}
+    )
+    if all_attributes:
+        columns.append(Product.attributes)
+    else:
+        columns += [
+            Product.attributes[key].label(f"attribute_{i}")
+            for i, key in enumerate(attribute_keys)
+        ]
+    price_selections = [f for f in fields if f.name == "prices"]
+    price_loads = price_load_columns(price_selections, as_of)
+    return Projection(columns, all_attributes, attribute_keys, price_loads, as_of)
+
+
+def build_products(
+    session: Session, rows: list[Any], projection: Projection
+) -> list[ApiProduct]:
+    """Products from the rows of a projected query, with their prices."""
+    product_hashes = [r.product_hash for r in rows]
+    prices = {
+        as_of: load_prices(session, product_hashes, columns, as_of) if rows else {}
+        for as_of, columns in projection.price_loads.items()
+    }
+    attribute_keys = projection.attribute_keys
+    products = []
+    for row in rows:
+        if projection.all_attributes:
+            attributes = row.attributes or {}
+        else:
+            extracted = (getattr(row, f"attribute_{i}") for i in range(len(attribute_keys)))
+            attributes = {
+                k: v for k, v in zip(attribute_keys, extracted) if v is not None
+            }
+        products.append(
+            ApiProduct.from_row(
+                row,
+                attributes,
+                {t: by_product.get(row.product_hash, []) for t, by_product in prices.items()},
+                projection.as_of,
+            )
+        )
+    return products
+
+
+def load_products(session: Session, stmt: Any, projection: Projection) -> list[ApiProduct]:
+    """Runs a products query and its prices query."""
+    return build_products(session, session.execute(stmt).all(), projection)
+
+
+@strawberry.type
+class SearchResults:
+    items: list[ApiProduct]
+    # Pass as `after` for the next page, null on the last page.
+    next_cursor: str | None = None
+
+
+def encode_cursor(rank: float, product_hash: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([rank, product_hash]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[float, str]:
+    try:
+        rank, product_hash = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), str(product_hash)
+    except (binascii.Error, ValueError, TypeError):
+        raise ValueError("Invalid cursor") from None
+
+
+def search_products(
+    session: Session, stmt: Any, projection: Projection, first: int
+) -> SearchResults:
+    """Runs a search query, which fetches one row more than `first` to tell
+    whether there's a next page.
+    """
+    rows = session.execute(stmt).all()
+    items = build_products(session, rows[:first], projection)
+    if len(rows) <= first:
+        return SearchResults(items=items)
+    last = rows[first - 1]
+    return SearchResults(
+        items=items, next_cursor=encode_cursor(last.search_rank, last.product_hash)
+    )
+
+
+class ProductLoader:
+    """Runs the products fields of one request concurrently.
+
+    Each load runs in a thread with its own connection from the pool of
+    `engine`, at most `concurrency` at the same time, so a document with many
+    aliased products fields takes about as long as its slowest field. Fields
+    with the same filter and selections share a single load.
+    """
+
+    def __init__(self, engine: Engine, concurrency: int):
+        self.engine = engine
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.loads: Dict[Hashable, asyncio.Task] = {}
+
+    async def load(self, key: Hashable, fn: Callable[[Session], Any]) -> Any:
+        task = self.loads.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run(fn))
+            self.loads[key] = task
+        return await task
+
+    async def _run(self, fn: Callable[[Session], Any]) -> Any:
+        async with self.semaphore:
+            return await asyncio.to_thread(self._run_in_session, fn)
+
+    def _run_in_session(self, fn: Callable[[Session], Any]) -> Any:
+        return read_catalog(fn, self.engine)
+
+
+@strawberry.type
+class FacetValue:
+    value: str
+    count: int
+
+
+@strawberry.type
+class ServiceAttributeKeys:
+    vendor_name: str
+    service: str
+    keys: list[FacetValue]
+
+
+@strawberry.type
+class CatalogFacets:
+    vendors: list[FacetValue]
+    services: list[FacetValue]
+    regions: list[FacetValue]
+    product_families: list[FacetValue]
+    attribute_keys: list[ServiceAttributeKeys]
+
+
+def facet_values(counts: Counter) -> list[FacetValue]:
+    """Most common values first."""
+    return [
+        FacetValue(value=value, count=count)
+        for value, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    ]
+
+
+def catalog_facets(
+    facets: Facets, vendor_name: str | None, service: str | None
+) -> CatalogFacets:
+    """Product counts per value. Each facet is narrowed by the filters on the
+    other facets, so vendors are narrowed by service, but not by vendor.
+    """
+    vendors: Counter = Counter()
+    services: Counter = Counter()
+    regions: Counter = Counter()
+    families: Counter = Counter()
+    for f in facets.products:
+        vendor_match = not vendor_name or f.vendor_name == vendor_name
+        service_match = not service or f.service == service
+        if service_match:
+            vendors[f.vendor_name] += f.products
+        if vendor_match:
+            services[f.service] += f.products
+        if vendor_match and service_match:
+            families[f.product_family] += f.products
+            # Products without a region can't be filtered by one.
+            if f.region:
+                regions[f.region] += f.products
+
+    attribute_keys: dict[tuple[str, str], Counter] = {}
+    for a in facets.attributes:
+        if vendor_name and a.vendor_name != vendor_name:
+            continue
+        if service and a.service != service:
+            continue
+        keys = attribute_keys.setdefault((a.vendor_name, a.service), Counter())
+        keys[a.key] = a.products
+    return CatalogFacets(
+        vendors=facet_values(vendors),
+        services=facet_values(services),
+        regions=facet_values(regions),
+        product_families=facet_values(families),
+        attribute_keys=[
+            ServiceAttributeKeys(vendor_name=vendor, service=name, keys=facet_values(keys))
+            for (vendor, name), keys in sorted(attribute_keys.items())
+        ],
+    )
+
+
 def append_clause(base, clause):
     if base is None:
         return clause
@@ -203,9 +558,9 @@ def append_clause(base, clause):
 class Query:
     @strawberry.field
     async def products(
-        self, filter: ProductFilter, info: strawberry.Info
+        self, filter: ProductFilter, info: strawberry.Info, as_of: datetime | None = None
     ) -> list[ApiProduct]:
-        session: Session = info.context["db"]
+        # asOf selects the prices from the price history, see app.catalog.
         where_clause = None
         if filter.vendor_name:
             where_clause = append_clause(
@@ -239,12 +594,82 @@ class Query:
                     ).op("~")(cleaned_regex),
                 )
 
-        stmt = select(Product)
+        projection = product_projection(
+            list(selected_fields(info.selected_fields[0].selections)), utc(as_of)
+        )
+        stmt = select(*projection.columns)
         if where_clause is not None:
             stmt = stmt.where(where_clause)  # type: ignore
-        stmt = stmt.limit(product_limit)
-        products = session.exec(stmt).unique().all()
-        return [ApiProduct.from_storage(p) for p in products]
+        # Set by QueryCostExtension for clamped queries over the cost budget.
+        limit = max(1, int(product_limit * info.context.get("limit_scale", 1.0)))
+        stmt = stmt.limit(limit)
+
+        key = (json.dumps(normalize(filter), sort_keys=True), projection.key(), limit)
+        loader: ProductLoader = info.context["products"]
+        return await loader.load(
+            key, lambda session: load_products(session, stmt, projection)
+        )
+
+    @strawberry.field
+    async def search(
+        self,
+        query: str,
+        info: strawberry.Info,
+        vendor_name: str | None = None,
+        region: str | None = None,
+        first: int = search_page_size,
+        after: str | None = None,
+    ) -> SearchResults:
+        # Best matches first, see app.db.search for the query syntax.
+        if not query.strip():
+            return SearchResults(items=[])
+        loader: ProductLoader = info.context["products"]
+        match, rank = search_match(
+            Product.__table__.c.search_vector,  # type: ignore
+            query,
+            loader.engine.dialect.name,
+        )
+        where_clause = match
+        if vendor_name:
+            where_clause = and_(where_clause, Product.vendor_name == vendor_name)
+        if region:
+            where_clause = and_(where_clause, Product.region == region)
+        if after:
+            after_rank, after_hash = decode_cursor(after)
+            where_clause = and_(
+                where_clause,
+                or_(
+                    rank < after_rank,
+                    and_(rank == after_rank, Product.product_hash > after_hash),
+                ),
+            )
+
+        fields = selected_fields(info.selected_fields[0].selections)
+        items = [f for f in fields if f.name == "items"]
+        projection = product_projection(
+            [f for selection in items for f in selected_fields(selection.selections)]
+        )
+        search_rank = rank.label("search_rank")
+        first = min(max(first, 1), search_limit)
+        first = max(1, int(first * info.context.get("limit_scale", 1.0)))
+        stmt = (
+            select(*projection.columns, search_rank)
+            .where(where_clause)
+            .order_by(search_rank.desc(), Product.product_hash)
+            .limit(first + 1)
+        )
+        key = ("search", query, vendor_name, region, after, projection.key(), first)
+        return await loader.load(
+            key, lambda session: search_products(session, stmt, projection, first)
+        )
+
+    @strawberry.field
+    async def facets(
+        self, vendor_name: str | None = None, service: str | None = None
+    ) -> CatalogFacets:
+        # Served from memory, see app.catalog.
+        facets = await asyncio.to_thread(get_facet_cache().get)
+        return catalog_facets(facets, vendor_name, service)
 
     # @strawberry.field
     # async def product_attributes(self, product: ApiProduct) -> list[TransformedProductAttribute]:
@@ -257,5 +682,46 @@ class Query:
     #     return []
 
 
-schema = strawberry.Schema(query=Query)
-graphql_app = GraphQLRouter(schema, context_getter=get_context)
+# Weights of the products cost estimate. A product is counted as 1/100 and
+# each filter divides the expected number of products by its selectivity.
+filter_selectivity = {"vendorName": 2, "productFamily": 4, "service": 10, "region": 10}
+attribute_selectivity = 4
+# Regex filters can't use an index, prices multiply the rows returned.
+regex_multiplier = 5
+prices_multiplier = 3
+
+
+@cost.field_cost("products")
+def products_cost(arguments: Dict[str, Any], selected: set[str]) -> float:
+    filter = arguments.get("filter") or {}
+    products = float(product_limit)
+    for name, selectivity in filter_selectivity.items():
+        if filter.get(name):
+            products /= selectivity
+    regexes = 0
+    for attribute_filter in filter.get("attributeFilters") or []:
+        if attribute_filter.get("value"):
+            products /= attribute_selectivity
+        if attribute_filter.get("valueRegex"):
+            regexes += 1
+    estimate = 1 + max(products, 1) / 100
+    if "prices" in selected:
+        estimate *= prices_multiplier
+    return estimate * regex_multiplier**regexes
+
+
+@cost.field_cost("search")
+def search_cost(arguments: Dict[str, Any], selected: set[str]) -> float:
+    first = min(arguments.get("first") or search_page_size, search_limit)
+    estimate = 1 + first / 100
+    if "prices" in selected:
+        estimate *= prices_multiplier
+    return estimate
+
+
+schema = strawberry.Schema(
+    query=Query,
+    # QueryCostExtension sets the cost RateLimitExtension charges.
+    extensions=[InstrumentationExtension, cost.QueryCostExtension, RateLimitExtension],
+)
+graphql_app = ApiGraphQLRouter(schema, context_getter=get_context)
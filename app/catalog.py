@@ -0,0 +1,208 @@
+"""Version and facets of the product catalog.
+
+Once a vendor's scrapers have finished, the persisted version is bumped if
+they wrote anything. API instances keep the last version they read for CATALOG_VERSION_TTL_SECONDS, so
+responses can be validated against it without querying the database. The
+version is read from the same engine as the catalog, so it never runs ahead
+of a lagging replica.
+
+The facets, the values of vendors, services, product families, regions and
+attribute keys with their product counts, are summary tables that the
+scrapers recompute for their vendor before bumping the version. API instances
+keep them in memory until the version changes.
+
+Scraper runs overwrite the prices, so they also record the prices that
+changed in the append-only price history, which answers what a product cost
+at an earlier time.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Tuple
+
+from sqlalchemy import delete, exists, func, insert, literal, literal_column, true, update
+from sqlmodel import Session, select
+
+from app import settings
+from app.db.dependencies import read_catalog
+from app.db.models import (
+    AttributeFacet,
+    CatalogVersion,
+    Price,
+    PriceBase,
+    PriceVersion,
+    Product,
+    ProductFacet,
+)
+
+# Columns whose change makes a new version of a price. Not the effective
+# dates, which some scrapers fill with the time of the run when the vendor has
+# none; a version keeps the dates of the run that added it.
+versioned_columns = [
+    name
+    for name in PriceBase.model_fields
+    if name not in ("price_hash", "effective_start_date", "effective_date_end")
+]
+
+
+def bump_catalog_version(session: Session, source: str) -> int:
+    """Increments the catalog version and commits, returns the new version."""
+    row = session.get(CatalogVersion, 1, with_for_update=True)
+    if row is None:
+        row = CatalogVersion(id=1)
+    row.version += 1
+    row.source = source
+    row.updated_at = datetime.now(timezone.utc)
+    session.add(row)
+    session.commit()
+    return row.version
+
+
+class CatalogVersionCache:
+    def __init__(self, ttl: float = settings.catalog_version_ttl_seconds):
+        self.ttl = ttl
+        self._version = 0
+        self._expires = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> int:
+        with self._lock:
+            if self._expires > time.monotonic():
+                return self._version
+            row = read_catalog(lambda session: session.get(CatalogVersion, 1))
+            self._version = row.version if row else 0
+            self._expires = time.monotonic() + self.ttl
+            return self._version
+
+    def invalidate(self):
+        with self._lock:
+            self._expires = 0.0
+
+
+_cache: CatalogVersionCache | None = None
+
+
+def get_catalog_version_cache() -> CatalogVersionCache:
+    global _cache
+    if _cache is None:
+        _cache = CatalogVersionCache()
+    return _cache
+
+
+def refresh_facets(session: Session, vendor: str | None = None):
+    """Recomputes the facets of `vendor`, or of all vendors, and commits."""
+    products = Product.vendor_name == vendor if vendor else true()
+    if session.get_bind().dialect.name == "postgresql":
+        keys = func.json_object_keys(Product.attributes).table_valued("key").render_derived()
+        is_object = func.json_typeof(Product.attributes) == "object"
+    else:
+        keys = func.json_each(Product.attributes).table_valued("key")
+        is_object = func.json_type(Product.attributes) == "object"
+    # Inline, Postgres only groups by the same expression without parameters.
+    region = func.coalesce(Product.region, literal_column("''"))
+
+    for table in (ProductFacet, AttributeFacet):
+        session.execute(
+            delete(table).where(table.vendor_name == vendor if vendor else true())
+        )
+    session.execute(
+        insert(ProductFacet).from_select(
+            ["vendor_name", "service", "product_family", "region", "products"],
+            select(
+                Product.vendor_name,
+                Product.service,
+                Product.product_family,
+                region,
+                func.count(),
+            )
+            .where(products)
+            .group_by(Product.vendor_name, Product.service, Product.product_family, region),
+        )
+    )
+    session.execute(
+        insert(AttributeFacet).from_select(
+            ["vendor_name", "service", "key", "products"],
+            select(Product.vendor_name, Product.service, keys.c.key, func.count())
+            .join(keys, true())
+            .where(products, is_object)
+            .group_by(Product.vendor_name, Product.service, keys.c.key),
+        )
+    )
+    session.commit()
+
+
+def record_price_changes(
+    session: Session, vendor: str, now: datetime | None = None
+) -> Tuple[int, int]:
+    """Brings the price history of `vendor` up to date with its prices and commits.
+
+    Closes the current versions of prices that changed or were removed and
+    adds versions of new and changed prices, valid from `now`. Returns the
+    number of closed and added versions.
+    """
+    now = now or datetime.now(timezone.utc)
+    current = PriceVersion.vendor_name == vendor, PriceVersion.valid_to.is_(None)  # type: ignore
+    unchanged = exists().where(
+        Price.price_hash == PriceVersion.price_hash,
+        *[
+            getattr(Price, name).is_not_distinct_from(getattr(PriceVersion, name))
+            for name in versioned_columns
+        ],
+    )
+    closed = session.execute(
+        update(PriceVersion).where(*current, ~unchanged).values(valid_to=now)
+    ).rowcount
+    # Prices of rows written before prices had a vendor_name are found by product.
+    vendor_products = select(Product.product_hash).where(Product.vendor_name == vendor)
+    columns = [*PriceBase.model_fields, "product_hash"]
+    added = session.execute(
+        insert(PriceVersion).from_select(
+            [*columns, "vendor_name", "valid_from"],
+            select(*[getattr(Price, name) for name in columns], literal(vendor), literal(now))
+            .where(Price.product_hash.in_(vendor_products))  # type: ignore
+            .where(~exists().where(*current, PriceVersion.price_hash == Price.price_hash)),
+        )
+    ).rowcount
+    session.commit()
+    return closed, added
+
+
+@dataclass
+class Facets:
+    products: List[ProductFacet]
+    attributes: List[AttributeFacet]
+
+
+class FacetCache:
+    """Facets as of the catalog version, reloaded when it changes."""
+
+    def __init__(self, versions: CatalogVersionCache | None = None):
+        self.versions = versions or get_catalog_version_cache()
+        self._facets: Facets | None = None
+        self._version = -1
+        self._lock = threading.Lock()
+
+    def get(self) -> Facets:
+        version = self.versions.get()
+        with self._lock:
+            if self._facets is None or self._version != version:
+                self._facets = read_catalog(
+                    lambda session: Facets(
+                        products=list(session.exec(select(ProductFacet)).all()),
+                        attributes=list(session.exec(select(AttributeFacet)).all()),
+                    )
+                )
+                self._version = version
+            return self._facets
+
+
+_facet_cache: FacetCache | None = None
+
+
+def get_facet_cache() -> FacetCache:
+    global _facet_cache
+    if _facet_cache is None:
+        _facet_cache = FacetCache()
+    return _facet_cache
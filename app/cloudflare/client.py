@@ -1,13 +1,152 @@
+import logging
+import threading
+from typing import Dict
+
+import httpx
+
+from app import settings
 from app.db.models import UserType
 
+logger = logging.getLogger("app.cloudflare")
+
+# Failed batches are retried after flush_interval, doubling up to this.
+max_retry_delay = 60.0
+
 
 class CloudflareClient:
+    """Writes user types to a Workers KV namespace, keyed by user id.
+
+    Writes are buffered and sent with the bulk endpoints by a background
+    thread. Writes to the same key before a flush are coalesced into the last
+    one. A flush happens every flush_interval seconds, or as soon as
+    batch_size keys are pending. After a failed flush the next one waits with
+    exponential backoff. Writes after close are rejected. Without an account
+    and namespace configured writes are dropped.
+    """
+
+    def __init__(
+        self,
+        api_base: str = settings.cloudflare_api_base,
+        account_id: str | None = settings.cloudflare_account_id,
+        namespace_id: str | None = settings.cloudflare_kv_namespace_id,
+        api_token: str = settings.cloudflare_api_token,
+        flush_interval: float = settings.cloudflare_kv_flush_interval,
+        batch_size: int = settings.cloudflare_kv_batch_size,
+    ):
+        self.enabled = bool(account_id and namespace_id)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.http = httpx.Client(
+            base_url=f"{api_base}/accounts/{account_id}/storage/kv/namespaces/{namespace_id}",
+            headers={"Authorization": f"Bearer {api_token}"},
+            timeout=30,
+        )
+        # Key -> value to write, or None to delete the key.
+        self._pending: Dict[str, str | None] = {}
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread: threading.Thread | None = None
+
     def put_user_type(self, user_id: str, user_type: UserType):
-        pass
+        self._write(user_id, user_type.value)
 
     def remote_user_type(self, user_id: str):
-        pass
+        self._write(user_id, None)
+
+    def get_user_type(self, user_id: str) -> UserType | None:
+        with self._cond:
+            if user_id in self._pending:
+                value = self._pending[user_id]
+                return UserType(value) if value is not None else None
+        if not self.enabled:
+            return None
+        response = self.http.get(f"/values/{user_id}")
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return UserType(response.text)
+
+    def flush(self):
+        """Sends all pending writes before returning."""
+        with self._cond:
+            batch, self._pending = self._pending, {}
+        if batch:
+            self._send(batch)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        with self._cond:
+            if self._pending:
+                logger.error(f"Dropping {len(self._pending)} KV writes that failed on close")
+        self.http.close()
+
+    def _write(self, key: str, value: str | None):
+        if not self.enabled:
+            return
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"KV write of {key} after the client was closed")
+            self._pending[key] = value
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="cloudflare-kv", daemon=True
+                )
+                self._thread.start()
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def _run(self):
+        retry_delay = 0.0
+        while True:
+            with self._cond:
+                if retry_delay:
+                    # A full batch doesn't cut the backoff short, only close does.
+                    self._cond.wait_for(lambda: self._closed, timeout=retry_delay)
+                else:
+                    self._cond.wait_for(
+                        lambda: self._closed or len(self._pending) >= self.batch_size,
+                        timeout=self.flush_interval,
+                    )
+                keys = list(self._pending)[: self.batch_size]
+                batch = {key: self._pending.pop(key) for key in keys}
+                closed = self._closed
+            if batch:
+                if self._send(batch):
+                    retry_delay = 0.0
+                else:
+                    retry_delay = min(max(retry_delay * 2, self.flush_interval), max_retry_delay)
+            if closed:
+                return
+
+    def _send(self, batch: Dict[str, str | None]) -> bool:
+        """Returns whether the batch was written, failed batches are pending again."""
+        puts = [{"key": k, "value": v} for k, v in batch.items() if v is not None]
+        deletes = [k for k, v in batch.items() if v is None]
+        try:
+            if puts:
+                self.http.put("/bulk", json=puts).raise_for_status()
+            if deletes:
+                self.http.post("/bulk/delete", json=deletes).raise_for_status()
+        except httpx.HTTPError as e:
+            logger.warning(f"Writing {len(batch)} keys to KV failed, retrying: {e}")
+            with self._cond:
+                # Keys written again in the meantime keep their newer value.
+                for key, value in batch.items():
+                    self._pending.setdefault(key, value)
+            return False
+        return True
+
+
+_client: CloudflareClient | None = None
 
 
 def get_cloudflare_client() -> CloudflareClient:
-    return CloudflareClient()
+    global _client
+    if _client is None:
+        _client = CloudflareClient()
+    return _client
@@ -0,0 +1,113 @@
+import zlib
+from typing import Callable, Tuple
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # The brotli extra is optional, responses fall back to gzip
+    brotli = None
+
+
+# Responses smaller than this are sent uncompressed.
+minimum_size = 1024
+gzip_level = 6
+# Brotli quality 4 compresses better than gzip 6 at about the same speed.
+brotli_quality = 4
+
+Compressor = Tuple[Callable[[bytes], bytes], Callable[[], bytes]]
+
+
+def negotiate(accept_encoding: str) -> str | None:
+    """Picks br or gzip from an Accept-Encoding header, preferring br."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for coding in ("br", "gzip"):
+        if coding == "br" and brotli is None:
+            continue
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+
+def compressor(encoding: str) -> Compressor:
+    """Returns functions that compress (and flush) a chunk and end the stream."""
+    if encoding == "br":
+        br = brotli.Compressor(quality=brotli_quality)
+        return (lambda chunk: br.process(chunk) + br.flush()), br.finish
+    gz = zlib.compressobj(gzip_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    return (lambda chunk: gz.compress(chunk) + gz.flush(zlib.Z_SYNC_FLUSH)), gz.flush
+
+
+class CompressionMiddleware:
+    """Compresses responses with brotli or gzip, depending on what the client accepts.
+
+    Streamed responses are compressed chunk by chunk, so the first bytes still
+    go out before the whole body is encoded.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Message | None = None
+        compress: Compressor | None = None
+        passthrough = False
+
+        async def send_compressed(message: Message):
+            nonlocal start_message, compress, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if compress is None:
+                assert start_message is not None
+                headers = MutableHeaders(raw=start_message["headers"])
+                if "content-encoding" in headers or (
+                    not more_body and len(body) < minimum_size
+                ):
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+                compress = compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if not more_body:
+                    body = compress[0](body) + compress[1]()
+                    headers["Content-Length"] = str(len(body))
+                    await send(start_message)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                del headers["Content-Length"]
+                await send(start_message)
+
+            chunk = compress[0](body) if body else b""
+            if not more_body:
+                chunk += compress[1]()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
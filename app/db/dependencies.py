@@ -2,10 +2,16 @@ import os
 import tempfile
 from app import settings
 import ssl
+from typing import Callable, TypeVar
+
+from sqlalchemy import Engine
 from sqlmodel import Session, create_engine
 from .models import SQLModel
+from .routing import ReadRouter
 from google.cloud.sql.connector import Connector, IPTypes
 
+T = TypeVar("T")
+
 
 def load_cert_chain_from_strings(cert_string, key_string, password=None):
     context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
@@ -31,8 +37,14 @@ def load_cert_chain_from_strings(cert_string, key_string, password=None):
     return context
 
 
-if settings.instance_connection_name is not None:
-    instance_connection_name = settings.instance_connection_name
+connector: Connector | None = None
+
+
+def cloud_sql_engine(instance_connection_name: str):
+    global connector
+    if connector is None:
+        connector = Connector()
+    cloud_sql = connector
     db_user = settings.db_user
     db_pass = settings.db_password
     db_name = settings.db_name
@@ -42,10 +54,9 @@ if settings.instance_connection_name is not None:
         )
 
     ip_type = IPTypes.PRIVATE if settings.db_private_ip else IPTypes.PUBLIC
-    connector = Connector()
 
     def getconn():
-        conn = connector.connect(
+        conn = cloud_sql.connect(
             instance_connection_name,
             "pg8000",
             user=db_user,
@@ -55,10 +66,28 @@ if settings.instance_connection_name is not None:
         )
         return conn
 
-    engine = create_engine("postgresql+pg8000://", creator=getconn)
+    return create_engine("postgresql+pg8000://", creator=getconn)
+
+
+if settings.instance_connection_name is not None:
+    engine = cloud_sql_engine(settings.instance_connection_name)
 else:
     engine = create_engine(settings.db_url)
 
+# Read-only, used for catalog reads while it keeps up with the primary.
+replica_engine = None
+if settings.replica_instance_connection_name is not None:
+    replica_engine = cloud_sql_engine(settings.replica_instance_connection_name)
+elif settings.replica_db_url is not None:
+    replica_engine = create_engine(settings.replica_db_url)
+
+read_router = ReadRouter(
+    engine,
+    replica_engine,
+    max_lag=settings.replica_max_lag_seconds,
+    check_interval=settings.replica_check_interval,
+)
+
 
 SQLModel.metadata.create_all(engine)
 
@@ -66,3 +95,13 @@ SQLModel.metadata.create_all(engine)
 def get_db_session():
     with Session(engine) as session:
         yield session
+
+
+def get_read_engine() -> Engine:
+    """Engine for catalog reads, the replica unless it's down or lagging."""
+    return read_router.engine()
+
+
+def read_catalog(fn: Callable[[Session], T], engine: Engine | None = None) -> T:
+    """Runs a catalog read, on the primary if it fails on the replica."""
+    return read_router.read(fn, engine)
@@ -1,9 +1,12 @@
+from datetime import datetime, timezone
 from enum import Enum
 from typing import Dict
 
 import sqlalchemy
 from sqlmodel import JSON, Column, Field, Relationship, SQLModel
 
+from app.db.search import TSVector, search_document
+
 
 class UserType(Enum):
     FREE = "free"
@@ -16,6 +19,86 @@ class User(SQLModel, table=True):
     user_type: UserType
 
 
+class WebhookStatus(Enum):
+    PENDING = "pending"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class WebhookEvent(SQLModel, table=True):
+    """A received webhook delivery, keyed by the provider's event id.
+
+    Retried deliveries of an event that is already stored are not processed again.
+    """
+
+    source: str = Field(primary_key=True)
+    id: str = Field(primary_key=True)
+    event_type: str
+    payload: Dict = Field(default_factory=dict, sa_column=Column(JSON))
+    status: WebhookStatus = Field(default=WebhookStatus.PENDING, index=True)
+    attempts: int = 0
+    last_error: str | None = None
+    received_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    processed_at: datetime | None = None
+
+
+class RateLimitBucket(SQLModel, table=True):
+    """Token bucket state shared between instances, see app.ratelimit."""
+
+    key: str = Field(primary_key=True)
+    tokens: float
+    # Unix timestamp of the last refill.
+    updated_at: float
+
+
+class CatalogVersion(SQLModel, table=True):
+    """Single row counter that the scrapers increment when they change the catalog.
+
+    GraphQL responses are tagged with it, see app.api.caching.
+    """
+
+    id: int = Field(default=1, primary_key=True)
+    version: int = 0
+    # Scrapers of the last change, e.g. "aws:bulk" or "gcp:catalog,gcp:machine-types".
+    source: str | None = None
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class PersistedQuery(SQLModel, table=True):
+    """GraphQL documents registered ahead of time, keyed by the sha256 of their text.
+
+    See scripts.persisted_queries. Documents registered by clients are only
+    kept in memory, see app.api.caching.
+    """
+
+    sha256_hash: str = Field(primary_key=True)
+    query: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class ProductFacet(SQLModel, table=True):
+    """Number of products per vendor, service, product family and region.
+
+    Recomputed for a vendor after its scrapers run, see app.catalog.
+    """
+
+    vendor_name: str = Field(primary_key=True)
+    service: str = Field(primary_key=True)
+    product_family: str = Field(primary_key=True)
+    # Empty for products without a region.
+    region: str = Field(primary_key=True)
+    products: int
+
+
+class AttributeFacet(SQLModel, table=True):
+    """Number of products of a vendor's service that have an attribute key."""
+
+    vendor_name: str = Field(primary_key=True)
+    service: str = Field(primary_key=True)
+    key: str = Field(primary_key=True)
+    products: int
+
+
 class Product(SQLModel, table=True):
     product_hash: str = Field(primary_key=True)
     sku: str
@@ -29,10 +112,23 @@ class Product(SQLModel, table=True):
         back_populates="product", sa_relationship_kwargs={"lazy": "joined"}
     )
 
-    __table_args__ = (sqlalchemy.Index("idx_service_region", "service", "region"),)
+    __table_args__ = (
+        sqlalchemy.Index("idx_service_region", "service", "region"),
+        # Maintained by the database and not mapped, so that merging a scraped
+        # product never writes it, see app.db.search.
+        Column(
+            "search_vector",
+            TSVector,
+            sqlalchemy.Computed(search_document(), persisted=True),
+        ),
+        sqlalchemy.Index(
+            "idx_product_search", "search_vector", postgresql_using="gin"
+        ).ddl_if(dialect="postgresql"),
+    )
+    __mapper_args__ = {"exclude_properties": ["search_vector"]}
 
 
-class Price(SQLModel, table=True):
+class PriceBase(SQLModel):
     price_hash: str = Field(primary_key=True)
     purchase_option: str
     unit: str
@@ -51,6 +147,49 @@ class Price(SQLModel, table=True):
     currency: str | None = None
     part_number: str | None = None
 
-    product_hash: str = Field(foreign_key="product.product_hash")
+
+class Price(PriceBase, table=True):
+    """Current price of a product, overwritten by every scraper run."""
+
+    product_hash: str = Field(foreign_key="product.product_hash", index=True)
+    # Same as the product's, so prices can be partitioned by vendor like
+    # products, see scripts.staging.
+    vendor_name: str | None = None
 
     product: Product = Relationship(back_populates="prices")
+
+
+class PriceVersion(PriceBase, table=True):
+    """A price as it was from valid_from until valid_to.
+
+    Append only: after a scraper run, the open versions of prices that changed
+    or were removed get a valid_to, and new and changed prices a new open
+    version, see app.catalog.record_price_changes. Unchanged prices aren't
+    written. Rows outlive their product, so product_hash isn't a foreign key.
+    """
+
+    valid_from: datetime = Field(
+        primary_key=True, sa_type=sqlalchemy.DateTime(timezone=True)
+    )
+    # Open while the price is current.
+    valid_to: datetime | None = Field(
+        default=None, sa_type=sqlalchemy.DateTime(timezone=True)
+    )
+    product_hash: str
+    vendor_name: str
+
+    __table_args__ = (
+        # Prices of products as of a time are a range scan: valid_from <= t
+        # within each product, valid_to is checked from the index.
+        sqlalchemy.Index(
+            "idx_price_version_product_range", "product_hash", "valid_from", "valid_to"
+        ),
+        # Current versions, which the next run compares the prices with.
+        sqlalchemy.Index(
+            "idx_price_version_current",
+            "vendor_name",
+            "price_hash",
+            postgresql_where=sqlalchemy.text("valid_to IS NULL"),
+            sqlite_where=sqlalchemy.text("valid_to IS NULL"),
+        ),
+    )
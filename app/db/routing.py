@@ -0,0 +1,116 @@
+"""Routing of catalog reads between the primary and a read replica.
+
+Writes (webhooks, rate limits, scrapers) always use the primary engine. Catalog
+reads use the replica while it's reachable and its replication lag is below
+REPLICA_MAX_LAG_SECONDS, which bulk loads on the primary can push it over.
+The replica is checked at most every REPLICA_CHECK_INTERVAL seconds, and
+a read that fails to reach it is retried on the primary, which then serves
+the reads until the replica passes a check again.
+"""
+
+import json
+import logging
+import threading
+import time
+from typing import Callable, TypeVar
+
+from sqlalchemy import Connection, Engine, text
+from sqlalchemy.exc import InterfaceError, OperationalError, SQLAlchemyError
+from sqlmodel import Session
+
+logger = logging.getLogger("app.db")
+
+T = TypeVar("T")
+
+# Seconds since the last replayed transaction, or 0 when all received WAL has
+# been replayed, since an idle primary doesn't mean the replica is behind.
+replica_lag_query = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery()
+            OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+    """
+)
+
+
+def replica_lag(conn: Connection) -> float:
+    if conn.dialect.name != "postgresql":
+        return 0.0
+    return float(conn.execute(replica_lag_query).scalar() or 0.0)
+
+
+class ReadRouter:
+    def __init__(
+        self,
+        primary: Engine,
+        replica: Engine | None,
+        max_lag: float,
+        check_interval: float,
+    ):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.use_replica = False
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def engine(self) -> Engine:
+        """The engine reads should use, checking the replica when it's due."""
+        if self.replica is None:
+            return self.primary
+        with self._lock:
+            due = time.monotonic() >= self._next_check
+            if due:
+                self._next_check = time.monotonic() + self.check_interval
+        if due:
+            self._update(self._check())
+        return self.replica if self.use_replica else self.primary
+
+    def read(self, fn: Callable[[Session], T], engine: Engine | None = None) -> T:
+        """Runs `fn` in a session of `engine`, by default engine(). If it fails
+        to reach the replica, the replica is marked unhealthy and `fn` runs
+        again on the primary.
+        """
+        engine = engine or self.engine()
+        try:
+            with Session(engine) as session:
+                return fn(session)
+        # Connection errors, pg8000 reports refused connections as InterfaceError.
+        except (OperationalError, InterfaceError) as e:
+            if self.replica is None or engine is not self.replica:
+                raise
+            self.replica_failed(e)
+        with Session(self.primary) as session:
+            return fn(session)
+
+    def replica_failed(self, error: Exception):
+        """Sends reads to the primary until the next check of the replica."""
+        with self._lock:
+            self._next_check = time.monotonic() + self.check_interval
+        self._update({"healthy": False, "error": str(error)})
+
+    def _check(self) -> dict:
+        assert self.replica is not None
+        try:
+            with self.replica.connect() as conn:
+                lag = replica_lag(conn)
+        except SQLAlchemyError as e:
+            return {"healthy": False, "error": str(e)}
+        return {"healthy": lag <= self.max_lag, "lag_seconds": round(lag, 3)}
+
+    def _update(self, status: dict):
+        if status["healthy"] == self.use_replica:
+            return
+        self.use_replica = status["healthy"]
+        logger.warning(
+            json.dumps(
+                {
+                    "event": "reads_to_replica" if self.use_replica else "reads_to_primary",
+                    "max_lag_seconds": self.max_lag,
+                    **status,
+                }
+            )
+        )
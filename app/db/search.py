@@ -0,0 +1,125 @@
+"""Full-text search over products.
+
+product.search_vector is a generated column, so the database maintains it on
+every insert and update, whichever way a scraper writes its rows. On Postgres
+it's a tsvector with a GIN index. Matches on the SKU rank above matches on the
+service and product family, and those above matches on the region and
+descriptive attributes. Other databases store the same text lowercased and
+match each term with LIKE, without ranking, which is enough for development.
+"""
+
+import re
+from typing import Any, Tuple
+
+from sqlalchemy import (
+    ColumnElement,
+    Text,
+    and_,
+    column,
+    func,
+    literal,
+    literal_column,
+    select,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, TSQUERY, TSVECTOR
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.types import TypeDecorator
+
+# No stemming or stop words, SKUs and machine types aren't English.
+search_config = "simple"
+
+# Attributes with descriptive text, as the scrapers name them.
+search_attributes = [
+    "description",
+    "machine_type",
+    "product_name",
+    "sku_name",
+    "meter_name",
+    "plan_display_name",
+    "flavor",
+]
+
+# Token types of the parts of hyphenated words like us-central1, which are
+# indexed as a whole too. Queries leave them out: they find the same products,
+# and the GIN index doesn't have to intersect the long lists of parts like
+# "us" or "n2".
+hyphenated_parts = ["hword_part", "hword_numpart", "hword_asciipart"]
+
+# Queries using "phrases", `or` or `-term` are parsed with websearch_to_tsquery.
+websearch_syntax = re.compile(r'"|(^|\s)(-|or(\s|$))', re.IGNORECASE)
+
+
+class TSVector(TypeDecorator):
+    """tsvector on Postgres, text elsewhere."""
+
+    impl = Text
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(TSVECTOR())
+        return dialect.type_descriptor(Text())
+
+
+class search_document(ColumnElement):
+    """Expression of the product.search_vector column."""
+
+    inherit_cache = True
+
+
+def _text(*expressions: str) -> str:
+    return " || ' ' || ".join(f"coalesce({e}, '')" for e in expressions)
+
+
+@compiles(search_document)
+def _compile_search_document(element, compiler, **kw):
+    attributes = [f"json_extract(attributes, '$.{key}')" for key in search_attributes]
+    return f"lower({_text('sku', 'service', 'product_family', 'region', *attributes)})"
+
+
+@compiles(search_document, "postgresql")
+def _compile_search_document_postgresql(element, compiler, **kw):
+    config = f"'{search_config}'::regconfig"
+    attributes = [f"attributes ->> '{key}'" for key in search_attributes]
+    weighted = [
+        (["sku"], "A"),
+        (["service", "product_family"], "B"),
+        (["region", *attributes], "C"),
+    ]
+    return " || ".join(
+        f"setweight(to_tsvector({config}, {_text(*columns)}), '{weight}')"
+        for columns, weight in weighted
+    )
+
+
+def search_tsquery(query: str) -> ColumnElement[Any]:
+    """tsquery of `query`, all its terms must match.
+
+    "quoted phrases", `or` and `-term` work like in web search engines.
+    """
+    config = literal_column(f"'{search_config}'::regconfig")
+    if websearch_syntax.search(query):
+        return func.websearch_to_tsquery(config, query)
+    token = (
+        func.ts_debug(config, query)
+        .table_valued(column("alias", Text), column("lexemes", ARRAY(Text)))
+        .alias("token")
+    )
+    # The simple dictionary makes one lexeme of every token but blanks.
+    lexeme = func.quote_literal(token.c.lexemes[1])
+    return (
+        select(func.string_agg(lexeme, " & ").cast(TSQUERY))
+        .where(token.c.alias.not_in(hyphenated_parts))
+        .scalar_subquery()
+    )
+
+
+def search_match(
+    search_vector: Any, query: str, dialect: str
+) -> Tuple[ColumnElement[bool], ColumnElement[float]]:
+    """Condition and rank of the products matching `query`."""
+    if dialect == "postgresql":
+        tsquery = search_tsquery(query)
+        return search_vector.op("@@")(tsquery), func.ts_rank(search_vector, tsquery)
+    terms = query.lower().split()
+    return and_(*[search_vector.contains(t, autoescape=True) for t in terms]), literal(0.0)
@@ -0,0 +1,86 @@
+"""In-process cache of user types.
+
+Entries expire after ENTITLEMENT_TTL_SECONDS. The webhook processors update
+the entry once their transaction commits, and write the change through to
+Cloudflare KV. Other instances see the change when their entry expires.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+from sqlalchemy import event
+from sqlmodel import Session
+
+from app import settings
+from app.cloudflare import CloudflareClient, get_cloudflare_client
+from app.db.models import User, UserType
+
+# Least recently used entries are dropped beyond this.
+max_entries = 100_000
+
+
+class EntitlementCache:
+    def __init__(
+        self,
+        cloudflare: CloudflareClient,
+        ttl: float = settings.entitlement_ttl_seconds,
+    ):
+        self.cloudflare = cloudflare
+        self.ttl = ttl
+        # User id -> (user type or None for unknown users, expiry).
+        self._entries: OrderedDict[str, Tuple[UserType | None, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, user_id: str) -> UserType | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                return entry[0]
+        user = db.get(User, user_id)
+        user_type = user.user_type if user else None
+        self._store(user_id, user_type)
+        return user_type
+
+    def set(self, user_id: str, user_type: UserType):
+        self._store(user_id, user_type)
+        self.cloudflare.put_user_type(user_id, user_type)
+
+    def remove(self, user_id: str):
+        self._store(user_id, None)
+        self.cloudflare.remote_user_type(user_id)
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def set_after_commit(self, db: Session, user_id: str, user_type: UserType | None):
+        """Sets (or removes, for None) the user type once db commits."""
+
+        def after_commit(session: Session):
+            if user_type is None:
+                self.remove(user_id)
+            else:
+                self.set(user_id, user_type)
+
+        event.listen(db, "after_commit", after_commit, once=True)
+
+    def _store(self, user_id: str, user_type: UserType | None):
+        with self._lock:
+            self._entries[user_id] = (user_type, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+
+
+_cache: EntitlementCache | None = None
+
+
+def get_entitlement_cache() -> EntitlementCache:
+    global _cache
+    if _cache is None:
+        _cache = EntitlementCache(get_cloudflare_client())
+    return _cache
@@ -0,0 +1,13 @@
+from .graphql import InstrumentationExtension, normalize
+from .metrics import RequestMetrics, current_metrics, instrument_engine, timed_serialization
+from .middleware import InstrumentationMiddleware
+
+__all__ = [
+    "InstrumentationExtension",
+    "InstrumentationMiddleware",
+    "RequestMetrics",
+    "current_metrics",
+    "instrument_engine",
+    "normalize",
+    "timed_serialization",
+]
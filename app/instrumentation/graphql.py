@@ -0,0 +1,52 @@
+import dataclasses
+import inspect
+import time
+from enum import Enum
+from typing import Any
+
+from strawberry.extensions import SchemaExtension
+
+from .metrics import _current_metrics
+
+# Fields below the top level that are timed on their own.
+timed_fields = {"prices"}
+
+
+def normalize(value: Any) -> Any:
+    """Turns GraphQL inputs into plain JSON values without the unset fields."""
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        value = {f.name: getattr(value, f.name) for f in dataclasses.fields(value)}
+    if isinstance(value, dict):
+        return {k: normalize(v) for k, v in sorted(value.items()) if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+class InstrumentationExtension(SchemaExtension):
+    """Records the time spent in top-level resolvers and in timed_fields."""
+
+    def resolve(self, _next, root, info, *args, **kwargs):
+        metrics = _current_metrics.get()
+        top_level = info.path.prev is None
+        if metrics is None or not (top_level or info.field_name in timed_fields):
+            return _next(root, info, *args, **kwargs)
+
+        if top_level:
+            metrics.fields.append({"field": info.field_name, "args": normalize(kwargs)})
+        start = time.perf_counter()
+        result = _next(root, info, *args, **kwargs)
+        if not inspect.isawaitable(result):
+            metrics.add_resolver(info.field_name, start, time.perf_counter())
+            return result
+
+        async def timed():
+            try:
+                return await result
+            finally:
+                metrics.add_resolver(info.field_name, start, time.perf_counter())
+
+        return timed()
+
@@ -0,0 +1,130 @@
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import settings
+
+logger = logging.getLogger("app.requests")
+
+
+@dataclass
+class RequestMetrics:
+    method: str
+    path: str
+    start: float = field(default_factory=time.perf_counter)
+    sql_count: int = 0
+    sql_seconds: float = 0.0
+    # Per field, from the first resolver call to the last resolver result.
+    # Async resolvers for list items run concurrently, so their durations
+    # can't be summed.
+    resolver_spans: Dict[str, List[float]] = field(default_factory=dict)
+    serialize_seconds: float = 0.0
+    # Normalized arguments of the top-level GraphQL fields.
+    fields: List[Dict[str, Any]] = field(default_factory=list)
+    slow_queries: List[Dict[str, Any]] = field(default_factory=list)
+    # Estimate of the GraphQL operation, see app.api.cost.
+    query_cost: Dict[str, Any] | None = None
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add_query(self, statement: str, seconds: float):
+        with self.lock:
+            self.sql_count += 1
+            self.sql_seconds += seconds
+        if seconds * 1000 >= settings.slow_query_ms:
+            query = {"statement": normalize_statement(statement), "ms": round(seconds * 1000, 1)}
+            with self.lock:
+                self.slow_queries.append(query)
+            logger.warning(
+                json.dumps({"event": "slow_query", "path": self.path, "fields": self.fields, **query})
+            )
+
+    def add_resolver(self, name: str, start: float, end: float):
+        with self.lock:
+            span = self.resolver_spans.setdefault(name, [start, end])
+            span[0], span[1] = min(span[0], start), max(span[1], end)
+
+    @property
+    def resolver_seconds(self) -> Dict[str, float]:
+        return {name: end - start for name, (start, end) in self.resolver_spans.items()}
+
+    def server_timing(self) -> str:
+        total = (time.perf_counter() - self.start) * 1000
+        entries = [f'sql;dur={self.sql_seconds * 1000:.1f};desc="{self.sql_count} queries"']
+        for name, seconds in self.resolver_seconds.items():
+            entries.append(f"resolve-{name};dur={seconds * 1000:.1f}")
+        if self.serialize_seconds:
+            entries.append(f"serialize;dur={self.serialize_seconds * 1000:.1f}")
+        entries.append(f"total;dur={total:.1f}")
+        return ", ".join(entries)
+
+    def log(self, status: int):
+        duration_ms = (time.perf_counter() - self.start) * 1000
+        slow = duration_ms >= settings.slow_request_ms
+        line: Dict[str, Any] = {
+            "event": "slow_request" if slow else "request",
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "duration_ms": round(duration_ms, 1),
+            "sql_count": self.sql_count,
+            "sql_ms": round(self.sql_seconds * 1000, 1),
+            "resolver_ms": {k: round(v * 1000, 1) for k, v in self.resolver_seconds.items()},
+            "serialize_ms": round(self.serialize_seconds * 1000, 1),
+        }
+        if self.fields:
+            line["fields"] = self.fields
+        if self.query_cost:
+            line["query_cost"] = self.query_cost
+        if slow and self.slow_queries:
+            line["slow_queries"] = self.slow_queries
+        logger.log(logging.WARNING if slow else logging.INFO, json.dumps(line, default=str))
+
+
+_current_metrics: ContextVar[RequestMetrics | None] = ContextVar(
+    "request_metrics", default=None
+)
+
+
+def current_metrics() -> RequestMetrics | None:
+    return _current_metrics.get()
+
+
+@contextmanager
+def timed_serialization() -> Iterator[None]:
+    """Counts the time spent in the block as serialization of the current response."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = _current_metrics.get()
+        if metrics is not None:
+            with metrics.lock:
+                metrics.serialize_seconds += time.perf_counter() - start
+
+
+def normalize_statement(statement: str) -> str:
+    return re.sub(r"\s+", " ", statement).strip()[:1000]
+
+
+def instrument_engine(engine: Engine):
+    """Attributes every statement run on the engine to the current request."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._request_query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        metrics = _current_metrics.get()
+        if metrics is None:
+            return
+        metrics.add_query(statement, time.perf_counter() - context._request_query_start)
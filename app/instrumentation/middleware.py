@@ -0,0 +1,34 @@
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .metrics import RequestMetrics, _current_metrics
+
+
+class InstrumentationMiddleware:
+    """Adds a Server-Timing header and logs a line with the metrics of each request."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = RequestMetrics(method=scope["method"], path=scope["path"])
+        token = _current_metrics.set(metrics)
+        status = 500
+
+        async def send_with_timing(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", metrics.server_timing())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_metrics.reset(token)
+            metrics.log(status)
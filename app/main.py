@@ -1,11 +1,40 @@
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import Depends, FastAPI
 from sqlmodel import Session
 
+from app import settings
 from app.api import routers
-from app.db.dependencies import get_db_session
+from app.api.caching import ConditionalGraphQLMiddleware
+from app.cloudflare import get_cloudflare_client
+from app.compression import CompressionMiddleware
+from app.db.dependencies import engine, get_db_session, replica_engine
+from app.instrumentation import InstrumentationMiddleware, instrument_engine
+from app.webhooks import get_webhook_queue
+
+
+logging.basicConfig(level=settings.log_level, format="%(levelname)s %(name)s %(message)s")
+instrument_engine(engine)
+if replica_engine is not None:
+    instrument_engine(replica_engine)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    queue = get_webhook_queue()
+    await queue.start()
+    yield
+    await queue.stop()
+    # Sends the KV writes that are still buffered.
+    get_cloudflare_client().close()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(ConditionalGraphQLMiddleware, paths=["/v1/products/graphql"])
+app.add_middleware(CompressionMiddleware)
+# Added last so its timings include compression.
+app.add_middleware(InstrumentationMiddleware)
 app.include_router(routers.v1_router)
 
 
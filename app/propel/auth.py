@@ -1,5 +1,146 @@
-from propelauth_fastapi import init_auth
+"""Propel access token verification without a network call per request.
+
+The verifier key is fetched on first use and cached. When a token fails
+verification the key is fetched again, at most once per key_refresh_interval,
+in case Propel rotated it. Validated tokens are kept in an LRU until they
+expire, so repeated requests with the same token skip the signature check.
+Tokens are checked and mapped to users by propelauth_py. Requests with a
+token get a 503 while the key can't be fetched.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Tuple
+
+import httpx
+import jwt
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from propelauth_py import (
+    TokenVerificationMetadata,
+    UnauthorizedException,
+    User,
+    wrap_validate_access_token_and_get_user,
+)
 
 from app import settings
 
-auth = init_auth(settings.propel_auth_url, settings.propel_auth_api_key)
+logger = logging.getLogger("app.propel")
+
+# Seconds between two fetches of the verifier key.
+key_refresh_interval = 60.0
+max_cached_tokens = 10_000
+
+_security = HTTPBearer(auto_error=False)
+
+
+class KeyUnavailableError(Exception):
+    pass
+
+
+class VerifierKey:
+    def __init__(self, auth_url: str, api_key: str):
+        self.auth_url = auth_url
+        self.api_key = api_key
+        # Checks a token against the current key and returns its user.
+        self._validate: Callable[[str], User] | None = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def validate(self, token: str) -> User:
+        if self._validate is None:
+            self.refresh()
+        assert self._validate is not None
+        return self._validate(f"Bearer {token}")
+
+    def refresh(self) -> bool:
+        """Fetches the key unless it was fetched recently, returns whether it did."""
+        with self._lock:
+            if (
+                self._validate is not None
+                and time.monotonic() - self._fetched_at < key_refresh_interval
+            ):
+                return False
+            try:
+                response = httpx.get(
+                    f"{self.auth_url}/api/v1/token_verification_metadata",
+                    headers={"Authorization": f"Bearer {self.api_key}"},
+                    timeout=10,
+                )
+                response.raise_for_status()
+                pem = response.json()["verifier_key_pem"]
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                raise KeyUnavailableError(f"Fetching the propel verifier key failed: {e}")
+            self._validate = wrap_validate_access_token_and_get_user(
+                TokenVerificationMetadata(verifier_key=pem, issuer=self.auth_url)
+            )
+            self._fetched_at = time.monotonic()
+            logger.info("Fetched propel verifier key")
+            return True
+
+
+class LocalAuth:
+    def __init__(self, auth_url: str, api_key: str):
+        self.key = VerifierKey(auth_url, api_key)
+        # sha256 of the token -> (user, expiry as a unix timestamp).
+        self._tokens: OrderedDict[bytes, Tuple[User, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def validate(self, token: str) -> User:
+        token_hash = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            cached = self._tokens.get(token_hash)
+            if cached is not None:
+                if cached[1] > time.time():
+                    self._tokens.move_to_end(token_hash)
+                    return cached[0]
+                del self._tokens[token_hash]
+
+        try:
+            user = self.key.validate(token)
+        except UnauthorizedException:
+            # Possibly signed with a key we don't know yet, Propel may have
+            # rotated it.
+            if not self.key.refresh():
+                raise
+            user = self.key.validate(token)
+        # The signature and expiry were checked above.
+        expires_at = jwt.decode(token, options={"verify_signature": False})["exp"]
+        with self._lock:
+            self._tokens[token_hash] = (user, expires_at)
+            while len(self._tokens) > max_cached_tokens:
+                self._tokens.popitem(last=False)
+        return user
+
+    def require_user(
+        self, credentials: HTTPAuthorizationCredentials | None = Depends(_security)
+    ) -> User:
+        if credentials is None or credentials.scheme.lower() != "bearer":
+            raise HTTPException(status_code=401)
+        try:
+            return self.validate(credentials.credentials)
+        except UnauthorizedException:
+            raise HTTPException(status_code=401)
+        except KeyUnavailableError as e:
+            logger.error(str(e))
+            raise HTTPException(status_code=503, detail="Authentication is unavailable")
+
+    def optional_user(
+        self, credentials: HTTPAuthorizationCredentials | None = Depends(_security)
+    ) -> User | None:
+        if credentials is None:
+            return None
+        try:
+            return self.validate(credentials.credentials)
+        except UnauthorizedException:
+            return None
+        except KeyUnavailableError as e:
+            # Not treated as anonymous, the client would get lower limits.
+            logger.error(str(e))
+            raise HTTPException(status_code=503, detail="Authentication is unavailable")
+
+
+auth = LocalAuth(settings.propel_auth_url, settings.propel_auth_api_key)
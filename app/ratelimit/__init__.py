@@ -0,0 +1,11 @@
+from .buckets import Budget, RateLimiter, Tier, get_rate_limiter, tiers
+from .graphql import RateLimitExtension
+
+__all__ = [
+    "Budget",
+    "RateLimitExtension",
+    "RateLimiter",
+    "Tier",
+    "get_rate_limiter",
+    "tiers",
+]
@@ -0,0 +1,194 @@
+"""Token buckets per user and per tier.
+
+A request is charged its estimated cost against two buckets: the user's own,
+sized by their tier, and one shared by all users of the tier, so a burst of
+FREE traffic can't use up the capacity PRO users rely on. The request is only
+allowed if both buckets have enough tokens, and then both are charged.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Protocol, Tuple
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, col, select
+
+from app import settings
+from app.db.dependencies import engine
+from app.db.models import RateLimitBucket, UserType
+
+
+@dataclass(frozen=True)
+class Tier:
+    name: str
+    # Tokens a user can spend at once, and tokens added back per second.
+    capacity: float
+    refill_per_second: float
+    # Same, for all users of the tier together.
+    shared_capacity: float
+    shared_refill_per_second: float
+
+
+# Anonymous clients are keyed by IP address.
+tiers: Dict[UserType | None, Tier] = {
+    None: Tier("anonymous", 50, 0.5, 2_000, 20),
+    UserType.FREE: Tier("free", 300, 2, 20_000, 200),
+    UserType.PRO: Tier("pro", 3_000, 20, 200_000, 2_000),
+}
+
+
+@dataclass
+class Budget:
+    allowed: bool
+    cost: float
+    capacity: float
+    # Tokens left in the user's bucket after this request.
+    remaining: float
+    # Seconds until the request would be allowed, 0 if it was.
+    retry_after: float
+    # Seconds until the user's bucket is full again.
+    reset_after: float
+
+
+# (key, capacity, refill per second) of each bucket a request is charged against.
+BucketSpec = Tuple[str, float, float]
+
+
+def refill(tokens: float, updated_at: float, capacity: float, rate: float, now: float) -> float:
+    return min(capacity, tokens + (now - updated_at) * rate)
+
+
+def charge_buckets(
+    state: Dict[str, Tuple[float, float]], buckets: List[BucketSpec], cost: float, now: float
+) -> Tuple[Budget, Dict[str, float]]:
+    """Returns the budget of the first bucket and the new token counts."""
+    levels = {}
+    retry_after = 0.0
+    for key, capacity, rate in buckets:
+        tokens, updated_at = state.get(key, (capacity, now))
+        levels[key] = refill(tokens, updated_at, capacity, rate, now)
+        if levels[key] < cost:
+            # Costs are capped at the user's capacity, see query_cost_budget. Report
+            # the time to a full bucket for any that isn't.
+            missing = min(cost, capacity) - levels[key]
+            retry_after = max(retry_after, missing / rate)
+    allowed = retry_after == 0.0
+    if allowed:
+        levels = {key: tokens - cost for key, tokens in levels.items()}
+    key, capacity, rate = buckets[0]
+    budget = Budget(
+        allowed=allowed,
+        cost=cost,
+        capacity=capacity,
+        remaining=max(levels[key], 0.0),
+        retry_after=retry_after,
+        reset_after=(capacity - levels[key]) / rate,
+    )
+    return budget, levels
+
+
+class Backend(Protocol):
+    # Whether charge does I/O and should run outside the event loop.
+    blocking: bool
+
+    def charge(self, buckets: List[BucketSpec], cost: float) -> Budget: ...
+
+
+class MemoryBackend:
+    blocking = False
+
+    def __init__(self):
+        self._state: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def charge(self, buckets: List[BucketSpec], cost: float) -> Budget:
+        now = time.time()
+        with self._lock:
+            budget, levels = charge_buckets(self._state, buckets, cost, now)
+            for key, tokens in levels.items():
+                self._state[key] = (tokens, now)
+            if len(self._state) > 100_000:
+                self._prune(now)
+        return budget
+
+    def _prune(self, now: float):
+        # Buckets idle for an hour are full again for every tier.
+        self._state = {k: v for k, v in self._state.items() if now - v[1] < 3600}
+
+
+class DatabaseBackend:
+    """Keeps the buckets in the rate-limit table so all instances share them.
+
+    The rows of a request are locked while they're updated (FOR UPDATE on
+    Postgres; SQLite serializes writers), so concurrent requests can't both
+    spend the same tokens.
+    """
+
+    blocking = True
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def charge(self, buckets: List[BucketSpec], cost: float) -> Budget:
+        try:
+            return self._charge(buckets, cost)
+        except IntegrityError:
+            # Another instance created one of the buckets first.
+            return self._charge(buckets, cost)
+
+    def _charge(self, buckets: List[BucketSpec], cost: float) -> Budget:
+        now = time.time()
+        keys = [key for key, _, _ in buckets]
+        with Session(self.engine) as db:
+            rows = {
+                row.key: row
+                for row in db.exec(
+                    select(RateLimitBucket)
+                    .where(col(RateLimitBucket.key).in_(keys))
+                    .with_for_update()
+                )
+            }
+            state = {key: (row.tokens, row.updated_at) for key, row in rows.items()}
+            budget, levels = charge_buckets(state, buckets, cost, now)
+            for key, tokens in levels.items():
+                row = rows.get(key) or RateLimitBucket(key=key, tokens=tokens, updated_at=now)
+                row.tokens, row.updated_at = tokens, now
+                db.add(row)
+            db.commit()
+        return budget
+
+
+def query_cost_budget(user_type: UserType | None) -> float:
+    """QUERY_COST_BUDGET, capped at the bucket capacity of the user's tier so
+    that operations within budget can be paid once the bucket refills.
+    """
+    return min(settings.query_cost_budget, tiers[user_type].capacity)
+
+
+class RateLimiter:
+    def __init__(self, backend: Backend):
+        self.backend = backend
+
+    def charge(self, identity: str, user_type: UserType | None, cost: float) -> Budget:
+        tier = tiers[user_type]
+        return self.backend.charge(
+            [
+                (f"user:{identity}", tier.capacity, tier.refill_per_second),
+                (f"tier:{tier.name}", tier.shared_capacity, tier.shared_refill_per_second),
+            ],
+            cost,
+        )
+
+
+_limiter: RateLimiter | None = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    global _limiter
+    if _limiter is None:
+        if settings.rate_limit_backend == "db":
+            _limiter = RateLimiter(DatabaseBackend(engine))
+        else:
+            _limiter = RateLimiter(MemoryBackend())
+    return _limiter
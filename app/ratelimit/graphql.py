@@ -0,0 +1,88 @@
+import math
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from graphql import GraphQLError
+from strawberry.extensions import SchemaExtension
+from strawberry.types import ExecutionResult
+
+from app import settings
+from app.api.cost import estimate_cost
+from .buckets import Budget, get_rate_limiter
+
+
+def client_ip(request: Request, hops: int | None = None) -> str:
+    # Entries before the ones the trusted proxies appended come from the
+    # client, which can send any X-Forwarded-For.
+    hops = settings.trusted_proxy_hops if hops is None else hops
+    forwarded = [a.strip() for a in request.headers.get("x-forwarded-for", "").split(",")]
+    if hops > 0 and forwarded[0]:
+        return forwarded[-min(hops, len(forwarded))]
+    return request.client.host if request.client else "unknown"
+
+
+def budget_headers(budget: Budget) -> dict[str, str]:
+    headers = {
+        "RateLimit-Limit": str(int(budget.capacity)),
+        "RateLimit-Remaining": str(int(budget.remaining)),
+        "RateLimit-Reset": str(math.ceil(budget.reset_after)),
+        "X-Query-Cost": f"{budget.cost:g}",
+    }
+    if not budget.allowed:
+        headers["Retry-After"] = str(math.ceil(budget.retry_after))
+    return headers
+
+
+class RateLimitExtension(SchemaExtension):
+    """Charges each validated operation its estimated cost before executing it.
+
+    Expects the context to have the user and their user_type (None for
+    anonymous clients). Operations over budget fail with a 429 without being
+    executed. Does nothing with RATE_LIMIT_BACKEND set to "off".
+    """
+
+    async def on_execute(self):
+        await self.charge()
+        yield
+
+    async def charge(self):
+        execution_context = self.execution_context
+        if execution_context.result is not None or settings.rate_limit_backend == "off":
+            # Already rejected by an earlier extension, or not rate limited.
+            return
+        context = execution_context.context
+        cost = context.get("query_cost")
+        if cost is None:
+            assert execution_context.graphql_document
+            cost = estimate_cost(
+                execution_context.graphql_document,
+                execution_context.operation_name,
+                execution_context.variables,
+            ).total
+            context["query_cost"] = cost
+
+        user = context.get("user")
+        identity = user.user_id if user else client_ip(context["request"])
+        limiter = get_rate_limiter()
+        if limiter.backend.blocking:
+            budget = await run_in_threadpool(
+                limiter.charge, identity, context.get("user_type"), cost
+            )
+        else:
+            budget = limiter.charge(identity, context.get("user_type"), cost)
+
+        response = context["response"]
+        response.headers.update(budget_headers(budget))
+        if not budget.allowed:
+            response.status_code = 429
+            # With a result set, strawberry skips executing the operation.
+            execution_context.result = ExecutionResult(
+                data=None,
+                errors=[
+                    GraphQLError(
+                        f"Rate limit exceeded, query cost {cost:g} is over the remaining "
+                        f"budget of {budget.remaining:.0f}, retry in {math.ceil(budget.retry_after)}s",
+                        extensions={"code": "RATE_LIMITED"},
+                    )
+                ],
+            )
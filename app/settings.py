@@ -12,12 +12,45 @@ class Settings:
     )
     propel_auth_api_key: str = os.environ["PROPEL_AUTH_API_KEY"]
     cloudflare_api_token: str = os.environ["CLOUDFLARE_API_TOKEN"]
+    # Can be pointed at scripts/fake_kv.py for local testing.
+    cloudflare_api_base: str = os.environ.get(
+        "CLOUDFLARE_API_BASE", "https://api.cloudflare.com/client/v4"
+    )
+    cloudflare_account_id = os.environ.get("CLOUDFLARE_ACCOUNT_ID")
+    cloudflare_kv_namespace_id = os.environ.get("CLOUDFLARE_KV_NAMESPACE_ID")
+    cloudflare_kv_flush_interval = float(os.environ.get("CLOUDFLARE_KV_FLUSH_INTERVAL", 1.0))
+    # The bulk endpoints accept up to 10,000 keys.
+    cloudflare_kv_batch_size = int(os.environ.get("CLOUDFLARE_KV_BATCH_SIZE", 1000))
+    # Estimated cost above which queries are rejected, or with "clamp" run
+    # with fewer products per field.
+    query_cost_budget = float(os.environ.get("QUERY_COST_BUDGET", 200))
+    query_cost_mode = os.environ.get("QUERY_COST_MODE", "reject")
+    # Products fields of one GraphQL request that query the database at the
+    # same time, each on its own pooled connection.
+    graphql_field_concurrency = int(os.environ.get("GRAPHQL_FIELD_CONCURRENCY", 4))
+    # How long an instance serves the catalog version it last read. Responses
+    # can be this much out of date after a scrape finishes.
+    catalog_version_ttl_seconds = float(os.environ.get("CATALOG_VERSION_TTL_SECONDS", 5))
+    # max-age of GraphQL queries sent with GET, which CDNs can cache.
+    graphql_cache_max_age = int(os.environ.get("GRAPHQL_CACHE_MAX_AGE", 60))
+    # "memory" keeps buckets per instance, "db" shares them through the database,
+    # "off" disables rate limiting, e.g. for benchmarks.
+    rate_limit_backend = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+    # Proxies in front of the API that append the address they received a
+    # request from to X-Forwarded-For, 1 for Cloud Run. Anonymous clients are
+    # rate limited by the address the outermost of them saw.
+    trusted_proxy_hops = int(os.environ.get("TRUSTED_PROXY_HOPS", 1))
+    entitlement_ttl_seconds = float(os.environ.get("ENTITLEMENT_TTL_SECONDS", 300))
     stripe_api_key: str = os.environ["STRIPE_API_KEY"]
     stripe_product_id: str = os.environ["STRIPE_PRODUCT_ID"]
     stripe_price_id: str = os.environ["STRIPE_PRICE_ID"]
     # TODO: need to figure out something for this
     stripe_redirect_url: str = "http://localhost:8000"
     stripe_webhook_signing_secret: str = os.environ["STRIPE_WEBHOOK_SIGNING_SECRET"]
+    # Can be pointed at stripe-mock for local testing.
+    stripe_api_base: str = os.environ.get("STRIPE_API_BASE", "https://api.stripe.com")
+    webhook_workers = int(os.environ.get("WEBHOOK_WORKERS", 4))
+    webhook_max_attempts = int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", 5))
     instance_connection_name = os.environ.get("INSTANCE_CONNECTION_NAME")
     db_password = os.environ.get("DB_PASSWORD")
     db_user = os.environ.get("DB_USER")
@@ -26,6 +59,16 @@ class Settings:
     db_cert = os.environ.get("DB_CERT")
     db_key = os.environ.get("DB_KEY")
     db_private_ip = os.environ.get("DB_PRIVATE_IP", False)
+    # Optional read replica for catalog reads, a Cloud SQL instance or a URL.
+    replica_instance_connection_name = os.environ.get("REPLICA_INSTANCE_CONNECTION_NAME")
+    replica_db_url = os.environ.get("REPLICA_DB_URL")
+    # Reads go back to the primary while the replica is further behind than this.
+    replica_max_lag_seconds = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", 30))
+    replica_check_interval = float(os.environ.get("REPLICA_CHECK_INTERVAL", 10))
+    log_level = os.environ.get("LOG_LEVEL", "INFO")
+    # Requests and SQL statements slower than these are logged as warnings.
+    slow_request_ms = float(os.environ.get("SLOW_REQUEST_MS", 1000))
+    slow_query_ms = float(os.environ.get("SLOW_QUERY_MS", 250))
 
 
 settings = Settings()
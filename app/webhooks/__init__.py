@@ -0,0 +1,10 @@
+from .processors import WebhookServices, processors
+from .queue import WebhookQueue, get_webhook_queue, record_event
+
+__all__ = [
+    "WebhookQueue",
+    "WebhookServices",
+    "get_webhook_queue",
+    "processors",
+    "record_event",
+]
@@ -0,0 +1,104 @@
+"""Processing of stored webhook events.
+
+Processors run in a worker thread with a session whose transaction also marks
+the event as done, so the database changes of an event are applied once.
+"""
+
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict
+
+import stripe
+from sqlmodel import Session, select
+
+from app import settings
+from app.db.models import User, UserType
+from app.entitlements import EntitlementCache, get_entitlement_cache
+
+logger = logging.getLogger("app.webhooks")
+
+
+class PermanentWebhookError(Exception):
+    """Raised for events that will fail the same way if retried."""
+
+
+def retrieve_subscription(subscription_id: str) -> Dict[str, Any]:
+    return stripe.Subscription.retrieve(subscription_id)
+
+
+@dataclass
+class WebhookServices:
+    """External services used while processing, replaced by stand-ins locally."""
+
+    retrieve_subscription: Callable[[str], Dict[str, Any]] = retrieve_subscription
+    entitlements: EntitlementCache = field(default_factory=get_entitlement_cache)
+
+
+def has_pro_price(subscription: Dict[str, Any]) -> bool:
+    return any(
+        line_item["price"]["id"] == settings.stripe_price_id
+        for line_item in subscription["items"]["data"]
+    )
+
+
+def process_stripe_event(
+    event: Dict[str, Any], db: Session, services: WebhookServices
+):
+    event_type = event["type"]
+    if event_type == "checkout.session.completed":
+        # The customer completed signing up for a subscription
+        session = event["data"]["object"]
+        user_id = session["client_reference_id"]
+        user = db.get(User, user_id)
+        if user is None:
+            # The propel user.created event may not have been processed yet.
+            raise ValueError(f"User not found: {user_id}")
+        subscription = services.retrieve_subscription(session["subscription"])
+        if has_pro_price(subscription):
+            user.user_type = UserType.PRO
+            user.stripe_customer_id = subscription["customer"]
+            db.add(user)
+            services.entitlements.set_after_commit(db, user.id, UserType.PRO)
+    elif event_type == "customer.subscription.deleted":
+        # The customer canceled their subscription
+        subscription = event["data"]["object"]
+        customer = subscription["customer"]
+        user = db.exec(select(User).where(User.stripe_customer_id == customer)).first()
+        if user is None:
+            raise PermanentWebhookError(f"User not found for stripe customer: {customer}")
+        if has_pro_price(subscription):
+            user.user_type = UserType.FREE
+            db.add(user)
+            services.entitlements.set_after_commit(db, user.id, UserType.FREE)
+    elif event_type == "invoice.payment_failed":
+        customer = event["data"]["object"].get("customer")
+        logger.warning(f"Payment failed for customer: {customer}")
+
+
+def process_propel_event(
+    event: Dict[str, Any], db: Session, services: WebhookServices
+):
+    event_type = event["event_type"]
+    if event_type == "user.created":
+        if db.get(User, event["user_id"]) is None:
+            db.add(
+                User(
+                    id=event["user_id"],
+                    stripe_customer_id=None,
+                    user_type=UserType.FREE,
+                )
+            )
+        services.entitlements.set_after_commit(db, event["user_id"], UserType.FREE)
+    elif event_type == "user.deleted":
+        user = db.get(User, event["user_id"])
+        if user:
+            db.delete(user)
+        services.entitlements.set_after_commit(db, event["user_id"], None)
+
+
+Processor = Callable[[Dict[str, Any], Session, WebhookServices], None]
+
+processors: Dict[str, Processor] = {
+    "stripe": process_stripe_event,
+    "propel": process_propel_event,
+}
@@ -0,0 +1,181 @@
+"""Background queue for webhook events.
+
+Handlers store each event and acknowledge it right away; the event id is the
+primary key, so a retried delivery is not stored twice. Workers then process
+events with retries and exponential backoff. Events still pending when the
+process stops are picked up again on the next start.
+
+An event is only processed by one worker at a time, even when a duplicate
+delivery queues it again: workers skip events another worker of the process
+is on, and the event's row stays locked while it's processed, which workers
+of other instances skip on Postgres.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Tuple
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from app import settings
+from app.db.dependencies import engine
+from app.db.models import WebhookEvent, WebhookStatus
+from .processors import PermanentWebhookError, Processor, WebhookServices, processors
+
+logger = logging.getLogger("app.webhooks")
+
+# Seconds before the first retry, doubled for every further attempt.
+retry_delay = 1.0
+
+
+def record_event(
+    db: Session, source: str, event_id: str, event_type: str, payload: Dict[str, Any]
+) -> bool:
+    """Stores the event and returns whether it still needs processing."""
+    db.add(
+        WebhookEvent(source=source, id=event_id, event_type=event_type, payload=payload)
+    )
+    try:
+        db.commit()
+        return True
+    except IntegrityError:
+        db.rollback()
+    existing = db.get(WebhookEvent, (source, event_id))
+    # A pending duplicate is queued again in case the earlier enqueue was lost.
+    return existing is not None and existing.status == WebhookStatus.PENDING
+
+
+class WebhookQueue:
+    def __init__(
+        self,
+        engine: Engine = engine,
+        services: WebhookServices | None = None,
+        processors: Dict[str, Processor] = processors,
+        workers: int = settings.webhook_workers,
+        max_attempts: int = settings.webhook_max_attempts,
+    ):
+        self.engine = engine
+        self.services = services or WebhookServices()
+        self.processors = processors
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.queue: asyncio.Queue[Tuple[str, str]] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._retries: set[asyncio.TimerHandle] = set()
+        self._in_flight: set[Tuple[str, str]] = set()
+
+    def enqueue(self, source: str, event_id: str):
+        self.queue.put_nowait((source, event_id))
+
+    async def start(self):
+        pending = await asyncio.to_thread(self._pending_events)
+        for key in pending:
+            self.enqueue(*key)
+        if pending:
+            logger.info(f"Resuming {len(pending)} pending webhook events")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for handle in self._retries:
+            handle.cancel()
+        self._retries.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def join(self):
+        """Waits until every queued event, including scheduled retries, is processed."""
+        while True:
+            await self.queue.join()
+            if not self._retries:
+                return
+            await asyncio.sleep(0.05)
+
+    def _pending_events(self) -> list[Tuple[str, str]]:
+        with Session(self.engine) as db:
+            stmt = select(WebhookEvent.source, WebhookEvent.id).where(
+                WebhookEvent.status == WebhookStatus.PENDING
+            )
+            return [(source, event_id) for source, event_id in db.exec(stmt)]
+
+    async def _worker(self):
+        while True:
+            source, event_id = await self.queue.get()
+            key = (source, event_id)
+            if key in self._in_flight:
+                # The worker on it retries it if it fails.
+                self.queue.task_done()
+                continue
+            self._in_flight.add(key)
+            try:
+                attempts = await asyncio.to_thread(self._process, source, event_id)
+                if attempts is not None:
+                    self._schedule_retry(source, event_id, retry_delay * 2 ** (attempts - 1))
+            except Exception:
+                logger.exception(f"Could not process {source} event {event_id}")
+            finally:
+                self._in_flight.discard(key)
+                self.queue.task_done()
+
+    def _schedule_retry(self, source: str, event_id: str, delay: float):
+        def retry():
+            self._retries.discard(handle)
+            self.enqueue(source, event_id)
+
+        handle = asyncio.get_running_loop().call_later(delay, retry)
+        self._retries.add(handle)
+
+    def _process(self, source: str, event_id: str) -> int | None:
+        """Processes the event and returns the attempt count if it should be retried."""
+        with Session(self.engine) as db:
+            # Locked until the commit, None while another instance processes it.
+            event = db.exec(
+                select(WebhookEvent)
+                .where(WebhookEvent.source == source, WebhookEvent.id == event_id)
+                .with_for_update(skip_locked=True)
+            ).first()
+            if event is None or event.status != WebhookStatus.PENDING:
+                return None
+            try:
+                self.processors[source](event.payload, db, self.services)
+                event.status = WebhookStatus.DONE
+                event.attempts += 1
+                event.processed_at = datetime.now(timezone.utc)
+                event.last_error = None
+                db.add(event)
+                db.commit()
+                return None
+            except Exception as e:
+                db.rollback()
+                error = e
+
+        with Session(self.engine) as db:
+            event = db.get(WebhookEvent, (source, event_id))
+            if event is None:
+                return None
+            event.attempts += 1
+            event.last_error = str(error)
+            permanent = isinstance(error, PermanentWebhookError)
+            if permanent or event.attempts >= self.max_attempts:
+                event.status = WebhookStatus.FAILED
+            db.add(event)
+            db.commit()
+            logger.warning(
+                f"{source} event {event_id} ({event.event_type}) failed on attempt "
+                f"{event.attempts}: {error}"
+            )
+            return None if event.status == WebhookStatus.FAILED else event.attempts
+
+
+_queue: WebhookQueue | None = None
+
+
+def get_webhook_queue() -> WebhookQueue:
+    global _queue
+    if _queue is None:
+        _queue = WebhookQueue()
+    return _queue
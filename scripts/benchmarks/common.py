@@ -0,0 +1,54 @@
+import json
+import os
+import statistics
+from typing import Any, Dict, List
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    if len(samples) < 2:
+        value = samples[0] if samples else 0.0
+        return {"p50": value, "p95": value, "p99": value}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"p50": cuts[49], "p95": cuts[94], "p99": cuts[98]}
+
+
+def load_baseline(path: str) -> Dict[str, Any] | None:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(path: str, results: Dict[str, Any]):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {path}")
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    metrics: List[str],
+    threshold: float,
+    higher_is_better: List[str] | None = None,
+) -> List[str]:
+    """Returns a line per metric that got worse than the baseline by more than threshold (e.g. 0.2 for 20%)."""
+    higher_is_better = higher_is_better or []
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in metrics:
+            before, after = previous.get(metric), current.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if metric in higher_is_better:
+                change = -change
+            if change > threshold:
+                regressions.append(
+                    f"{name} {metric}: {before:.4g} -> {after:.4g} ({change:+.0%} worse)"
+                )
+    return regressions
@@ -0,0 +1,241 @@
+"""Ingestion throughput benchmark for the gcp:catalog loader.
+
+    python -m scripts.benchmarks.ingestion generate --sizes 1000,10000,100000
+    python -m scripts.benchmarks.ingestion run --db-url postgresql+pg8000://...
+
+`generate` writes synthetic files in the shape download_service produces.
+`run` times parsing, hashing, building ORM objects and writing separately, then
+the whole pipeline, and reports rows/sec and peak memory for each phase.
+"""
+
+import asyncio
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from glob import glob
+from typing import Any, Callable, Dict, List, Tuple
+
+import typer
+
+from .common import compare, load_baseline, save_results
+
+app = typer.Typer()
+
+default_output_dir = "data/bench"
+default_baseline = "scripts/benchmarks/baselines/ingestion.json"
+
+gcp_regions = [
+    "us-central1", "us-east1", "us-east4", "us-west1", "us-west2", "us-west4",
+    "europe-west1", "europe-west2", "europe-west3", "europe-west4", "europe-north1",
+    "asia-east1", "asia-east2", "asia-northeast1", "asia-south1", "asia-southeast1",
+    "australia-southeast1", "northamerica-northeast1", "southamerica-east1",
+]
+services = {
+    "Compute Engine": ["Compute", "Storage", "Network", "License"],
+    "Cloud SQL": ["ApplicationServices", "Storage", "Network"],
+    "Cloud Storage": ["Storage", "Network"],
+    "Kubernetes Engine": ["Compute", "ApplicationServices"],
+    "BigQuery": ["ApplicationServices", "Storage"],
+}
+resource_groups = ["CPU", "RAM", "GPU", "SSD", "PDStandard", "N1Standard", "Egress"]
+usage_types = ["OnDemand", "Preemptible", "Commit1Yr", "Commit3Yr"]
+usage_units = ["hour", "gibibyte month", "gibibyte", "count"]
+
+
+def synthetic_sku(rng: random.Random, i: int) -> Dict[str, Any]:
+    service = rng.choice(list(services))
+    # Most SKUs are regional, some are global or span many regions.
+    regions = rng.sample(gcp_regions, k=rng.choice([1, 1, 1, 2, 3, len(gcp_regions)]))
+    usage_type = rng.choice(usage_types)
+    unit = rng.choice(usage_units)
+    prices = []
+    tiers = rng.choice([1, 1, 1, 2, 3])
+    for t in range(tiers):
+        units, nanos = rng.randint(0, 3), rng.randint(0, 999_999_999)
+        prices.append(
+            {
+                "purchase_option": usage_type,
+                "unit": unit,
+                "USD": f"{units}.{str(nanos).zfill(9)}",
+                "effective_date_start": "2024-06-01 08:00:00+00:00",
+                "start_usage_amount": str(float(t * 1024)),
+                "end_usage_amount": str(float((t + 1) * 1024)) if t + 1 < tiers else None,
+            }
+        )
+    # Same keys as dataclasses.asdict(gcp_catalog.Product), which isn't
+    # imported so that generating files doesn't need a database.
+    return {
+        "sku_id": f"{rng.getrandbits(48):012X}-{i}",
+        "service_regions": regions,
+        "service_display_name": service,
+        "product_family": rng.choice(services[service]),
+        "attributes": {
+            "description": f"{rng.choice(['N2', 'E2', 'C2', 'N1'])} Instance "
+            f"{rng.choice(resource_groups)} running in {regions[0]}",
+            "resource_group": rng.choice(resource_groups),
+        },
+        "prices": prices,
+    }
+
+
+@app.command()
+def generate(
+    sizes: str = typer.Option("1000,10000,100000", help="Comma-separated number of SKUs per file"),
+    output_dir: str = typer.Option(default_output_dir),
+    seed: int = typer.Option(42),
+):
+    """
+    Generate synthetic gcp-*.json files.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+    for size in [int(s) for s in sizes.split(",")]:
+        filename = os.path.join(output_dir, f"gcp-bench-{size}.json")
+        skus = [synthetic_sku(rng, i) for i in range(size)]
+        with open(filename, "w") as f:
+            json.dump({"skus": skus}, f)
+        print(f"Wrote {filename} ({os.path.getsize(filename) / 1024 / 1024:.1f}MB)")
+
+
+def measure(fn: Callable[[], Any]) -> Tuple[Any, float, float]:
+    from scripts.profiling import peak_rss_mb, reset_peak_rss
+
+    reset_peak_rss()
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start, peak_rss_mb()
+
+
+@app.command()
+def run(
+    db_url: str = typer.Option(..., help="SQLite or local Postgres database, its catalog tables are emptied"),
+    input_dir: str = typer.Option(default_output_dir, help="Directory with generated files"),
+    batch_size: int = typer.Option(5000, help="Rows per write transaction"),
+    baseline: str = typer.Option(default_baseline, help="Baseline to compare against"),
+    save_baseline: bool = typer.Option(False, help="Store these results as the new baseline"),
+    threshold: float = typer.Option(0.2, help="Relative slowdown reported as a regression"),
+    output: str = typer.Option(None, help="Also write the results to this file"),
+):
+    """
+    Time each ingestion phase on the generated files.
+    """
+    from sqlalchemy.engine import make_url
+    from sqlmodel import Session, delete
+    from app import settings
+
+    # The loader writes through the app engine, which is created from the
+    # settings when it's first imported. A Cloud SQL instance set in .env
+    # would take precedence over db_url, and its catalog would be emptied.
+    settings.db_url = db_url
+    settings.instance_connection_name = None
+    settings.replica_instance_connection_name = None
+    from app.db.dependencies import engine
+
+    if engine.url.render_as_string(hide_password=False) != make_url(db_url).render_as_string(
+        hide_password=False
+    ):
+        raise typer.BadParameter(
+            f"The app is connected to {engine.url}, not to --db-url, refusing to empty it"
+        )
+    from app.db.models import Price, Product
+    from scripts.pipeline import BatchedDbSink
+    from scripts.scrapers import gcp_catalog
+
+    def reset_tables():
+        with Session(engine) as session:
+            session.exec(delete(Price))  # type: ignore
+            session.exec(delete(Product))  # type: ignore
+            session.commit()
+
+    sink = BatchedDbSink(batch_size=batch_size)
+
+    def write_all(rows: List[Any]):
+        for i in range(0, len(rows), batch_size):
+            sink.write(rows[i : i + batch_size])
+
+    results: Dict[str, Dict[str, float]] = {}
+    filenames = sorted(
+        glob(os.path.join(input_dir, "gcp-*.json")), key=os.path.getsize
+    )
+    if not filenames:
+        raise typer.BadParameter(f"No files in {input_dir}, run generate first")
+
+    for filename in filenames:
+        name = os.path.basename(filename).removeprefix("gcp-").removesuffix(".json")
+        with open(filename) as f:
+            content = f.read()
+        reset_tables()
+
+        json_data, parse_s, parse_mb = measure(lambda: json.loads(content))
+
+        hashed, hash_s, hash_mb = measure(
+            lambda: gcp_catalog.hash_products(json_data)
+        )
+        rows, transform_s, transform_mb = measure(
+            lambda: gcp_catalog.build_models((filename, hashed))
+        )
+        _, insert_s, insert_mb = measure(lambda: write_all(rows))
+        # Same rows again, so every upsert finds an existing row.
+        rows = gcp_catalog.build_models((filename, hashed))
+        _, update_s, update_mb = measure(lambda: write_all(rows))
+
+        reset_tables()
+        with tempfile.TemporaryDirectory() as tmp:
+            # load_all removes the files it loaded.
+            copy = shutil.copy(filename, tmp)
+            _, pipeline_s, pipeline_mb = measure(
+                lambda: asyncio.run(gcp_catalog.load_all([copy]))
+            )
+
+        row_count = len(rows)
+        phases = {
+            "parse": (parse_s, parse_mb),
+            "hash": (hash_s, hash_mb),
+            "transform": (transform_s, transform_mb),
+            "write_insert": (insert_s, insert_mb),
+            "write_update": (update_s, update_mb),
+            "pipeline": (pipeline_s, pipeline_mb),
+        }
+        print(f"{name}: {len(json_data['skus'])} SKUs, {row_count} rows, {engine.dialect.name}")
+        for phase, (seconds, mb) in phases.items():
+            results[f"{name}:{phase}"] = {
+                "rows": row_count,
+                "seconds": round(seconds, 3),
+                "rows_per_second": round(row_count / seconds, 1) if seconds else 0.0,
+                "peak_rss_mb": round(mb, 1),
+            }
+            print(
+                f"  {phase:<13} {seconds:>8.2f}s {row_count / seconds if seconds else 0:>12.0f} rows/s "
+                f"peak_rss={mb:.0f}MB"
+            )
+    reset_tables()
+
+    report = {"db_dialect": engine.dialect.name, "batch_size": batch_size, "phases": results}
+    if output:
+        save_results(output, report)
+
+    previous = load_baseline(baseline)
+    if save_baseline:
+        save_results(baseline, report)
+    elif previous is None:
+        print(f"No baseline at {baseline}, run with --save-baseline to store one")
+    else:
+        regressions = compare(
+            results,
+            previous["phases"],
+            ["rows_per_second", "peak_rss_mb"],
+            threshold,
+            higher_is_better=["rows_per_second"],
+        )
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            raise typer.Exit(code=1)
+        print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    app()
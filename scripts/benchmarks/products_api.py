@@ -0,0 +1,441 @@
+"""Benchmark for Query.products and Query.search on a synthetic catalog.
+
+    python -m scripts.benchmarks.products_api generate --products 1000000 --prices 10000000 --db-url postgresql+pg8000://...
+    python -m scripts.benchmarks.products_api run --db-url postgresql+pg8000://...
+
+`run` sends a fixed set of representative queries through the FastAPI app
+in-process and compares the latencies against a stored baseline.
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+import resource
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Tuple
+
+import typer
+from sqlalchemy import create_engine, delete, event, func, insert, select
+from sqlmodel import SQLModel
+
+from app.db.models import Price, Product
+from .common import compare, load_baseline, percentiles, save_results
+
+app = typer.Typer()
+
+default_baseline = "scripts/benchmarks/baselines/products_api.json"
+
+vendor_weights = {"aws": 45, "azure": 30, "gcp": 20, "ibm": 5}
+
+service_weights = {
+    "aws": {
+        "AmazonEC2": 50,
+        "AmazonRDS": 20,
+        "AmazonElastiCache": 10,
+        "AmazonCloudWatch": 10,
+        "AmazonS3": 5,
+        "AWSLambda": 5,
+    },
+    "azure": {
+        "Virtual Machines": 50,
+        "SQL Database": 20,
+        "Storage": 15,
+        "Bandwidth": 10,
+        "Azure Kubernetes Service": 5,
+    },
+    "gcp": {
+        "Compute Engine": 60,
+        "Cloud SQL": 15,
+        "Cloud Storage": 10,
+        "BigQuery": 10,
+        "Kubernetes Engine": 5,
+    },
+    "ibm": {
+        "Kubernetes Service": 40,
+        "Virtual Server for VPC": 40,
+        "Cloud Object Storage": 20,
+    },
+}
+
+# Earlier regions are more common, like in the real catalogs.
+vendor_regions = {
+    "aws": ["us-east-1", "us-west-2", "eu-west-1", "ap-southeast-1", "eu-central-1",
+            "ap-northeast-1", "us-east-2", "sa-east-1", "ca-central-1", "ap-south-1"],
+    "azure": ["eastus", "westeurope", "westus2", "northeurope", "southeastasia",
+              "centralus", "uksouth", "japaneast", "australiaeast", "canadacentral"],
+    "gcp": ["us-central1", "europe-west1", "us-east1", "asia-east1", "europe-west4",
+            "us-west1", "asia-northeast1", "australia-southeast1", "southamerica-east1"],
+    "ibm": ["us-south", "eu-de", "eu-gb", "jp-tok", "au-syd", "us-east"],
+}
+
+family_weights = {
+    "Compute Instance": 40,
+    "Storage": 20,
+    "Data Transfer": 15,
+    "Database Instance": 15,
+    "Other": 10,
+}
+
+instance_families = ["m5", "c5", "r5", "t3", "n2", "e2", "c2", "d2"]
+instance_sizes = ["large", "xlarge", "2xlarge", "4xlarge", "8xlarge", "16xlarge"]
+operating_systems = {"Linux": 70, "Windows": 20, "RHEL": 10}
+purchase_options = {"on_demand": 50, "reserved": 30, "spot": 20}
+units = {"Hrs": 60, "GB-Mo": 25, "Requests": 15}
+
+
+def weighted(rng: random.Random, weights: Dict[str, int]) -> str:
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def zipf_choice(rng: random.Random, values: List[str]) -> str:
+    return rng.choices(values, weights=[1 / (i + 1) for i in range(len(values))])[0]
+
+
+def synthetic_product(rng: random.Random, i: int) -> Dict[str, Any]:
+    vendor = weighted(rng, vendor_weights)
+    service = weighted(rng, service_weights[vendor])
+    region = zipf_choice(rng, vendor_regions[vendor])
+    family = weighted(rng, family_weights)
+    instance_type = f"{rng.choice(instance_families)}.{rng.choice(instance_sizes)}"
+    operating_system = weighted(rng, operating_systems)
+    attributes = {
+        "instanceType": instance_type,
+        "vcpu": str(2 ** rng.randint(0, 6)),
+        "memory": f"{2 ** rng.randint(0, 9)} GiB",
+        "operatingSystem": operating_system,
+        "tenancy": rng.choice(["Shared", "Dedicated"]),
+        "description": f"{service} {instance_type} {operating_system} in {region}",
+    }
+    # Real products carry a varying number of extra attributes.
+    for j in range(rng.randint(0, 8)):
+        attributes[f"attribute{j}"] = f"value{rng.randint(0, 100)}"
+    return {
+        "product_hash": hashlib.sha256(f"bench-{i}".encode()).hexdigest(),
+        "sku": f"SKU-{i:08d}",
+        "vendor_name": vendor,
+        "region": region,
+        "service": service,
+        "product_family": family,
+        "attributes": attributes,
+    }
+
+
+def synthetic_prices(
+    rng: random.Random, product_hash: str, count: int
+) -> Iterator[Dict[str, Any]]:
+    for j in range(count):
+        yield {
+            "price_hash": hashlib.sha256(f"{product_hash}-{j}".encode()).hexdigest(),
+            "purchase_option": weighted(rng, purchase_options),
+            "unit": weighted(rng, units),
+            "usd": f"{rng.lognormvariate(-3, 2):.10f}",
+            "effective_start_date": "2024-01-01T00:00:00Z",
+            "start_usage_amount": str(j * 100) if j else "0",
+            "end_usage_amount": None,
+            "product_hash": product_hash,
+        }
+
+
+def insert_rows(conn, table, rows: List[Dict[str, Any]]):
+    if not rows:
+        return
+    if conn.dialect.name == "postgresql":
+        # pg8000 runs executemany row by row, a multi-row VALUES is one round trip.
+        conn.execute(insert(table).values(rows))
+    else:
+        conn.execute(insert(table), rows)
+
+
+@app.command()
+def generate(
+    db_url: str = typer.Option(..., help="SQLAlchemy URL of a SQLite or local Postgres database"),
+    products: int = typer.Option(1_000_000, help="Number of products"),
+    prices: int = typer.Option(10_000_000, help="Total number of prices"),
+    seed: int = typer.Option(42),
+    replace: bool = typer.Option(False, help="Delete existing products and prices first"),
+):
+    """
+    Generate a synthetic catalog.
+    """
+    engine = create_engine(db_url)
+    SQLModel.metadata.create_all(engine)
+    product_table, price_table = Product.__table__, Price.__table__  # type: ignore
+    with engine.begin() as conn:
+        existing = conn.execute(select(func.count()).select_from(product_table)).scalar()
+        if existing and not replace:
+            raise typer.BadParameter(
+                f"Database already has {existing} products, pass --replace to delete them"
+            )
+        conn.execute(delete(price_table))
+        conn.execute(delete(product_table))
+
+    rng = random.Random(seed)
+    mean_prices = prices / products
+    # Smaller than the Postgres limit of 65535 bind parameters per statement.
+    chunk = 2000
+    start = time.perf_counter()
+    product_rows: List[Dict[str, Any]] = []
+    price_rows: List[Dict[str, Any]] = []
+    written_prices = 0
+    with engine.begin() as conn:
+        for i in range(products):
+            product = synthetic_product(rng, i)
+            product_rows.append(product)
+            count = max(1, round(rng.expovariate(1 / mean_prices)))
+            price_rows.extend(synthetic_prices(rng, product["product_hash"], count))
+            if len(product_rows) >= chunk:
+                insert_rows(conn, product_table, product_rows)
+                product_rows = []
+            while len(price_rows) >= chunk:
+                insert_rows(conn, price_table, price_rows[:chunk])
+                written_prices += chunk
+                price_rows = price_rows[chunk:]
+            if (i + 1) % 100_000 == 0:
+                print(f"Generated {i + 1} products and {written_prices} prices")
+        insert_rows(conn, product_table, product_rows)
+        insert_rows(conn, price_table, price_rows)
+        written_prices += len(price_rows)
+    elapsed = time.perf_counter() - start
+    print(f"Generated {products} products and {written_prices} prices in {elapsed:.1f}s")
+
+
+@dataclass
+class Scenario:
+    name: str
+    query: str
+    variables: Dict[str, Any]
+    # Uses the ~ operator, which SQLite doesn't have.
+    postgres_only: bool = False
+
+
+product_fields = "sku vendorName region service productFamily"
+
+scenarios = [
+    Scenario(
+        "plain_filters",
+        f"query($filter: ProductFilter!) {{ products(filter: $filter) {{ {product_fields} prices {{ usd unit }} }} }}",
+        {"filter": {"vendorName": "aws", "service": "AmazonEC2", "region": "us-east-1"}},
+    ),
+    Scenario(
+        "product_family",
+        f"query($filter: ProductFilter!) {{ products(filter: $filter) {{ {product_fields} }} }}",
+        {"filter": {"vendorName": "gcp", "productFamily": "Storage", "region": "us-central1"}},
+    ),
+    Scenario(
+        "attribute_equality",
+        f"query($filter: ProductFilter!) {{ products(filter: $filter) {{ {product_fields} attributes prices {{ usd }} }} }}",
+        {
+            "filter": {
+                "vendorName": "aws",
+                "service": "AmazonEC2",
+                "region": "us-east-1",
+                "attributeFilters": [{"key": "instanceType", "value": "m5.large"}],
+            }
+        },
+    ),
+    Scenario(
+        "attribute_regex",
+        f"query($filter: ProductFilter!) {{ products(filter: $filter) {{ {product_fields} attributes prices {{ usd }} }} }}",
+        {
+            "filter": {
+                "vendorName": "azure",
+                "service": "Virtual Machines",
+                "attributeFilters": [{"key": "description", "valueRegex": "/m5\\.(2x|4x)large linux/i"}],
+            }
+        },
+        postgres_only=True,
+    ),
+    Scenario(
+        "price_filter",
+        f"query($filter: ProductFilter!) {{ products(filter: $filter) {{ {product_fields} prices(filter: {{purchaseOption: \"on_demand\", unit: \"Hrs\"}}) {{ usd startUsageAmount }} }} }}",
+        {"filter": {"vendorName": "gcp", "service": "Compute Engine", "region": "europe-west1"}},
+    ),
+    Scenario(
+        "large_result",
+        f"query($filter: ProductFilter!) {{ products(filter: $filter) {{ productHash {product_fields} attributes prices {{ usd purchaseOption unit startUsageAmount }} }} }}",
+        {"filter": {"vendorName": "aws"}},
+    ),
+    Scenario(
+        "search",
+        f"query($query: String!) {{ search(query: $query, first: 50) {{ items {{ {product_fields} }} nextCursor }} }}",
+        {"query": "m5.large linux us-east-1"},
+    ),
+    Scenario(
+        "search_filtered",
+        f"query($query: String!) {{ search(query: $query, vendorName: \"gcp\", region: \"europe-west1\") {{ items {{ {product_fields} attributes prices {{ usd }} }} }} }}",
+        {"query": "n2 windows"},
+    ),
+]
+
+
+def register_sqlite_functions(engine):
+    def json_extract_path_text(attributes: str | None, key: str) -> str | None:
+        if attributes is None:
+            return None
+        value = json.loads(attributes).get(key)
+        return None if value is None else str(value)
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, _):
+        dbapi_connection.create_function(
+            "json_extract_path_text", 2, json_extract_path_text, deterministic=True
+        )
+
+    # Drop connections opened before the function was registered.
+    engine.dispose()
+
+
+@dataclass
+class ScenarioResult:
+    latencies_ms: List[float] = field(default_factory=list)
+    wall_seconds: float = 0.0
+    response_bytes: int = 0
+    products: int = 0
+    peak_alloc_mb: float = 0.0
+
+    def summary(self) -> Dict[str, float]:
+        p = percentiles(self.latencies_ms)
+        return {
+            "iterations": len(self.latencies_ms),
+            "p50_ms": round(p["p50"], 2),
+            "p95_ms": round(p["p95"], 2),
+            "p99_ms": round(p["p99"], 2),
+            "mean_ms": round(sum(self.latencies_ms) / len(self.latencies_ms), 2),
+            "requests_per_second": round(len(self.latencies_ms) / self.wall_seconds, 2),
+            "products": self.products,
+            "response_bytes": self.response_bytes,
+            "peak_alloc_mb": round(self.peak_alloc_mb, 2),
+        }
+
+
+async def run_scenario(
+    client, scenario: Scenario, iterations: int, warmup: int, concurrency: int
+) -> ScenarioResult:
+    result = ScenarioResult()
+    body = {"query": scenario.query, "variables": scenario.variables}
+
+    async def send() -> Tuple[float, Any]:
+        start = time.perf_counter()
+        response = await client.post("/v1/products/graphql", json=body)
+        elapsed = (time.perf_counter() - start) * 1000
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get("errors"):
+            raise RuntimeError(f"{scenario.name} failed: {payload['errors']}")
+        return elapsed, response
+
+    for _ in range(warmup):
+        await send()
+
+    # One extra request with allocation tracing, so it doesn't skew the latencies.
+    tracemalloc.start()
+    _, response = await send()
+    result.peak_alloc_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+    tracemalloc.stop()
+    result.response_bytes = len(response.content)
+    data = response.json()["data"]
+    result.products = len(data["products"] if "products" in data else data["search"]["items"])
+
+    remaining = iter(range(iterations))
+
+    async def worker():
+        for _ in remaining:
+            elapsed, _ = await send()
+            result.latencies_ms.append(elapsed)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    result.wall_seconds = time.perf_counter() - start
+    return result
+
+
+@app.command()
+def run(
+    db_url: str = typer.Option(..., help="Database created by the generate command"),
+    iterations: int = typer.Option(50, help="Measured requests per scenario"),
+    warmup: int = typer.Option(3, help="Unmeasured requests per scenario"),
+    concurrency: int = typer.Option(1, help="Requests in flight at the same time"),
+    only: List[str] = typer.Option(None, help="Scenarios to run"),
+    baseline: str = typer.Option(default_baseline, help="Baseline to compare against"),
+    save_baseline: bool = typer.Option(False, help="Store these results as the new baseline"),
+    threshold: float = typer.Option(0.2, help="Relative slowdown reported as a regression"),
+    output: str = typer.Option(None, help="Also write the results to this file"),
+):
+    """
+    Run the query scenarios through the app and compare them with the baseline.
+    """
+    import httpx
+    from app import settings
+
+    # The app creates its engine from the settings when it's first imported.
+    settings.db_url = db_url
+    # All requests come from one anonymous client, which the rate limits
+    # would throttle after a few iterations.
+    settings.rate_limit_backend = "off"
+    from app.db.dependencies import engine
+    from app.main import app as fastapi_app
+
+    if engine.dialect.name == "sqlite":
+        register_sqlite_functions(engine)
+
+    async def run_all() -> Dict[str, Dict[str, float]]:
+        results = {}
+        transport = httpx.ASGITransport(app=fastapi_app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=None
+        ) as client:
+            for scenario in scenarios:
+                if only and scenario.name not in only:
+                    continue
+                if scenario.postgres_only and engine.dialect.name != "postgresql":
+                    print(f"Skipping {scenario.name}, it needs Postgres")
+                    continue
+                result = await run_scenario(
+                    client, scenario, iterations, warmup, concurrency
+                )
+                results[scenario.name] = result.summary()
+                s = results[scenario.name]
+                print(
+                    f"{scenario.name:<20} p50={s['p50_ms']:>8.1f}ms p95={s['p95_ms']:>8.1f}ms "
+                    f"p99={s['p99_ms']:>8.1f}ms {s['requests_per_second']:>7.1f} req/s "
+                    f"products={s['products']} bytes={s['response_bytes']} "
+                    f"alloc={s['peak_alloc_mb']:.1f}MB"
+                )
+        return results
+
+    results = asyncio.run(run_all())
+    report = {
+        "db_dialect": engine.dialect.name,
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "scenarios": results,
+    }
+    if output:
+        save_results(output, report)
+
+    previous = load_baseline(baseline)
+    if save_baseline:
+        save_results(baseline, report)
+    elif previous is None:
+        print(f"No baseline at {baseline}, run with --save-baseline to store one")
+    else:
+        regressions = compare(
+            results,
+            previous["scenarios"],
+            ["p50_ms", "p95_ms", "p99_ms", "peak_alloc_mb", "requests_per_second"],
+            threshold,
+            higher_is_better=["requests_per_second"],
+        )
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            raise typer.Exit(code=1)
+        print("No regressions against the baseline")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,30 @@
+"""Recomputes the facets of all vendors.
+
+    python -m scripts.facets
+
+Scraper runs recompute the facets of their vendor. This fills them for a
+catalog loaded before the facet tables existed.
+"""
+
+import typer
+from sqlmodel import Session
+
+from app.catalog import bump_catalog_version, refresh_facets
+from app.db.dependencies import engine
+
+app = typer.Typer()
+
+
+@app.command()
+def refresh():
+    """
+    Recompute the facets of all vendors.
+    """
+    with Session(engine) as session:
+        refresh_facets(session)
+        version = bump_catalog_version(session, "facets")
+    print(f"Recomputed the facets, catalog version is now {version}")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,114 @@
+"""In-memory stand-in for the Cloudflare Workers KV API.
+
+    python -m scripts.fake_kv --port 8787
+    CLOUDFLARE_API_BASE=http://localhost:8787/client/v4 CLOUDFLARE_ACCOUNT_ID=local \
+        CLOUDFLARE_KV_NAMESPACE_ID=users make server
+
+Implements the value and bulk endpoints the app uses, and prints each request
+so batching and coalescing can be checked.
+"""
+
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+import typer
+
+app = typer.Typer()
+
+path_pattern = re.compile(
+    r"^/client/v4/accounts/[^/]+/storage/kv/namespaces/(?P<namespace>[^/]+)/(?P<rest>.+)$"
+)
+
+store: Dict[str, Dict[str, str]] = {}
+lock = threading.Lock()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def route(self):
+        match = path_pattern.match(self.path.split("?")[0])
+        if match is None:
+            self.reply(404, {"success": False})
+            return None
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        with lock:
+            namespace = store.setdefault(match["namespace"], {})
+        return namespace, match["rest"], body
+
+    def reply(self, status: int, body: object, raw: str | None = None):
+        content = (raw if raw is not None else json.dumps(body)).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        routed = self.route()
+        if routed is None:
+            return
+        namespace, rest, _ = routed
+        if rest.startswith("values/"):
+            with lock:
+                value = namespace.get(rest.removeprefix("values/"))
+            if value is None:
+                self.reply(404, {"success": False})
+            else:
+                self.reply(200, None, raw=value)
+        elif rest == "keys":
+            with lock:
+                keys = [{"name": k} for k in sorted(namespace)]
+            self.reply(200, {"success": True, "result": keys})
+        else:
+            self.reply(404, {"success": False})
+
+    def do_PUT(self):
+        routed = self.route()
+        if routed is None:
+            return
+        namespace, rest, body = routed
+        with lock:
+            if rest == "bulk":
+                for pair in json.loads(body):
+                    namespace[pair["key"]] = pair["value"]
+            elif rest.startswith("values/"):
+                namespace[rest.removeprefix("values/")] = body.decode()
+        self.reply(200, {"success": True})
+
+    def do_POST(self):
+        routed = self.route()
+        if routed is None:
+            return
+        namespace, rest, body = routed
+        if rest != "bulk/delete":
+            self.reply(404, {"success": False})
+            return
+        with lock:
+            for key in json.loads(body):
+                namespace.pop(key, None)
+        self.reply(200, {"success": True})
+
+    def do_DELETE(self):
+        routed = self.route()
+        if routed is None:
+            return
+        namespace, rest, _ = routed
+        with lock:
+            namespace.pop(rest.removeprefix("values/"), None)
+        self.reply(200, {"success": True})
+
+
+@app.command()
+def serve(port: int = typer.Option(8787)):
+    """
+    Run the fake KV server.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    print(f"Fake KV listening on http://127.0.0.1:{port}/client/v4")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,110 @@
+"""Local stand-in for Propel's token verification metadata endpoint.
+
+    python -m scripts.fake_propel serve --port 8788
+    PROPEL_AUTH_URL=http://localhost:8788 make server
+    python -m scripts.fake_propel mint --user-id user_1
+
+The RSA key pair is stored in .fake_propel_key.pem, so tokens minted by `mint`
+verify against the key served by `serve`. `serve --rotate` starts with a new
+key, which the app picks up on the first token it can't verify.
+"""
+
+import json
+import os
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+import typer
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+app = typer.Typer()
+
+key_file = ".fake_propel_key.pem"
+default_url = "http://localhost:8788"
+
+
+def load_key(rotate: bool = False) -> rsa.RSAPrivateKey:
+    if os.path.exists(key_file) and not rotate:
+        with open(key_file, "rb") as f:
+            key = serialization.load_pem_private_key(f.read(), password=None)
+            assert isinstance(key, rsa.RSAPrivateKey)
+            return key
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with open(key_file, "wb") as f:
+        f.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    return key
+
+
+def public_pem(key: rsa.RSAPrivateKey) -> str:
+    return key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode()
+
+
+def mint_token(
+    key: rsa.RSAPrivateKey, user_id: str, email: str, issuer: str, minutes: int
+) -> str:
+    now = int(time.time())
+    claims = {
+        "user_id": user_id,
+        "email": email,
+        "iss": issuer,
+        "iat": now,
+        "exp": now + minutes * 60,
+        "jti": uuid.uuid4().hex,
+        "org_id_to_org_member_info": {},
+    }
+    return jwt.encode(claims, key, algorithm="RS256")
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Public key served, can be replaced while serving to rotate it.
+    pem = ""
+
+    def do_GET(self):
+        if self.path != "/api/v1/token_verification_metadata":
+            self.send_response(404)
+            self.end_headers()
+            return
+        content = json.dumps({"verifier_key_pem": self.pem}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+@app.command()
+def serve(port: int = typer.Option(8788), rotate: bool = typer.Option(False)):
+    """
+    Serve the verifier key.
+    """
+    Handler.pem = public_pem(load_key(rotate))
+    print(f"Fake propel listening on http://127.0.0.1:{port}")
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+@app.command()
+def mint(
+    user_id: str = typer.Option("user_1"),
+    email: str = typer.Option("user_1@example.com"),
+    issuer: str = typer.Option(default_url, help="Must match PROPEL_AUTH_URL of the app"),
+    minutes: int = typer.Option(60),
+):
+    """
+    Print an access token signed with the local key.
+    """
+    print(mint_token(load_key(), user_id, email, issuer, minutes))
+
+
+if __name__ == "__main__":
+    app()
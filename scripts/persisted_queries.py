@@ -0,0 +1,41 @@
+"""Registers GraphQL documents as persisted queries.
+
+    python -m scripts.persisted_queries frontend/queries/*.graphql
+
+Registered documents are known to every API instance, so clients can send
+only their sha256 from the first request on.
+"""
+
+import hashlib
+from pathlib import Path
+from typing import List
+
+import typer
+from sqlmodel import Session
+
+from app.api.caching import normalize_query
+from app.db.dependencies import engine
+from app.db.models import PersistedQuery
+
+app = typer.Typer()
+
+
+@app.command()
+def register(paths: List[Path]):
+    """
+    Register the queries in the given files, one document per file.
+    """
+    with Session(engine) as session:
+        for path in paths:
+            query = path.read_text()
+            if normalize_query(query) is None:
+                raise typer.BadParameter(f"{path} isn't a GraphQL query")
+            sha256_hash = hashlib.sha256(query.encode()).hexdigest()
+            if session.get(PersistedQuery, sha256_hash) is None:
+                session.add(PersistedQuery(sha256_hash=sha256_hash, query=query))
+            print(f"{sha256_hash} {path}")
+        session.commit()
+
+
+if __name__ == "__main__":
+    app()
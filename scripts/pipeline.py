@@ -0,0 +1,262 @@
+"""Small framework for scraper pipelines.
+
+A pipeline is a source, a chain of stages and a sink, connected by bounded
+queues. A slow stage applies backpressure to the ones before it instead of the
+whole catalog being buffered in memory, and every stage runs concurrently with
+the others, so fetching, parsing and writing overlap.
+"""
+
+import asyncio
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import sqlalchemy
+from sqlmodel import SQLModel
+
+from app.db.dependencies import engine
+from .profiling import record_pipeline
+from .staging import active_load, catalog_tables, upsert
+
+
+# Marks the end of a queue.
+_done = object()
+
+# Rows written by BatchedDbSink in this process, so scripts.scrape can tell
+# whether a vendor's scrapers wrote anything.
+_rows_written = 0
+_rows_written_lock = threading.Lock()
+
+
+def rows_written() -> int:
+    return _rows_written
+
+
+@dataclass
+class StageMetrics:
+    name: str
+    items_in: int = 0
+    items_out: int = 0
+    busy_seconds: float = 0.0
+    wall_seconds: float = 0.0
+    max_queue_depth: int = 0
+    queue_depth_total: int = 0
+    queue_depth_samples: int = 0
+
+    def sample_queue(self, depth: int):
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+        self.queue_depth_total += depth
+        self.queue_depth_samples += 1
+
+    @property
+    def throughput(self) -> float:
+        return self.items_out / self.wall_seconds if self.wall_seconds else 0.0
+
+    @property
+    def mean_queue_depth(self) -> float:
+        if not self.queue_depth_samples:
+            return 0.0
+        return self.queue_depth_total / self.queue_depth_samples
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "wall_seconds": round(self.wall_seconds, 3),
+            "items_per_second": round(self.throughput, 1),
+            "max_queue_depth": self.max_queue_depth,
+            "mean_queue_depth": round(self.mean_queue_depth, 1),
+        }
+
+
+@dataclass
+class Stage:
+    name: str
+    # Called with one item. May be async. Returning None drops the item.
+    fn: Callable[[Any], Any]
+    workers: int = 1
+    # Size of the queue in front of this stage.
+    queue_size: int = 100
+    # Treat the result as a list of items to pass on one by one.
+    flatten: bool = False
+    # Run fn in a process pool. fn, its input and its output must be picklable.
+    process: bool = False
+    # Called with the item and the error when fn raises, the item is then
+    # dropped instead of failing the whole pipeline.
+    on_error: Callable[[Any, Exception], None] | None = None
+
+
+class BatchedDbSink:
+    """Upserts catalog rows into the database in batches of batch_size rows.
+
+    Rows with the same primary key within a batch are only written once, the
+    last one wins. During a staged load (see scripts.staging) the rows go to
+    its staging tables instead.
+    """
+
+    name = "write"
+
+    def __init__(self, batch_size: int = 5000, queue_size: int = 20000):
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.batches = 0
+
+    async def run(self, inbox: asyncio.Queue, metrics: StageMetrics):
+        rows: Dict[Tuple[Any, ...], SQLModel] = {}
+        while True:
+            row = await inbox.get()
+            metrics.sample_queue(inbox.qsize())
+            if row is _done:
+                break
+            metrics.items_in += 1
+            rows[row_key(row)] = row
+            if len(rows) >= self.batch_size:
+                await self.flush(list(rows.values()), metrics)
+                rows = {}
+        if rows:
+            await self.flush(list(rows.values()), metrics)
+
+    async def flush(self, rows: List[SQLModel], metrics: StageMetrics):
+        start = time.perf_counter()
+        # Written in a thread so the stages before keep running meanwhile.
+        await asyncio.to_thread(self.write, rows)
+        metrics.busy_seconds += time.perf_counter() - start
+        metrics.items_out += len(rows)
+        self.batches += 1
+
+    def write(self, rows: List[SQLModel]):
+        global _rows_written
+        load = active_load()
+        if load is not None:
+            load.write(rows)
+        else:
+            with engine.begin() as conn:
+                upsert(conn, catalog_tables(), rows)
+        with _rows_written_lock:
+            _rows_written += len(rows)
+
+
+def row_key(row: SQLModel) -> Tuple[Any, ...]:
+    mapper = sqlalchemy.inspect(type(row))
+    return (type(row), *(getattr(row, c.key) for c in mapper.primary_key))
+
+
+class Pipeline:
+    def __init__(
+        self,
+        name: str,
+        source: Callable[[Callable[[Any], Awaitable[None]]], Awaitable[None]],
+        stages: List[Stage],
+        sink: BatchedDbSink,
+    ):
+        """source is called with an async emit function and returns once it has emitted everything."""
+        self.name = name
+        self.source = source
+        self.stages = stages
+        self.sink = sink
+        self.metrics = [StageMetrics("source")]
+        self.metrics += [StageMetrics(s.name) for s in stages]
+        self.metrics.append(StageMetrics(sink.name))
+
+    async def run(self) -> List[StageMetrics]:
+        executor = None
+        if any(s.process for s in self.stages):
+            executor = ProcessPoolExecutor(max_workers=os.cpu_count())
+        queues = [asyncio.Queue(maxsize=s.queue_size) for s in self.stages]
+        queues.append(asyncio.Queue(maxsize=self.sink.queue_size))
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(self._run_source(queues[0], self.metrics[0]))
+                for i, stage in enumerate(self.stages):
+                    tg.create_task(
+                        self._run_stage(
+                            stage, queues[i], queues[i + 1], self.metrics[i + 1], executor
+                        )
+                    )
+                tg.create_task(self._run_sink(queues[-1], self.metrics[-1]))
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        self.print_metrics()
+        record_pipeline(self.name, self.metrics)
+        return self.metrics
+
+    async def _run_source(self, outbox: asyncio.Queue, metrics: StageMetrics):
+        start = time.perf_counter()
+
+        async def emit(item: Any):
+            metrics.items_out += 1
+            metrics.sample_queue(outbox.qsize())
+            await outbox.put(item)
+
+        await self.source(emit)
+        await outbox.put(_done)
+        metrics.wall_seconds = time.perf_counter() - start
+
+    async def _run_stage(
+        self,
+        stage: Stage,
+        inbox: asyncio.Queue,
+        outbox: asyncio.Queue,
+        metrics: StageMetrics,
+        executor: ProcessPoolExecutor | None,
+    ):
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+
+        async def worker():
+            while True:
+                item = await inbox.get()
+                metrics.sample_queue(inbox.qsize())
+                if item is _done:
+                    # Leave it for the other workers of this stage.
+                    await inbox.put(_done)
+                    return
+                metrics.items_in += 1
+                item_start = time.perf_counter()
+                try:
+                    if stage.process:
+                        result = await loop.run_in_executor(executor, stage.fn, item)
+                    else:
+                        result = stage.fn(item)
+                        if inspect.isawaitable(result):
+                            result = await result
+                except Exception as e:
+                    if stage.on_error is None:
+                        raise
+                    stage.on_error(item, e)
+                    continue
+                finally:
+                    metrics.busy_seconds += time.perf_counter() - item_start
+                for output in result if stage.flatten else [result]:
+                    if output is None:
+                        continue
+                    metrics.items_out += 1
+                    await outbox.put(output)
+
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(stage.workers):
+                tg.create_task(worker())
+        await outbox.put(_done)
+        metrics.wall_seconds = time.perf_counter() - start
+
+    async def _run_sink(self, inbox: asyncio.Queue, metrics: StageMetrics):
+        start = time.perf_counter()
+        await self.sink.run(inbox, metrics)
+        metrics.wall_seconds = time.perf_counter() - start
+
+    def print_metrics(self):
+        print(f"Pipeline {self.name}:")
+        for m in self.metrics:
+            print(
+                f"  {m.name:<12} in={m.items_in:<9} out={m.items_out:<9} "
+                f"{m.throughput:>10.1f}/s busy={m.busy_seconds:.1f}s "
+                f"wall={m.wall_seconds:.1f}s queue(max={m.max_queue_depth}, "
+                f"mean={m.mean_queue_depth:.1f})"
+            )
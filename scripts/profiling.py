@@ -0,0 +1,230 @@
+"""Run report for `scripts.scrape run --profile`.
+
+Each scraper run records wall time, rows read and written, DB round trips and
+peak memory. Pipelines report their per-stage metrics into the run that is
+active when they finish. The report is written as JSON so ingestion
+performance can be compared across runs.
+"""
+
+import cProfile
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Literal
+
+from sqlalchemy import event
+
+from app.db.dependencies import engine
+
+
+ProfileMode = Literal["none", "cprofile", "sample"]
+
+# Seconds between two samples of the sampling profiler.
+sample_interval = 0.005
+
+
+@dataclass
+class ScraperRun:
+    scraper: str
+    success: bool = True
+    error: str | None = None
+    wall_seconds: float = 0.0
+    # Rows produced by the scraper, before rows with the same key are merged.
+    rows_read: int = 0
+    # Rows inserted, updated or deleted according to the database.
+    rows_written: int = 0
+    rows_per_second: float = 0.0
+    db_round_trips: int = 0
+    db_seconds: float = 0.0
+    db_statements: Dict[str, int] = field(default_factory=dict)
+    peak_rss_mb: float = 0.0
+    peak_children_rss_mb: float = 0.0
+    profile_file: str | None = None
+    stages: List[Dict[str, Any]] = field(default_factory=list)
+
+
+# The run that DB statements and pipeline metrics are attributed to. It is
+# copied into threads started with asyncio.to_thread, which is where the
+# pipelines write.
+_active_run: ContextVar[ScraperRun | None] = ContextVar("active_run", default=None)
+_lock = threading.Lock()
+
+
+def record_pipeline(name: str, metrics: List[Any]):
+    """Called by scripts.pipeline.Pipeline when it finishes."""
+    run = _active_run.get()
+    if run is None:
+        return
+    with _lock:
+        for m in metrics:
+            run.stages.append({"pipeline": name, **m.as_dict()})
+        run.rows_read += metrics[-1].items_in
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._profiling_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    run = _active_run.get()
+    if run is None:
+        return
+    elapsed = time.perf_counter() - getattr(context, "_profiling_start", time.perf_counter())
+    kind = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "?"
+    with _lock:
+        run.db_round_trips += 1
+        run.db_seconds += elapsed
+        run.db_statements[kind] = run.db_statements.get(kind, 0) + 1
+        if kind in ("INSERT", "UPDATE", "DELETE") and cursor.rowcount > 0:
+            run.rows_written += cursor.rowcount
+
+
+def reset_peak_rss():
+    # Linux only. Without it the peak is the peak of the whole process so far.
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return _maxrss_mb(resource.RUSAGE_SELF)
+
+
+def _maxrss_mb(who: int) -> float:
+    maxrss = resource.getrusage(who).ru_maxrss
+    # Bytes on macOS, kilobytes everywhere else.
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads and counts them in folded format.
+
+    The output can be fed to flamegraph.pl or speedscope.
+    """
+
+    def __init__(self, interval: float = sample_interval):
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def dump(self, filename: str):
+        with open(filename, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ScrapeProfiler:
+    def __init__(self, output: str, mode: ProfileMode = "none"):
+        self.output = output
+        self.mode = mode
+        self.started_at = datetime.now(timezone.utc)
+        self.runs: List[ScraperRun] = []
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    @contextmanager
+    def scraper(self, name: str) -> Iterator[ScraperRun]:
+        run = ScraperRun(scraper=name)
+        self.runs.append(run)
+        token = _active_run.set(run)
+        profiler: cProfile.Profile | SamplingProfiler | None = None
+        if self.mode == "cprofile":
+            # Only sees the event loop thread, not the threads writing batches.
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif self.mode == "sample":
+            profiler = SamplingProfiler()
+            profiler.start()
+        reset_peak_rss()
+        start = time.perf_counter()
+        try:
+            yield run
+        except Exception as e:
+            run.success = False
+            run.error = str(e)
+            raise
+        finally:
+            run.wall_seconds = time.perf_counter() - start
+            run.peak_rss_mb = peak_rss_mb()
+            run.peak_children_rss_mb = _maxrss_mb(resource.RUSAGE_CHILDREN)
+            rows = run.rows_written or run.rows_read
+            run.rows_per_second = rows / run.wall_seconds if run.wall_seconds else 0.0
+            _active_run.reset(token)
+            if profiler is not None:
+                run.profile_file = self._dump_profile(name, profiler)
+
+    def _dump_profile(
+        self, name: str, profiler: cProfile.Profile | SamplingProfiler
+    ) -> str:
+        base = os.path.splitext(self.output)[0] + "-" + name.replace(":", "-")
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            filename = f"{base}.prof"
+            profiler.dump_stats(filename)
+        else:
+            profiler.stop()
+            filename = f"{base}.folded"
+            profiler.dump(filename)
+        return filename
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "db_dialect": engine.dialect.name,
+            "success": all(r.success for r in self.runs),
+            "scrapers": [asdict(r) for r in self.runs],
+        }
+
+    def write(self):
+        event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+        event.remove(engine, "after_cursor_execute", _after_cursor_execute)
+        with open(self.output, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        print(f"Wrote scrape profile to {self.output}")
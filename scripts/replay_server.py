@@ -0,0 +1,108 @@
+"""Serves recorded API responses so scrapers can run without the real API.
+
+    python -m scripts.replay_server tests/fixtures/azure_retail.json --port 8001
+    AZURE_RETAIL_PRICES_URL=http://localhost:8001/api/retail/prices \
+        python -m scripts.scrape --only=azure:retail
+
+A recording is a JSON object with the `origin` it was captured from and a list
+of `responses`, each with the `path` and `query` it answers plus its `status`,
+`headers` and `body`. Responses that match the same request are served in
+order and the last one repeats, so a recorded 503 followed by a 200 exercises
+the retry path. The origin is rewritten to the replay server's address in
+bodies, so next-page links come back to it. Unrecorded requests get a 404.
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import typer
+
+app = typer.Typer()
+
+
+class ReplayServer(ThreadingHTTPServer):
+    def __init__(self, recording: Dict[str, Any], port: int = 0):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.origin = recording.get("origin", "")
+        self.responses = recording["responses"]
+        # Requests served so far, as (path, query) pairs.
+        self.requests: List[Tuple[str, Dict[str, str]]] = []
+        self.served: Dict[int, int] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def match(self, path: str, query: Dict[str, str]) -> Dict[str, Any] | None:
+        candidates = [
+            i
+            for i, response in enumerate(self.responses)
+            if response["path"] == path and response.get("query", {}) == query
+        ]
+        if not candidates:
+            return None
+        with self.lock:
+            self.requests.append((path, query))
+            key = candidates[0]
+            count = self.served.get(key, 0)
+            self.served[key] = count + 1
+        return self.responses[candidates[min(count, len(candidates) - 1)]]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class Handler(BaseHTTPRequestHandler):
+    server: ReplayServer
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        response = self.server.match(parts.path, dict(parse_qsl(parts.query)))
+        if response is None:
+            self.reply(404, {}, {"error": "not recorded"})
+            return
+        self.reply(
+            response.get("status", 200),
+            response.get("headers", {}),
+            response.get("body"),
+        )
+
+    def reply(self, status: int, headers: Dict[str, str], body: Any):
+        content = json.dumps(body)
+        if self.server.origin:
+            content = content.replace(self.server.origin, self.server.url)
+        encoded = content.encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@app.command()
+def serve(recording: Path, port: int = typer.Option(8001)):
+    """
+    Replay a recording until interrupted.
+    """
+    server = ReplayServer(json.loads(recording.read_text()), port)
+    print(f"Replaying {recording} on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    app()
@@ -1,8 +1,17 @@
 from dataclasses import dataclass
+from datetime import datetime
 import typer
 from typing import Callable, List
 import asyncio
 
+from sqlmodel import Session
+
+from app.catalog import bump_catalog_version, record_price_changes, refresh_facets
+from app.db.dependencies import engine
+from .pipeline import rows_written
+from .profiling import ScrapeProfiler
+from .staging import StagedLoad
+
 # Import your scrapers here
 from .scrapers import (
     aws_bulk,
@@ -50,10 +59,28 @@ def run(
         None,
         help="Comma-separated list of scrapers to run (e.g., aws:bulk,aws:spot,azure:retail)",
     ),
+    profile: bool = typer.Option(
+        False,
+        help="Record timings, row counts, DB round trips and peak memory per scraper",
+    ),
+    profile_output: str = typer.Option(
+        None,
+        help="Where to write the JSON run report (default: profiles/scrape-<timestamp>.json)",
+    ),
+    profile_mode: str = typer.Option(
+        "none",
+        help="Also capture a cProfile (cprofile) or sampling (sample) profile per scraper",
+    ),
+    staged: bool = typer.Option(
+        False,
+        help="Load each vendor into staging tables and swap them in once all its scrapers succeed",
+    ),
 ):
     """
     Run data scraping from cloud vendors.
     """
+    if profile_mode not in ("none", "cprofile", "sample"):
+        raise typer.BadParameter("must be one of none, cprofile, sample")
     scraper_configs = []
 
     for vendor, vendor_scrapers in Scrapers.items():
@@ -66,29 +93,118 @@ def run(
                         scraper_func=scraper_func,
                     )
                 )
+    if staged:
+        # A staged load replaces all of the vendor's rows.
+        for vendor in {c.vendor for c in scraper_configs}:
+            missing = [
+                f"{vendor}:{source}"
+                for source in Scrapers[vendor]
+                if not any(c.vendor == vendor and c.source == source for c in scraper_configs)
+            ]
+            if missing:
+                raise typer.BadParameter(
+                    f"--staged replaces all {vendor} rows, also run {', '.join(missing)}"
+                )
+
+    profiler = None
+    if profile:
+        if profile_output is None:
+            timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            profile_output = f"profiles/scrape-{timestamp}.json"
+        profiler = ScrapeProfiler(profile_output, mode=profile_mode)  # type: ignore
 
-    success = asyncio.run(run_scrapers(scraper_configs))
+    success = asyncio.run(run_scrapers(scraper_configs, profiler, staged))
+    if profiler is not None:
+        profiler.write()
     if not success:
         raise typer.Exit(code=1)
 
 
-async def run_scrapers(scraper_configs: List[ScraperConfig]) -> bool:
-    success = True
+async def run_scrapers(
+    scraper_configs: List[ScraperConfig],
+    profiler: ScrapeProfiler | None = None,
+    staged: bool = False,
+) -> bool:
+    if not staged:
+        success = True
+        for vendor in dict.fromkeys(c.vendor for c in scraper_configs):
+            written = rows_written()
+            for scraper_config in scraper_configs:
+                if scraper_config.vendor == vendor:
+                    success = await run_scraper(scraper_config, profiler) and success
+            # Also after errors, since the batches written before them are kept.
+            if rows_written() > written:
+                catalog_updated(vendor, scraper_sources(scraper_configs, vendor))
+            else:
+                print(f"Nothing written for {vendor}, keeping the catalog version")
+        return success
 
-    for scraper_config in scraper_configs:
-        print(
-            f"Running update function for {scraper_config.vendor}:{scraper_config.source}"
-        )
+    success = True
+    for vendor in dict.fromkeys(c.vendor for c in scraper_configs):
+        load = StagedLoad(vendor)
+        await asyncio.to_thread(load.create)
+        vendor_success = True
+        with load.active():
+            for scraper_config in scraper_configs:
+                if scraper_config.vendor == vendor:
+                    vendor_success = (
+                        await run_scraper(scraper_config, profiler) and vendor_success
+                    )
+        if not vendor_success:
+            print(f"Not replacing the {vendor} catalog since a scraper failed")
+            await asyncio.to_thread(load.drop)
+            success = False
+            continue
         try:
-            await scraper_config.scraper_func()
+            counts = await asyncio.to_thread(load.finish)
         except Exception as err:
-            print(
-                f"Error in {scraper_config.vendor}:{scraper_config.source}: {str(err)}"
-            )
+            print(f"Error in staged load of {vendor}: {str(err)}")
             success = False
-
+            continue
+        print(f"Replaced the {vendor} catalog with {counts}")
+        catalog_updated(vendor, scraper_sources(scraper_configs, vendor))
     return success
 
 
+async def run_scraper(
+    scraper_config: ScraperConfig, profiler: ScrapeProfiler | None = None
+) -> bool:
+    print(
+        f"Running update function for {scraper_config.vendor}:{scraper_config.source}"
+    )
+    try:
+        if profiler is not None:
+            with profiler.scraper(
+                f"{scraper_config.vendor}:{scraper_config.source}"
+            ):
+                await scraper_config.scraper_func()
+        else:
+            await scraper_config.scraper_func()
+    except Exception as err:
+        print(
+            f"Error in {scraper_config.vendor}:{scraper_config.source}: {str(err)}"
+        )
+        return False
+    return True
+
+
+def scraper_sources(scraper_configs: List[ScraperConfig], vendor: str) -> str:
+    """The vendor's scrapers that ran, as the source of its catalog version."""
+    return ",".join(
+        f"{c.vendor}:{c.source}" for c in scraper_configs if c.vendor == vendor
+    )
+
+
+def catalog_updated(vendor: str, source: str):
+    with Session(engine) as session:
+        closed, added = record_price_changes(session, vendor)
+        print(f"Price history of {vendor}: {closed} versions closed, {added} added")
+        refresh_facets(session, vendor)
+        # Cached API responses and facets are revalidated against the catalog
+        # version, so it's bumped once the facets are current.
+        version = bump_catalog_version(session, source)
+    print(f"Catalog version is now {version}")
+
+
 if __name__ == "__main__":
     app()
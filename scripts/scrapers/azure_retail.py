@@ -1,2 +1,254 @@
-def scrape():
-    pass
+import asyncio
+import hashlib
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+import httpx
+from sqlmodel import SQLModel
+
+from app.db.models import Price, Product
+from ..pipeline import BatchedDbSink, Pipeline, Stage
+
+
+# Can be pointed at a local server that replays recorded pages.
+base_url = os.environ.get(
+    "AZURE_RETAIL_PRICES_URL", "https://prices.azure.com/api/retail/prices"
+)
+api_version = "2023-01-01-preview"
+
+# Number of page chains fetched at the same time.
+concurrency = 16
+# Number of fetched pages that can wait to be written before fetching blocks.
+queue_size = 64
+# Number of rows written per transaction.
+batch_size = 5000
+max_retries = 5
+
+service_families = [
+    "AI + Machine Learning",
+    "Analytics",
+    "Azure Arc",
+    "Azure Communication Services",
+    "Azure Security",
+    "Azure Stack",
+    "Blockchain",
+    "Compute",
+    "Containers",
+    "Data",
+    "Databases",
+    "Developer Tools",
+    "Dynamics",
+    "Gaming",
+    "Integration",
+    "Internet of Things",
+    "Management and Governance",
+    "Microsoft Syntex",
+    "Mixed Reality",
+    "Networking",
+    "Other",
+    "Power Platform",
+    "Quantum Computing",
+    "Security",
+    "Storage",
+    "Telecommunications",
+    "Web",
+    "Windows Virtual Desktop",
+]
+
+# These families hold most of the catalog, so they are split further by region
+# to keep any single page chain short.
+region_split_families = ["Compute", "Databases", "Networking", "Storage"]
+
+regions = [
+    "australiacentral",
+    "australiaeast",
+    "australiasoutheast",
+    "brazilsouth",
+    "canadacentral",
+    "canadaeast",
+    "centralindia",
+    "centralus",
+    "eastasia",
+    "eastus",
+    "eastus2",
+    "francecentral",
+    "germanywestcentral",
+    "israelcentral",
+    "italynorth",
+    "japaneast",
+    "japanwest",
+    "koreacentral",
+    "koreasouth",
+    "mexicocentral",
+    "northcentralus",
+    "northeurope",
+    "norwayeast",
+    "polandcentral",
+    "qatarcentral",
+    "southafricanorth",
+    "southcentralus",
+    "southeastasia",
+    "southindia",
+    "spaincentral",
+    "swedencentral",
+    "switzerlandnorth",
+    "uaenorth",
+    "uksouth",
+    "ukwest",
+    "westcentralus",
+    "westeurope",
+    "westindia",
+    "westus",
+    "westus2",
+    "westus3",
+]
+
+price_hash_keys = [
+    "meterId",
+    "type",
+    "unitOfMeasure",
+    "tierMinimumUnits",
+    "reservationTerm",
+]
+
+
+async def scrape():
+    semaphore = asyncio.Semaphore(concurrency)
+    filters = partition_filters()
+    print(f"Fetching {len(filters)} partitions of the Azure retail prices API")
+
+    async with httpx.AsyncClient(timeout=60) as client:
+
+        async def source(emit):
+            await asyncio.gather(
+                *[fetch_chain(client, f, emit, semaphore) for f in filters]
+            )
+
+        await Pipeline(
+            name="azure:retail",
+            source=source,
+            stages=[
+                Stage("parse", parse_page, queue_size=queue_size, flatten=True)
+            ],
+            sink=BatchedDbSink(batch_size=batch_size),
+        ).run()
+
+
+def odata_quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def partition_filters() -> List[str]:
+    """Splits the catalog into filters that together cover every item exactly once."""
+    filters = []
+    for family in service_families:
+        family_clause = f"serviceFamily eq {odata_quote(family)}"
+        if family not in region_split_families:
+            filters.append(family_clause)
+            continue
+        for region in regions:
+            filters.append(
+                f"{family_clause} and armRegionName eq {odata_quote(region)}"
+            )
+        filters.append(
+            " and ".join(
+                [family_clause]
+                + [f"armRegionName ne {odata_quote(r)}" for r in regions]
+            )
+        )
+    filters.append(
+        " and ".join(f"serviceFamily ne {odata_quote(f)}" for f in service_families)
+    )
+    return filters
+
+
+async def fetch_chain(
+    client: httpx.AsyncClient,
+    odata_filter: str,
+    emit: Callable[[List[Dict[str, Any]]], Awaitable[None]],
+    semaphore: asyncio.Semaphore,
+):
+    url: str | None = base_url
+    params: Dict[str, str] | None = {
+        "api-version": api_version,
+        "$filter": odata_filter,
+    }
+    while url:
+        async with semaphore:
+            page = await get_page(client, url, params)
+        # Only the first request needs the params, NextPageLink already has them.
+        params = None
+        if page["Items"]:
+            # Blocks when the writer falls behind so fetching can't run away.
+            await emit(page["Items"])
+        url = page.get("NextPageLink")
+
+
+async def get_page(
+    client: httpx.AsyncClient, url: str, params: Dict[str, str] | None
+) -> Dict[str, Any]:
+    for attempt in range(max_retries):
+        try:
+            response = await client.get(url, params=params)
+        except httpx.TransportError as e:
+            print(f"Request failed with {e}, retrying")
+            await asyncio.sleep(2**attempt)
+            continue
+        if response.status_code == 429 or response.status_code >= 500:
+            delay = float(response.headers.get("Retry-After", 2**attempt))
+            print(f"Got {response.status_code}, sleeping for {delay}s and retrying")
+            await asyncio.sleep(delay)
+            continue
+        response.raise_for_status()
+        return response.json()
+    raise RuntimeError(f"Giving up on {url} after {max_retries} attempts")
+
+
+def parse_page(items: List[Dict[str, Any]]) -> List[SQLModel]:
+    rows: List[SQLModel] = []
+    for item in items:
+        rows.extend(parse_item(item))
+    return rows
+
+
+def parse_item(item: Dict[str, Any]) -> Tuple[Product, Price]:
+    region = item.get("armRegionName") or None
+    hash_str = f"azure-{region}-{item['productId']}-{item['skuId']}-{item['meterId']}"
+    product_hash = hashlib.sha256(hash_str.encode()).hexdigest()
+    product = Product(
+        product_hash=product_hash,
+        sku=item["skuId"],
+        vendor_name="azure",
+        region=region,
+        service=item["serviceName"],
+        product_family=item.get("serviceFamily") or "",
+        attributes={
+            "product_id": item["productId"],
+            "product_name": item.get("productName"),
+            "sku_name": item.get("skuName"),
+            "arm_sku_name": item.get("armSkuName"),
+            "meter_id": item["meterId"],
+            "meter_name": item.get("meterName"),
+            "location": item.get("location"),
+        },
+    )
+
+    price_hash_str = "-".join(str(item.get(key)) for key in price_hash_keys)
+    price_hash = hashlib.sha256(
+        f"{product_hash}-{price_hash_str}".encode()
+    ).hexdigest()
+    price = Price(
+        price_hash=price_hash,
+        purchase_option=item["type"],
+        unit=item["unitOfMeasure"],
+        usd=str(item["retailPrice"])
+        if item.get("currencyCode", "USD") == "USD"
+        else None,
+        effective_start_date=item["effectiveStartDate"],
+        start_usage_amount=str(item.get("tierMinimumUnits", 0)),
+        term_length=item.get("reservationTerm"),
+        currency=item.get("currencyCode"),
+        product_hash=product_hash,
+        vendor_name="azure",
+    )
+    return product, price
@@ -12,10 +12,10 @@ from google.cloud import billing
 from google.api_core.exceptions import ResourceExhausted
 import hashlib
 
-from sqlmodel import Session
+from sqlmodel import SQLModel
 
 from app.db.models import Price, Product as ProductModel
-from app.db.dependencies import engine
+from ..pipeline import BatchedDbSink, Pipeline, Stage
 
 
 @dataclass
@@ -124,41 +124,80 @@ async def download_service(service: Service, client: billing.CloudCatalogAsyncCl
         await f.write(json.dumps({"skus": json_skus}))
 
 
-async def load_all():
-    for filename in glob("data/gcp-*.json"):
-        print(f"Processing file: {filename}")
-        try:
-            await process_file(filename)
+async def load_all(filenames: List[str] | None = None):
+    if filenames is None:
+        filenames = glob("data/gcp-*.json")
+    failed = set()
+
+    async def source(emit):
+        for filename in filenames:
+            print(f"Processing file: {filename}")
+            await emit(filename)
+
+    def on_error(item, e: Exception):
+        filename = item if isinstance(item, str) else item[0]
+        print(f"Skipping file {filename} due to error {e}")
+        print(f"Error details: {str(e)}")
+        failed.add(filename)
+
+    await Pipeline(
+        name="gcp:catalog",
+        source=source,
+        stages=[
+            Stage(
+                "parse",
+                parse_file,
+                workers=os.cpu_count() or 1,
+                queue_size=2,
+                process=True,
+                on_error=on_error,
+            ),
+            Stage(
+                "transform", build_models, queue_size=2, flatten=True, on_error=on_error
+            ),
+        ],
+        sink=BatchedDbSink(batch_size=5000),
+    ).run()
+
+    for filename in filenames:
+        if filename not in failed:
             os.remove(filename)
-        except Exception as e:
-            print(f"Skipping file {filename} due to error {e}")
-            print(f"Error details: {str(e)}")
 
 
-async def process_file(filename: str):
-    async with aiofiles.open(filename, mode="r") as f:
-        content = await f.read()
-        json_data = json.loads(content)
-
-    with Session(engine) as session:
-        for product_json in json_data["skus"]:
-            for region in product_json["service_regions"]:
-                # sku_id = product_json["sku_id"]
-                # hash_str = f"gcp-{region}-{sku_id}"
-                # product_hash = hashlib.sha256(hash_str.encode()).hexdigest()
-                # stmt = select(ProductModel).where(
-                #     ProductModel.product_hash == product_hash
-                # )
-                # product = session.exec(stmt).first()
-                # if product is not None:
-                #     print(f"Skipping since it already exists {product_hash}")
-                #     return
-                product, prices = parse_product(product_json, region)
-                session.merge(product)
-                for price in prices:
-                    session.merge(price)
-
-        session.commit()
+# A product in a region along with its product hash and the hashes of its prices.
+ParsedProduct = Tuple[Dict[str, Any], str, str, List[str]]
+
+
+def parse_file(filename: str) -> Tuple[str, List[ParsedProduct]]:
+    """Reads a downloaded file and hashes its products, runs in the process pool.
+
+    Only the filename is sent to the worker, so the file's contents aren't
+    pickled across processes.
+    """
+    with open(filename) as f:
+        return filename, hash_products(json.load(f))
+
+
+def hash_products(json_data: Dict[str, Any]) -> List[ParsedProduct]:
+    parsed = []
+    for product_json in json_data["skus"]:
+        for region in product_json["service_regions"]:
+            product_hash = get_product_hash(product_json["sku_id"], region)
+            price_hashes = [
+                get_price_hash(product_hash, price) for price in product_json["prices"]
+            ]
+            parsed.append((product_json, region, product_hash, price_hashes))
+    return parsed
+
+
+def build_models(item: Tuple[str, List[ParsedProduct]]) -> List[SQLModel]:
+    _, parsed = item
+    rows: List[SQLModel] = []
+    for product_json, region, product_hash, price_hashes in parsed:
+        product, prices = parse_product(product_json, region, product_hash, price_hashes)
+        rows.append(product)
+        rows.extend(prices)
+    return rows
 
 
 price_hash_keys = [
@@ -172,12 +211,31 @@ price_hash_keys = [
 ]
 
 
+def get_product_hash(sku_id: str, region: str) -> str:
+    hash_str = f"gcp-{region}-{sku_id}"
+    return hashlib.sha256(hash_str.encode()).hexdigest()
+
+
+def get_price_hash(product_hash: str, price: Dict[str, Any]) -> str:
+    price_hash_str = "-".join(
+        [str(price[key]) for key in price_hash_keys if key in price]
+    )
+    return hashlib.sha256(f"{product_hash}-{price_hash_str}".encode()).hexdigest()
+
+
 def parse_product(
-    product: Dict[str, Any], region: str
+    product: Dict[str, Any],
+    region: str,
+    product_hash: str | None = None,
+    price_hashes: List[str] | None = None,
 ) -> Tuple[ProductModel, list[Price]]:
     sku_id = product["sku_id"]
-    hash_str = f"gcp-{region}-{sku_id}"
-    product_hash = hashlib.sha256(hash_str.encode()).hexdigest()
+    if product_hash is None:
+        product_hash = get_product_hash(sku_id, region)
+    if price_hashes is None:
+        price_hashes = [get_price_hash(product_hash, p) for p in product["prices"]]
+    # prices is left unset so merging the product doesn't detach prices that
+    # are written in a later batch.
     db_product: ProductModel = ProductModel(
         product_hash=product_hash,
         sku=sku_id,
@@ -186,17 +244,10 @@ def parse_product(
         service=product["service_display_name"],
         product_family=product["product_family"],
         attributes=product["attributes"],
-        prices=[],
     )
 
     prices = []
-    for price in product["prices"]:
-        price_hash_str = "-".join(
-            [str(price[key]) for key in price_hash_keys if key in price]
-        )
-        price_hash = hashlib.sha256(
-            f"{product_hash}-{price_hash_str}".encode()
-        ).hexdigest()
+    for price, price_hash in zip(product["prices"], price_hashes):
         price = Price(
             price_hash=price_hash,
             purchase_option=price["purchase_option"],
@@ -206,6 +257,7 @@ def parse_product(
             start_usage_amount=price["start_usage_amount"],
             end_usage_amount=price["end_usage_amount"],
             product_hash=product_hash,
+            vendor_name="gcp",
         )
         prices.append(price)
 
@@ -1,13 +1,17 @@
+import asyncio
+from dataclasses import dataclass, field
 from datetime import datetime
 import hashlib
 import re
-from typing import Dict, Literal, Tuple
+from typing import Any, Dict, List, Literal, Tuple
 
 from google.cloud import compute
-from sqlmodel import Session, and_, func, select
+from sqlalchemy import select
 
-from app.db.models import Price, Product
 from app.db.dependencies import engine
+from app.db.models import Price, Product
+from ..pipeline import BatchedDbSink
+from ..staging import catalog_tables
 
 
 machine_type_description_lookups: Dict[str, Dict[str, str]] = {
@@ -54,60 +58,94 @@ machine_type_overrides: Dict[str, Dict[str, float]] = {
 }
 
 
-async def scrape():
-    with Session(engine) as db:
-        mt_client = compute.MachineTypesClient()
-        region_client = compute.RegionsClient()
+@dataclass
+class ComputeSku:
+    """A Compute Engine SKU of the gcp:catalog scraper, machine types are
+    priced from its CPU and memory SKUs.
+    """
 
-        regions = region_client.list(project="infra-new-dev")
-        for region in regions:
-            region_zones = [z.split("/")[-1] for z in region.zones]
+    description: str
+    prices: List[Any] = field(default_factory=list)
 
-            machine_types = mt_client.list(
-                project="infra-new-dev", zone=region_zones[0]
-            )
 
-            for machine_type in machine_types:
-                sku = f"gcp-machine-type-generated-{machine_type.name}"
-                hash_str = f"gcp-{region}-{sku}"
-                product_hash = hashlib.sha256(hash_str.encode()).hexdigest()
-                db_product = Product(
-                    product_hash=product_hash,
-                    sku=sku,
-                    vendor_name="gcp",
-                    region=region.name,
-                    service="Compute Engine",
-                    product_family="Compute Instance",
-                    attributes={
-                        "machine_type": machine_type.name,
-                    },
-                )
-                db.add(db_product)
-
-                on_demand_price = machineTypeToPrice(
-                    db_product,
-                    machine_type,
-                    "on_demand",
-                    db,
-                )
-                if on_demand_price is not None:
-                    db.add(on_demand_price)
-                preemptible_price = machineTypeToPrice(
-                    db_product,
-                    machine_type,
-                    "preemptible",
-                    db,
-                )
-                if preemptible_price is not None:
-                    db.add(preemptible_price)
-        db.commit()
+async def scrape():
+    # Reads the SKUs gcp:catalog wrote, during a staged load from the staging
+    # tables, and writes through the sink for the same reason.
+    skus = await asyncio.to_thread(load_compute_skus)
+    sink = BatchedDbSink()
+    mt_client = compute.MachineTypesClient()
+    region_client = compute.RegionsClient()
+
+    regions = region_client.list(project="infra-new-dev")
+    for region in regions:
+        region_zones = [z.split("/")[-1] for z in region.zones]
+
+        machine_types = mt_client.list(project="infra-new-dev", zone=region_zones[0])
+
+        rows: List[Product | Price] = []
+        for machine_type in machine_types:
+            sku = f"gcp-machine-type-generated-{machine_type.name}"
+            hash_str = f"gcp-{region}-{sku}"
+            product_hash = hashlib.sha256(hash_str.encode()).hexdigest()
+            db_product = Product(
+                product_hash=product_hash,
+                sku=sku,
+                vendor_name="gcp",
+                region=region.name,
+                service="Compute Engine",
+                product_family="Compute Instance",
+                attributes={
+                    "machine_type": machine_type.name,
+                },
+            )
+            rows.append(db_product)
+
+            for purchase_option in ("on_demand", "preemptible"):
+                price = machineTypeToPrice(db_product, machine_type, purchase_option, skus)
+                if price is not None:
+                    rows.append(price)
+        if rows:
+            await asyncio.to_thread(sink.write, rows)
+
+
+def load_compute_skus() -> Dict[str, List[ComputeSku]]:
+    """Compute Engine SKUs with their prices, by region."""
+    tables = catalog_tables()
+    product, price = tables["product"], tables["price"]
+    stmt = (
+        select(
+            product.c.product_hash,
+            product.c.region,
+            product.c.attributes,
+            price.c.usd,
+            price.c.end_usage_amount,
+            price.c.effective_start_date,
+            price.c.effective_date_end,
+        )
+        .join(price, price.c.product_hash == product.c.product_hash)
+        .where(
+            product.c.vendor_name == "gcp",
+            product.c.service == "Compute Engine",
+            product.c.product_family == "Compute",
+        )
+        .order_by(product.c.product_hash)
+    )
+    skus: Dict[str, Dict[str, ComputeSku]] = {}
+    with engine.connect() as conn:
+        for row in conn.execute(stmt):
+            by_hash = skus.setdefault(row.region or "", {})
+            if row.product_hash not in by_hash:
+                description = (row.attributes or {}).get("description") or ""
+                by_hash[row.product_hash] = ComputeSku(description)
+            by_hash[row.product_hash].prices.append(row)
+    return {region: list(by_hash.values()) for region, by_hash in skus.items()}
 
 
 def machineTypeToPrice(
     product: Product,
     machine_type: compute.MachineType,
     purchase_option: Literal["on_demand", "preemptible"],
-    session: Session,
+    skus: Dict[str, List[ComputeSku]],
 ):
     prefix = machine_type.name.split("-")[0]
 
@@ -119,11 +157,11 @@ def machineTypeToPrice(
     result = None
     if "total" in description_lookup:
         result = calculate_amount_from_total(
-            product, machine_type, purchase_option, description_lookup["total"], session
+            product, machine_type, purchase_option, description_lookup["total"], skus
         )
     else:
         result = calculate_amount_from_cpu_and_mem(
-            product, machine_type, purchase_option, session, description_lookup
+            product, machine_type, purchase_option, skus, description_lookup
         )
     if result is None:
         print(
@@ -142,6 +180,7 @@ def machineTypeToPrice(
         usd=str(amount),
         effective_start_date=effective_date_start,
         product_hash=product.product_hash,
+        vendor_name=product.vendor_name,
     )
 
 
@@ -150,13 +189,13 @@ def calculate_amount_from_total(
     machine_type: compute.MachineType,
     purchase_option: Literal["on_demand", "preemptible"],
     description: str,
-    session: Session,
+    skus: Dict[str, List[ComputeSku]],
 ) -> Tuple[float, str] | None:
     desc_regex = re.compile(f"^{description}")
     if purchase_option == "preemptible":
         desc_regex = re.compile(f"^Spot Preemptible {description}")
 
-    matched_product = find_compute_products(product.region or "", desc_regex, session)
+    matched_product = find_compute_products(product.region or "", desc_regex, skus)
 
     if not matched_product:
         print(
@@ -178,7 +217,7 @@ def calculate_amount_from_cpu_and_mem(
     product: Product,
     machine_type: compute.MachineType,
     purchase_option: str,
-    session: Session,
+    skus: Dict[str, List[ComputeSku]],
     description_lookup: Dict[str, str],
 ) -> Tuple[float, str] | None:
     cpu_desc = description_lookup["cpu"]
@@ -190,8 +229,8 @@ def calculate_amount_from_cpu_and_mem(
         cpu_desc_regex = re.compile(f"^Spot Preemptible {cpu_desc}")
         mem_desc_regex = re.compile(f"^Spot Preemptible {mem_desc}")
 
-    cpu_product = find_compute_products(product.region or "", cpu_desc_regex, session)
-    mem_product = find_compute_products(product.region or "", mem_desc_regex, session)
+    cpu_product = find_compute_products(product.region or "", cpu_desc_regex, skus)
+    mem_product = find_compute_products(product.region or "", mem_desc_regex, skus)
 
     if not cpu_product:
         print(
@@ -233,18 +272,6 @@ def calculate_amount_from_cpu_and_mem(
 
 
 def find_compute_products(
-    region: str, description: re.Pattern, db: Session
-) -> Product | None:
-    stmt = select(Product).where(
-        and_(
-            Product.vendor_name == "gcp",
-            Product.service == "Compute Engine",
-            Product.product_family == "Compute",
-            Product.region == region,
-            func.json_extract_path_text(Product.attributes, "description").op("~")(
-                description.pattern
-            ),
-        )
-    )
-
-    return db.exec(stmt).first()
+    region: str, description: re.Pattern, skus: Dict[str, List[ComputeSku]]
+) -> ComputeSku | None:
+    return next((s for s in skus.get(region, []) if description.search(s.description)), None)
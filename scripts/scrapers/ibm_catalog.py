@@ -1,2 +1,51 @@
-def scrape():
-    pass
+from typing import Any, Dict, List
+
+from . import ibm_global_catalog as catalog
+from .ibm_kubernetes import kubernetes_services
+
+
+# Catalog category tags, in order of preference, and the product family they map to.
+category_families = {
+    "compute": "Compute",
+    "containers": "Containers",
+    "storage": "Storage",
+    "network": "Network",
+    "databases": "Databases",
+    "analytics": "Analytics",
+    "ai": "AI",
+    "security": "Security",
+    "devops": "DevOps",
+    "logging_monitoring": "Logging and Monitoring",
+    "integration": "Integration",
+    "iot": "Internet of Things",
+    "blockchain": "Blockchain",
+    "developer_tools": "Developer Tools",
+}
+
+
+def product_family(service: Dict[str, Any]) -> str:
+    """The family of a service's products, from its catalog category tags."""
+    tags = set(service.get("tags", []))
+    for tag, family in category_families.items():
+        if tag in tags:
+            return family
+    # Uncategorised services fall back to their catalog kind.
+    return service.get("kind", "service")
+
+
+async def scrape():
+    async def list_services(client: catalog.CatalogClient) -> List[Dict[str, Any]]:
+        print("Listing IBM catalog services")
+        return [
+            s
+            for s in await client.services("kind:service active:true")
+            # These are written by the ibm:kubernetes scraper.
+            if s.get("name") not in kubernetes_services
+        ]
+
+    def parse(node: catalog.Node, pricing: Dict[str, Any]):
+        return catalog.parse_pricing(
+            node, pricing, product_family=product_family(node.service)
+        )
+
+    await catalog.scrape_pricing("ibm:catalog", list_services, parse)
@@ -0,0 +1,309 @@
+"""Shared crawler for the IBM Cloud global catalog.
+
+The catalog is a tree of services -> plans -> deployments, with pricing hanging
+off each deployment. Nodes are expanded breadth first by a fixed pool of
+workers, every catalog listing is fetched at most once per crawl, and the
+resulting products are written in batches by a scraper pipeline.
+"""
+
+import asyncio
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+from urllib.parse import urlencode
+
+import httpx
+
+from app.db.models import Price, Product
+from ..pipeline import BatchedDbSink, Pipeline, Stage
+
+
+# Can be pointed at a local fixture server.
+base_url = os.environ.get(
+    "IBM_GLOBAL_CATALOG_URL", "https://globalcatalog.cloud.ibm.com/api/v1"
+)
+
+# Number of requests in flight and number of nodes expanded at the same time.
+concurrency = 16
+page_size = 200
+# Number of rows written per transaction.
+batch_size = 2000
+max_retries = 5
+
+
+@dataclass
+class Node:
+    entry: Dict[str, Any]
+    service: Dict[str, Any]
+    plan: Dict[str, Any] | None = None
+
+
+class CatalogClient:
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.semaphore = asyncio.Semaphore(concurrency)
+        # Catalog listings keyed by request URL, so concurrent and repeated
+        # requests for a shared node are served by a single fetch. Pricing
+        # isn't kept, it is only read once and would grow with the crawl.
+        self.responses: Dict[str, asyncio.Task] = {}
+
+    async def get_json(
+        self, path: str, params: Dict[str, Any] | None = None, shared: bool = True
+    ) -> Dict[str, Any] | None:
+        url = f"{base_url}{path}"
+        if params:
+            url = f"{url}?{urlencode(sorted(params.items()))}"
+        if not shared:
+            return await self._fetch(url)
+        task = self.responses.get(url)
+        if task is None:
+            task = asyncio.create_task(self._fetch(url))
+            self.responses[url] = task
+        return await task
+
+    async def _fetch(self, url: str) -> Dict[str, Any] | None:
+        for attempt in range(max_retries):
+            try:
+                async with self.semaphore:
+                    response = await self.client.get(url)
+            except httpx.TransportError as e:
+                print(f"Request failed with {e}, retrying")
+                await asyncio.sleep(2**attempt)
+                continue
+            if response.status_code == 404:
+                return None
+            if response.status_code == 429 or response.status_code >= 500:
+                delay = float(response.headers.get("Retry-After", 2**attempt))
+                print(f"Got {response.status_code}, sleeping for {delay}s and retrying")
+                await asyncio.sleep(delay)
+                continue
+            response.raise_for_status()
+            return response.json()
+        raise RuntimeError(f"Giving up on {url} after {max_retries} attempts")
+
+    async def list_entries(
+        self, path: str, params: Dict[str, Any] | None = None
+    ) -> List[Dict[str, Any]]:
+        params = {**(params or {}), "_limit": page_size}
+        first = await self.get_json(path, {**params, "_offset": 0})
+        if first is None:
+            return []
+        resources = list(first.get("resources", []))
+        total = first.get("resource_count", len(resources))
+        # The total is known after the first page, so the rest are fetched at once.
+        pages = await asyncio.gather(
+            *[
+                self.get_json(path, {**params, "_offset": offset})
+                for offset in range(page_size, total, page_size)
+            ]
+        )
+        for page in pages:
+            if page is not None:
+                resources.extend(page.get("resources", []))
+        return resources
+
+    async def services(self, query: str) -> List[Dict[str, Any]]:
+        return await self.list_entries("", {"q": query, "complete": "true"})
+
+    async def children(self, entry_id: str, kind: str) -> List[Dict[str, Any]]:
+        return await self.list_entries(f"/{entry_id}/{kind}", {"complete": "true"})
+
+    async def pricing(self, deployment_id: str) -> Dict[str, Any] | None:
+        return await self.get_json(f"/{deployment_id}/pricing", shared=False)
+
+
+async def crawl(
+    roots: List[Node], expand: Callable[[Node], Awaitable[List[Node]]]
+) -> int:
+    """Expands nodes breadth first with a bounded number of workers.
+
+    Each catalog entry is expanded once, even if it is reachable from more than
+    one parent. A node that fails to expand is skipped along with its subtree
+    so the rest of the crawl can finish, and the number skipped is returned.
+    """
+    queue: asyncio.Queue[Node] = asyncio.Queue()
+    seen = set()
+    skipped = 0
+    for root in roots:
+        if root.entry["id"] not in seen:
+            seen.add(root.entry["id"])
+            queue.put_nowait(root)
+
+    async def worker():
+        nonlocal skipped
+        while True:
+            node = await queue.get()
+            try:
+                for child in await expand(node):
+                    if child.entry["id"] not in seen:
+                        seen.add(child.entry["id"])
+                        queue.put_nowait(child)
+            except Exception as e:
+                print(f"Skipping {node.entry.get('name')} due to error {e}")
+                skipped += 1
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        await queue.join()
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    print(f"Crawled {len(seen)} IBM catalog entries, skipped {skipped}")
+    return skipped
+
+
+async def crawl_pricing(
+    client: CatalogClient,
+    services: List[Dict[str, Any]],
+    on_pricing: Callable[[Node, Dict[str, Any]], Awaitable[None]],
+) -> int:
+    """Walks services -> plans -> deployments and calls on_pricing for each priced deployment.
+
+    Returns the number of entries skipped after errors.
+    """
+
+    async def expand(node: Node) -> List[Node]:
+        kind = node.entry.get("kind")
+        if kind == "service":
+            plans = await client.children(node.entry["id"], "plan")
+            return [Node(entry=p, service=node.service) for p in plans]
+        if kind == "plan":
+            deployments = await client.children(node.entry["id"], "deployment")
+            return [
+                Node(entry=d, service=node.service, plan=node.entry)
+                for d in deployments
+            ]
+        if kind == "deployment":
+            pricing = await client.pricing(node.entry["id"])
+            if pricing and pricing.get("metrics"):
+                await on_pricing(node, pricing)
+        return []
+
+    return await crawl([Node(entry=s, service=s) for s in services], expand)
+
+
+async def scrape_pricing(
+    name: str,
+    list_services: Callable[[CatalogClient], Awaitable[List[Dict[str, Any]]]],
+    parse: Callable[[Node, Dict[str, Any]], Tuple[Product, List[Price]]],
+):
+    async with httpx.AsyncClient(timeout=60) as http_client:
+        client = CatalogClient(http_client)
+        services = await list_services(client)
+        print(f"Crawling {len(services)} IBM catalog services")
+
+        skipped = 0
+
+        async def source(emit):
+            nonlocal skipped
+
+            async def on_pricing(node: Node, pricing: Dict[str, Any]):
+                await emit((node, pricing))
+
+            skipped = await crawl_pricing(client, services, on_pricing)
+
+        def parse_rows(item: Tuple[Node, Dict[str, Any]]) -> List[Any]:
+            product, prices = parse(*item)
+            return [product, *prices]
+
+        await Pipeline(
+            name=name,
+            source=source,
+            stages=[Stage("parse", parse_rows, flatten=True)],
+            sink=BatchedDbSink(batch_size=batch_size),
+        ).run()
+    # Raised after the pipeline so the rows that were crawled are still written,
+    # but the run is reported as failed and a staged load isn't swapped in.
+    if skipped:
+        raise RuntimeError(f"Skipped {skipped} IBM catalog entries after errors")
+
+
+def display_name(entry: Dict[str, Any]) -> str:
+    return (
+        entry.get("overview_ui", {}).get("en", {}).get("display_name")
+        or entry.get("name")
+        or entry["id"]
+    )
+
+
+def parse_pricing(
+    node: Node, pricing: Dict[str, Any], product_family: str
+) -> Tuple[Product, List[Price]]:
+    deployment = node.entry
+    plan = node.plan or {}
+    region = (
+        pricing.get("deployment_location")
+        or deployment.get("metadata", {}).get("deployment", {}).get("location")
+        or None
+    )
+    hash_str = f"ibm-{region}-{deployment['id']}"
+    product_hash = hashlib.sha256(hash_str.encode()).hexdigest()
+    product = Product(
+        product_hash=product_hash,
+        sku=plan.get("id", deployment["id"]),
+        vendor_name="ibm",
+        region=region,
+        service=display_name(node.service),
+        product_family=product_family,
+        attributes={
+            "service_name": node.service.get("name"),
+            "plan_name": plan.get("name"),
+            "plan_display_name": display_name(plan) if plan else None,
+            "deployment_id": deployment["id"],
+            "deployment_name": deployment.get("name"),
+            "pricing_type": pricing.get("type"),
+        },
+    )
+
+    prices = []
+    for metric in pricing.get("metrics", []):
+        for amount in metric.get("amounts", []):
+            if amount.get("country") != "USA":
+                continue
+            start_usage_amount = 0.0
+            for tier in amount.get("prices", []):
+                end_usage_amount = tier.get("quantity_tier")
+                price_hash_str = "-".join(
+                    [
+                        str(metric.get("part_ref")),
+                        str(metric.get("metric_id")),
+                        str(amount.get("currency")),
+                        str(start_usage_amount),
+                    ]
+                )
+                price_hash = hashlib.sha256(
+                    f"{product_hash}-{price_hash_str}".encode()
+                ).hexdigest()
+                prices.append(
+                    Price(
+                        price_hash=price_hash,
+                        purchase_option=pricing.get("type") or "paid",
+                        unit=metric.get("charge_unit_name")
+                        or metric.get("charge_unit")
+                        or "",
+                        usd=str(tier.get("price"))
+                        if amount.get("currency") == "USD"
+                        else None,
+                        effective_start_date=metric.get("effective_from")
+                        or pricing.get("effective_from")
+                        or "",
+                        start_usage_amount=str(start_usage_amount),
+                        end_usage_amount=str(end_usage_amount)
+                        if end_usage_amount is not None
+                        else None,
+                        description=metric.get("charge_unit_display_name"),
+                        tier_model=metric.get("tier_model"),
+                        country=amount.get("country"),
+                        currency=amount.get("currency"),
+                        part_number=metric.get("part_ref"),
+                        product_hash=product_hash,
+                        vendor_name="ibm",
+                    )
+                )
+                if end_usage_amount is not None:
+                    start_usage_amount = end_usage_amount
+    return product, prices
@@ -1,2 +1,24 @@
-def scrape():
-    pass
+from typing import Any, Dict, List
+
+from . import ibm_global_catalog as catalog
+
+
+kubernetes_services = ["containers-kubernetes", "openshift"]
+
+
+async def scrape():
+    async def list_services(client: catalog.CatalogClient) -> List[Dict[str, Any]]:
+        services = []
+        for name in kubernetes_services:
+            services.extend(await client.services(f"name:{name} kind:service"))
+        return services
+
+    def parse(node: catalog.Node, pricing: Dict[str, Any]):
+        product, prices = catalog.parse_pricing(
+            node, pricing, product_family="Kubernetes"
+        )
+        # Worker flavors are modelled as deployments of the cluster plans.
+        product.attributes["flavor"] = node.entry.get("name")
+        return product, prices
+
+    await catalog.scrape_pricing("ibm:kubernetes", list_services, parse)
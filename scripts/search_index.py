@@ -0,0 +1,49 @@
+"""Adds product.search_vector and its index to an existing database.
+
+    python -m scripts.search_index
+
+Databases created since the column exists get it from create_all. Adding it
+computes the column for every product, which on Postgres rewrites the table.
+"""
+
+import typer
+from sqlalchemy import Column, Computed, Connection, inspect, text
+from sqlalchemy.schema import CreateColumn
+
+from app.db.dependencies import engine
+from app.db.models import Product
+
+app = typer.Typer()
+
+
+def add_search_vector(conn: Connection) -> bool:
+    """Adds the column and its index if they're missing, returns whether it did."""
+    if "search_vector" in {c["name"] for c in inspect(conn).get_columns("product")}:
+        return False
+    column = Product.__table__.c.search_vector  # type: ignore
+    # SQLite can only add generated columns that aren't stored.
+    persisted = conn.dialect.name != "sqlite"
+    ddl = CreateColumn(
+        Column(column.name, column.type, Computed(column.computed.sqltext, persisted=persisted))
+    ).compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE product ADD COLUMN {ddl}"))
+    for index in Product.__table__.indexes:  # type: ignore
+        if "search_vector" in index.columns:
+            index.create(conn, checkfirst=True)
+    return True
+
+
+@app.command()
+def add():
+    """
+    Add product.search_vector and its full-text index.
+    """
+    with engine.begin() as conn:
+        if add_search_vector(conn):
+            print("Added product.search_vector")
+        else:
+            print("product.search_vector already exists")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,421 @@
+"""Staged loads of a vendor's catalog.
+
+    python -m scripts.scrape --staged --only=gcp:catalog --only=gcp:machine-types
+    python -m scripts.staging  # partitions product and price on Postgres
+
+A staged load writes all of a vendor's rows into staging tables that readers
+never see. Once every scraper of the vendor has finished, the staging tables
+are indexed, their row counts are checked against the live data, and they
+replace the vendor's rows in a single transaction. A failed scrape leaves the
+live catalog as it was. Scrapers write through scripts.pipeline.BatchedDbSink
+and read the catalog they build from catalog_tables(); writing to the live
+tables during a staged load fails the scraper.
+
+On Postgres, after `partition` has split product and price into a partition
+per vendor_name, the staging tables become the vendor's new partitions: the old
+ones are detached and dropped and the new ones attached. The serving tables
+get no row writes and no index updates, and readers are blocked only for the
+catalog lock of the swap. On other databases the vendor's rows are deleted
+and copied from the staging tables in one transaction.
+"""
+
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List
+
+import typer
+from sqlalchemy import (
+    Column,
+    Computed,
+    Connection,
+    Delete,
+    Index,
+    Insert,
+    MetaData,
+    Table,
+    Update,
+    event,
+    func,
+    select,
+    text,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import SQLModel
+
+from app.db.dependencies import engine
+from app.db.models import Price, Product
+from scripts.search_index import add_search_vector
+
+app = typer.Typer()
+
+# A load with fewer products than this fraction of the vendor's current
+# products is rejected, as it's more likely a broken scrape than a smaller catalog.
+min_row_ratio = 0.5
+
+# Live tables in the order rows are copied, products before their prices.
+live_tables: List[Table] = [Product.__table__, Price.__table__]  # type: ignore
+
+# The staged load that scripts.pipeline.BatchedDbSink writes to. It's copied
+# into the threads the sinks write from.
+_active_load: ContextVar["StagedLoad | None"] = ContextVar("active_load", default=None)
+
+
+class StagedLoadError(Exception):
+    pass
+
+
+def active_load() -> "StagedLoad | None":
+    return _active_load.get()
+
+
+def catalog_tables() -> Dict[str, Table]:
+    """Tables with the catalog being loaded: the staging tables of the active
+    load, or else the live tables.
+    """
+    load = active_load()
+    if load is not None:
+        return load.staging
+    return {table.name: table for table in live_tables}
+
+
+@event.listens_for(engine, "before_execute")
+def _reject_live_writes(conn: Connection, statement: Any, *args: Any):
+    # The swap would drop rows written past the staging tables.
+    load = active_load()
+    if (
+        load is not None
+        and isinstance(statement, (Insert, Update, Delete))
+        and statement.table in live_tables
+    ):
+        raise StagedLoadError(
+            f"Wrote to {statement.table.name} during the staged load of "
+            f"{load.vendor}, write through scripts.pipeline.BatchedDbSink"
+        )
+
+
+def is_partitioned(conn: Connection, table: str) -> bool:
+    if conn.dialect.name != "postgresql":
+        return False
+    relkind = conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"),
+        {"table": table},
+    ).scalar()
+    return relkind == "p"
+
+
+def vendor_partition(conn: Connection, table: str, vendor: str) -> str | None:
+    """Name of the partition of `table` that holds `vendor`, if there is one."""
+    return conn.execute(
+        text(
+            """
+            SELECT child.relname FROM pg_inherits
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = to_regclass(:table)
+            AND pg_get_expr(child.relpartbound, child.oid) = :bound
+            """
+        ),
+        {"table": table, "bound": f"FOR VALUES IN ({quote_literal(vendor)})"},
+    ).scalar()
+
+
+def quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def copy_table(table: Table, name: str, metadata: MetaData) -> Table:
+    """Same columns and primary key as `table`, without foreign keys and indexes.
+
+    Generated columns stay generated, partitions must match their parent.
+    """
+    columns = []
+    for c in table.columns:
+        computed = (
+            [Computed(c.computed.sqltext, persisted=c.computed.persisted)]
+            if c.computed is not None
+            else []
+        )
+        columns.append(
+            Column(c.name, c.type, *computed, primary_key=c.primary_key, nullable=c.nullable)
+        )
+    return Table(name, metadata, *columns)
+
+
+def written_columns(table: Table) -> List[str]:
+    """Columns that take values, all but the generated ones."""
+    return [c.name for c in table.columns if c.computed is None]
+
+
+def upsert(
+    conn: Connection,
+    tables: Dict[str, Table],
+    rows: List[SQLModel],
+    vendor: str | None = None,
+):
+    """Inserts catalog rows into `tables`, keyed by live table name, and updates
+    the ones that exist. The last row with a key wins. Rows without a
+    vendor_name get `vendor`.
+    """
+    by_table: Dict[str, Dict[tuple, Dict]] = {}
+    for row in rows:
+        table: Table = row.__table__  # type: ignore
+        if table.name not in tables:
+            raise ValueError(f"{table.name} isn't a catalog table")
+        values = {name: getattr(row, name) for name in written_columns(table)}
+        if "vendor_name" in values and values["vendor_name"] is None:
+            values["vendor_name"] = vendor
+        key = tuple(values[c.name] for c in table.primary_key.columns)
+        # Postgres can't update a row twice in one statement.
+        by_table.setdefault(table.name, {})[key] = values
+    insert = postgresql.insert if conn.dialect.name == "postgresql" else sqlite.insert
+    for live in live_tables:
+        values = list(by_table.get(live.name, {}).values())
+        if not values:
+            continue
+        target = tables[live.name]
+        keys = [c.name for c in target.primary_key.columns]
+        # Stays below the bind parameter limit of a statement.
+        chunk_size = max(1, 30_000 // len(target.columns))
+        for start in range(0, len(values), chunk_size):
+            stmt = insert(target).values(values[start : start + chunk_size])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=keys,
+                set_={
+                    c.name: stmt.excluded[c.name]
+                    for c in target.columns
+                    if c.name not in keys and c.computed is None
+                },
+            )
+            conn.execute(stmt)
+
+
+def copy_indexes(table: Table, staging: Table, suffix: str, dialect: str) -> List[Index]:
+    """Indexes of `table` on `staging`.
+
+    Indexes with options of another database only, like the GIN index of
+    product.search_vector, are left out.
+    """
+    return [
+        Index(
+            f"{index.name}_{suffix}",
+            *[staging.c[c.name] for c in index.columns],
+            **index.dialect_kwargs,
+        )
+        for index in table.indexes
+        if all(key.startswith(f"{dialect}_") for key in index.dialect_kwargs)
+    ]
+
+
+class StagedLoad:
+    def __init__(self, vendor: str, min_row_ratio: float = min_row_ratio):
+        self.vendor = vendor
+        self.min_row_ratio = min_row_ratio
+        # Unique per load, since the staging tables keep their name once
+        # they're attached and the previous partitions exist until the swap.
+        self.suffix = f"{re.sub(r'[^a-z0-9]', '_', vendor.lower())}_{int(time.time())}"
+        self.metadata = MetaData()
+        self.staging = {
+            table.name: copy_table(table, f"{table.name}_{self.suffix}", self.metadata)
+            for table in live_tables
+        }
+
+    @contextmanager
+    def active(self) -> Iterator["StagedLoad"]:
+        token = _active_load.set(self)
+        try:
+            yield self
+        finally:
+            _active_load.reset(token)
+
+    def create(self):
+        self.metadata.drop_all(engine)
+        self.metadata.create_all(engine)
+
+    def drop(self):
+        self.metadata.drop_all(engine)
+
+    def write(self, rows: List[SQLModel]):
+        """Inserts rows into the staging tables, the last row with a key wins."""
+        with engine.begin() as conn:
+            upsert(conn, self.staging, rows, vendor=self.vendor)
+
+    def finish(self) -> Dict[str, int]:
+        """Indexes and validates the staging tables and swaps them in.
+
+        Returns the number of rows per table. The staging tables are dropped
+        if validation or the swap fails, the live tables are then unchanged.
+        """
+        try:
+            with engine.begin() as conn:
+                counts = self.validate(conn)
+            with engine.begin() as conn:
+                for live in live_tables:
+                    staging = self.staging[live.name]
+                    for index in copy_indexes(live, staging, self.suffix, conn.dialect.name):
+                        index.create(conn)
+                    if conn.dialect.name == "postgresql":
+                        conn.execute(text(f"ANALYZE {staging.name}"))
+            with engine.connect() as conn:
+                partitioned = all(is_partitioned(conn, t.name) for t in live_tables)
+            if partitioned:
+                with engine.begin() as conn:
+                    self._attach(conn)
+            else:
+                self._replace()
+        except Exception:
+            self.drop()
+            raise
+        return counts
+
+    def validate(self, conn: Connection) -> Dict[str, int]:
+        counts = {
+            live.name: conn.execute(
+                select(func.count()).select_from(self.staging[live.name])
+            ).scalar_one()
+            for live in live_tables
+        }
+        products = counts[Product.__tablename__]
+        current = conn.execute(
+            select(func.count())
+            .select_from(Product)
+            .where(Product.vendor_name == self.vendor)  # type: ignore
+        ).scalar_one()
+        if products == 0 or products < current * self.min_row_ratio:
+            raise StagedLoadError(
+                f"Staged load of {self.vendor} has {products} products, the catalog "
+                f"has {current}, refusing to replace it"
+            )
+        orphans = conn.execute(
+            text(
+                f"SELECT count(*) FROM {self.staging['price'].name} price "
+                f"WHERE NOT EXISTS (SELECT 1 FROM {self.staging['product'].name} product "
+                "WHERE product.product_hash = price.product_hash)"
+            )
+        ).scalar_one()
+        if orphans:
+            raise StagedLoadError(
+                f"Staged load of {self.vendor} has {orphans} prices without a product"
+            )
+        return counts
+
+    def _attach(self, conn: Connection):
+        vendor = quote_literal(self.vendor)
+        for live in live_tables:
+            staging = self.staging[live.name].name
+            # Lets ATTACH skip scanning the table for rows of other vendors.
+            conn.execute(
+                text(
+                    f"ALTER TABLE {staging} ADD CONSTRAINT {staging}_vendor "
+                    f"CHECK (vendor_name IS NOT NULL AND vendor_name = {vendor})"
+                )
+            )
+        for live in reversed(live_tables):
+            previous = vendor_partition(conn, live.name, self.vendor)
+            if previous is not None:
+                conn.execute(text(f"ALTER TABLE {live.name} DETACH PARTITION {previous}"))
+                conn.execute(text(f"DROP TABLE {previous}"))
+            else:
+                # Rows written without a staged load, in the default partition.
+                conn.execute(
+                    text(f"DELETE FROM {live.name} WHERE vendor_name = :vendor"),
+                    {"vendor": self.vendor},
+                )
+        for live in live_tables:
+            conn.execute(
+                text(
+                    f"ALTER TABLE {live.name} ATTACH PARTITION "
+                    f"{self.staging[live.name].name} FOR VALUES IN ({vendor})"
+                )
+            )
+
+    def _replace(self):
+        columns = {live.name: ", ".join(written_columns(live)) for live in live_tables}
+        with engine.begin() as conn:
+            conn.execute(
+                text(
+                    "DELETE FROM price WHERE product_hash IN "
+                    "(SELECT product_hash FROM product WHERE vendor_name = :vendor)"
+                ),
+                {"vendor": self.vendor},
+            )
+            conn.execute(
+                text("DELETE FROM product WHERE vendor_name = :vendor"),
+                {"vendor": self.vendor},
+            )
+            for live in live_tables:
+                conn.execute(
+                    text(
+                        f"INSERT INTO {live.name} ({columns[live.name]}) "
+                        f"SELECT {columns[live.name]} FROM {self.staging[live.name].name}"
+                    )
+                )
+        self.drop()
+
+
+@app.command()
+def partition():
+    """
+    Partition the product and price tables by vendor_name (Postgres only).
+
+    Each vendor gets its own partition, rows of vendors without one go to a
+    default partition. Postgres can't reference a partitioned table from a
+    foreign key without the partition key, so price.product_hash loses its
+    foreign key.
+    """
+    if engine.dialect.name != "postgresql":
+        raise typer.BadParameter("Partitioning needs Postgres")
+    suffix = int(time.time())
+    with engine.begin() as conn:
+        if is_partitioned(conn, "product"):
+            print("product and price are already partitioned")
+            return
+        conn.execute(text("ALTER TABLE price ADD COLUMN IF NOT EXISTS vendor_name VARCHAR"))
+        add_search_vector(conn)
+        conn.execute(
+            text(
+                "UPDATE price SET vendor_name = product.vendor_name FROM product "
+                "WHERE price.product_hash = product.product_hash AND price.vendor_name IS NULL"
+            )
+        )
+        vendors = conn.execute(select(Product.vendor_name).distinct()).scalars().all()
+        for live in reversed(live_tables):
+            conn.execute(text(f"ALTER TABLE {live.name} RENAME TO {live.name}_unpartitioned"))
+        for live in live_tables:
+            name = live.name
+            keys = ", ".join(c.name for c in live.primary_key.columns)
+            columns = ", ".join(written_columns(live))
+            conn.execute(
+                text(
+                    f"CREATE TABLE {name} (LIKE {name}_unpartitioned "
+                    "INCLUDING DEFAULTS INCLUDING GENERATED) PARTITION BY LIST (vendor_name)"
+                )
+            )
+            partitions = [(f"{name}_default", "DEFAULT")] + [
+                (
+                    f"{name}_{re.sub(r'[^a-z0-9]', '_', vendor.lower())}_{suffix}",
+                    f"FOR VALUES IN ({quote_literal(vendor)})",
+                )
+                for vendor in vendors
+            ]
+            for partition_name, bound in partitions:
+                conn.execute(text(f"CREATE TABLE {partition_name} PARTITION OF {name} {bound}"))
+            conn.execute(
+                text(
+                    f"INSERT INTO {name} ({columns}) "
+                    f"SELECT {columns} FROM {name}_unpartitioned"
+                )
+            )
+            for partition_name, _ in partitions:
+                conn.execute(text(f"ALTER TABLE {partition_name} ADD PRIMARY KEY ({keys})"))
+        for live in reversed(live_tables):
+            conn.execute(text(f"DROP TABLE {live.name}_unpartitioned"))
+        # Created on the parents, and with that on every partition.
+        for live in live_tables:
+            for index in live.indexes:
+                index.create(conn)
+        print(f"Partitioned product and price by vendor_name: {', '.join(vendors)}")
+
+
+if __name__ == "__main__":
+    app()
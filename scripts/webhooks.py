@@ -0,0 +1,100 @@
+"""Sends signed Stripe and Propel webhook events to a local server.
+
+    python -m scripts.webhooks propel user.created --user-id user_1
+    python -m scripts.webhooks stripe checkout.session.completed --user-id user_1 --subscription sub_1
+
+Events are signed with the secrets from the environment, like the providers
+would sign them. Run the server with STRIPE_API_BASE pointing at stripe-mock so
+processing checkout events doesn't call Stripe.
+"""
+
+import hashlib
+import hmac
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+import httpx
+import typer
+from svix.webhooks import Webhook
+
+from app import settings
+
+app = typer.Typer()
+
+default_url = "http://localhost:8000/v1/integrations"
+
+
+def stripe_event(event_type: str, user_id: str, subscription: str, customer: str) -> Dict[str, Any]:
+    if event_type == "checkout.session.completed":
+        data = {"client_reference_id": user_id, "subscription": subscription, "customer": customer}
+    elif event_type == "customer.subscription.deleted":
+        data = {
+            "id": subscription,
+            "customer": customer,
+            "items": {"data": [{"price": {"id": settings.stripe_price_id}}]},
+        }
+    else:
+        data = {"customer": customer}
+    return {
+        "id": f"evt_{uuid.uuid4().hex}",
+        "object": "event",
+        "type": event_type,
+        "data": {"object": data},
+    }
+
+
+def send(url: str, payload: str, headers: Dict[str, str], repeat: int):
+    for _ in range(repeat):
+        response = httpx.post(url, content=payload, headers={"content-type": "application/json", **headers})
+        print(f"{response.status_code} {response.text}")
+
+
+@app.command()
+def stripe(
+    event_type: str,
+    user_id: str = typer.Option("user_1"),
+    subscription: str = typer.Option("sub_1"),
+    customer: str = typer.Option("cus_1"),
+    url: str = typer.Option(default_url),
+    repeat: int = typer.Option(1, help="Deliver the same event this many times"),
+):
+    """
+    Send a signed Stripe event.
+    """
+    payload = json.dumps(stripe_event(event_type, user_id, subscription, customer))
+    timestamp = int(time.time())
+    signature = hmac.new(
+        settings.stripe_webhook_signing_secret.encode(),
+        f"{timestamp}.{payload}".encode(),
+        hashlib.sha256,
+    ).hexdigest()
+    send(f"{url}/stripe/webhook", payload, {"stripe-signature": f"t={timestamp},v1={signature}"}, repeat)
+
+
+@app.command()
+def propel(
+    event_type: str,
+    user_id: str = typer.Option("user_1"),
+    url: str = typer.Option(default_url),
+    repeat: int = typer.Option(1, help="Deliver the same event this many times"),
+):
+    """
+    Send a signed Propel (svix) event.
+    """
+    payload = json.dumps({"event_type": event_type, "user_id": user_id})
+    msg_id = f"msg_{uuid.uuid4().hex}"
+    timestamp = datetime.now(timezone.utc)
+    signature = Webhook(settings.propel_auth_webhook_secret).sign(msg_id, timestamp, payload)
+    headers = {
+        "svix-id": msg_id,
+        "svix-timestamp": str(int(timestamp.timestamp())),
+        "svix-signature": signature,
+    }
+    send(f"{url}/propel/webhook", payload, headers, repeat)
+
+
+if __name__ == "__main__":
+    app()
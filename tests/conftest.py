@@ -0,0 +1,27 @@
+import os
+import tempfile
+
+import pytest
+
+# app.settings reads these on import, so they're set before any app module is.
+os.environ.setdefault("DB_URL", f"sqlite:///{tempfile.mkdtemp()}/test.db")
+for name in [
+    "PROPEL_AUTH_WEBHOOK_SECRET",
+    "PROPEL_AUTH_API_KEY",
+    "CLOUDFLARE_API_TOKEN",
+    "STRIPE_API_KEY",
+    "STRIPE_PRODUCT_ID",
+    "STRIPE_PRICE_ID",
+    "STRIPE_WEBHOOK_SIGNING_SECRET",
+]:
+    os.environ.setdefault(name, "test")
+
+
+@pytest.fixture(autouse=True)
+def rate_limiter():
+    # Every test starts with full buckets.
+    from app.ratelimit import buckets
+
+    buckets._limiter = None
+    yield
+    buckets._limiter = None
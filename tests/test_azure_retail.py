@@ -0,0 +1,85 @@
+import asyncio
+import json
+from pathlib import Path
+
+import httpx
+import pytest
+from sqlmodel import Session, select
+
+from app.db.dependencies import engine
+from app.db.models import Price, Product
+from scripts.replay_server import ReplayServer
+from scripts.scrapers import azure_retail
+
+recording = json.loads(
+    (Path(__file__).parent / "fixtures" / "azure_retail.json").read_text()
+)
+odata_filter = "serviceFamily eq 'Compute' and armRegionName eq 'westeurope'"
+
+
+@pytest.fixture
+def replay(monkeypatch):
+    with ReplayServer(recording) as server:
+        monkeypatch.setattr(azure_retail, "base_url", f"{server.url}/api/retail/prices")
+        yield server
+
+
+def test_fetch_chain_retries_and_follows_next_page_links(replay):
+    pages = []
+
+    async def emit(items):
+        pages.append(items)
+
+    async def fetch():
+        async with httpx.AsyncClient() as client:
+            await azure_retail.fetch_chain(
+                client, odata_filter, emit, asyncio.Semaphore(1)
+            )
+
+    asyncio.run(fetch())
+
+    assert [[item["skuName"] for item in page] for page in pages] == [
+        ["D2s v3", "D2s v3"],
+        ["D4s v3"],
+    ]
+    # The 503 was retried, then the next-page link came back to the replay server.
+    assert [query.get("$skip") for _, query in replay.requests] == [None, None, "100"]
+
+
+def test_parse_item():
+    item = recording["responses"][1]["body"]["Items"][1]
+
+    product, price = azure_retail.parse_item(item)
+
+    assert product.vendor_name == "azure"
+    assert product.region == "westeurope"
+    assert product.service == "Virtual Machines"
+    assert product.product_family == "Compute"
+    assert product.sku == "DZH318Z0BQ4L/00TG"
+    assert product.attributes["arm_sku_name"] == "Standard_D2s_v3"
+    assert price.product_hash == product.product_hash
+    assert price.purchase_option == "Reservation"
+    assert price.usd == "504.0"
+    assert price.term_length == "1 Year"
+    # Consumption and reservation prices of one meter share the product.
+    on_demand_product, on_demand_price = azure_retail.parse_item(
+        recording["responses"][1]["body"]["Items"][0]
+    )
+    assert on_demand_product.product_hash == product.product_hash
+    assert on_demand_price.price_hash != price.price_hash
+
+
+def test_scrape_writes_every_page(replay, monkeypatch):
+    monkeypatch.setattr(azure_retail, "partition_filters", lambda: [odata_filter])
+
+    asyncio.run(azure_retail.scrape())
+
+    with Session(engine) as session:
+        skus = session.exec(
+            select(Product.sku).where(Product.vendor_name == "azure")
+        ).all()
+        purchase_options = session.exec(
+            select(Price.purchase_option).where(Price.vendor_name == "azure")
+        ).all()
+    assert sorted(skus) == ["DZH318Z0BQ4L/00TG", "DZH318Z0BQ4L/00TH"]
+    assert sorted(purchase_options) == ["Consumption", "Consumption", "Reservation"]
@@ -0,0 +1,78 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app import settings
+from app.main import app
+from app.propel import auth
+
+path = "/v1/products/graphql"
+query = '{ products(filter: {vendorName: "gcp"}) { sku } }'
+# Each unfiltered products field costs 11, over the anonymous budget of 50.
+expensive_query = "{ " + " ".join(f"p{i}: products(filter: {{}}) {{ sku }}" for i in range(5)) + " }"
+
+
+@pytest.fixture
+def client():
+    return TestClient(app)
+
+
+@pytest.fixture
+def signed_in():
+    app.dependency_overrides[auth.optional_user] = lambda: type(
+        "User", (), {"user_id": "cache-test-user"}
+    )()
+    yield {"Authorization": "Bearer token"}
+    app.dependency_overrides.pop(auth.optional_user)
+
+
+def test_anonymous_get_is_public_and_revalidated(client):
+    response = client.get(path, params={"query": query})
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == f"public, max-age={settings.graphql_cache_max_age}"
+    assert response.headers["vary"] == "Authorization"
+    etag = response.headers["etag"]
+
+    response = client.get(path, params={"query": query}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+
+
+def test_post_is_revalidated_but_not_cached(client):
+    response = client.post(path, json={"query": query})
+    assert response.headers["cache-control"] == "no-cache"
+    response = client.post(
+        path, json={"query": query}, headers={"If-None-Match": response.headers["etag"]}
+    )
+    assert response.status_code == 304
+
+
+def test_authenticated_responses_are_private(client, signed_in):
+    anonymous = client.get(path, params={"query": query})
+    response = client.get(path, params={"query": query}, headers=signed_in)
+    assert response.headers["cache-control"].startswith("private,")
+    assert response.headers["vary"] == "Authorization"
+    # Bodies differ by budget, so an anonymous ETag doesn't revalidate them.
+    assert response.headers["etag"] != anonymous.headers["etag"]
+    response = client.get(
+        path,
+        params={"query": query},
+        headers={**signed_in, "If-None-Match": anonymous.headers["etag"]},
+    )
+    assert response.status_code == 200
+
+
+def test_errors_are_not_cached(client):
+    response = client.get(path, params={"query": expensive_query})
+    assert response.status_code == 200
+    assert response.json()["errors"][0]["extensions"]["code"] == "QUERY_TOO_EXPENSIVE"
+    assert "etag" not in response.headers
+    assert response.headers["cache-control"] == "no-store"
+
+
+def test_clamped_responses_are_private(client, monkeypatch):
+    monkeypatch.setattr(settings, "query_cost_mode", "clamp")
+    response = client.get(path, params={"query": expensive_query})
+    assert "limitScale" in response.json()["extensions"]["cost"]
+    assert "etag" not in response.headers
+    assert response.headers["cache-control"].startswith("private,")
@@ -0,0 +1,119 @@
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from app.api.routers import integrations
+from app.cloudflare import CloudflareClient
+from app.db.dependencies import engine
+from app.db.models import User, UserType
+from app.entitlements import EntitlementCache, get_entitlement_cache
+from app.main import app
+from app.propel import auth
+from scripts import fake_kv
+
+
+class QuietHandler(fake_kv.Handler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def kv_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    fake_kv.store.clear()
+    yield f"http://127.0.0.1:{server.server_address[1]}/client/v4"
+    server.shutdown()
+    server.server_close()
+
+
+def kv_client(api_base: str, **kwargs) -> CloudflareClient:
+    return CloudflareClient(
+        api_base=api_base, account_id="local", namespace_id="users", api_token="test", **kwargs
+    )
+
+
+def add_user(user_id: str, user_type: UserType, stripe_customer_id: str | None = None):
+    with Session(engine) as session:
+        session.merge(
+            User(id=user_id, user_type=user_type, stripe_customer_id=stripe_customer_id)
+        )
+        session.commit()
+
+
+def test_writes_are_coalesced_and_flushed_on_close(kv_url):
+    client = kv_client(kv_url, flush_interval=60)
+    client.put_user_type("a", UserType.FREE)
+    client.put_user_type("a", UserType.PRO)
+    client.put_user_type("b", UserType.FREE)
+    client.remote_user_type("b")
+    # Pending writes are read back before they're sent.
+    assert client.get_user_type("a") == UserType.PRO
+    client.close()
+    assert fake_kv.store["users"] == {"a": "pro"}
+    with pytest.raises(RuntimeError):
+        client.put_user_type("c", UserType.FREE)
+
+
+def test_failed_batches_back_off(kv_url):
+    # Every request to the wrong path fails.
+    client = kv_client(f"{kv_url}/missing", flush_interval=0.1, batch_size=1)
+    attempts = []
+    put = client.http.put
+    client.http.put = lambda *args, **kwargs: attempts.append(1) or put(*args, **kwargs)
+    client.put_user_type("a", UserType.PRO)
+    client.put_user_type("b", UserType.PRO)
+    time.sleep(0.5)
+    # Retried after 0.1s, 0.2s and 0.4s, instead of in a loop as fast as
+    # requests fail since a full batch is pending.
+    assert len(attempts) <= 4
+    client.close()
+
+
+def test_entitlement_cache(kv_url):
+    add_user("cached", UserType.FREE)
+    client = kv_client(kv_url, flush_interval=60)
+    cache = EntitlementCache(client, ttl=60)
+    with Session(engine) as session:
+        assert cache.get(session, "cached") == UserType.FREE
+        assert cache.get(session, "unknown") is None
+        add_user("cached", UserType.PRO)
+        # Served from the cache until it's invalidated.
+        assert cache.get(session, "cached") == UserType.FREE
+        cache.invalidate("cached")
+        assert cache.get(session, "cached") == UserType.PRO
+
+        # Webhook processors only update the entry once they commit.
+        cache.set_after_commit(session, "cached", UserType.FREE)
+        assert cache.get(session, "cached") == UserType.PRO
+        session.commit()
+        assert cache.get(session, "cached") == UserType.FREE
+    client.close()
+    assert fake_kv.store["users"] == {"cached": "free"}
+
+
+def test_checkout_bills_returning_customers(monkeypatch):
+    add_user("returning", UserType.FREE, stripe_customer_id="cus_123")
+    sessions = []
+    monkeypatch.setattr(
+        integrations.stripe.checkout.Session,
+        "create",
+        lambda **kwargs: sessions.append(kwargs) or SimpleNamespace(url="https://checkout"),
+    )
+    app.dependency_overrides[auth.require_user] = lambda: SimpleNamespace(
+        user_id="returning", email="returning@example.com"
+    )
+    get_entitlement_cache().invalidate("returning")
+    try:
+        response = TestClient(app).get("/v1/integrations/stripe/checkout")
+    finally:
+        app.dependency_overrides.pop(auth.require_user)
+    assert response.json() == {"url": "https://checkout"}
+    assert sessions[0]["customer"] == "cus_123"
+    assert sessions[0]["customer_email"] is None
+    assert sessions[0]["client_reference_id"] == "returning"
@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+from sqlmodel import Session, select
+
+from app.db.dependencies import engine
+from app.db.models import Product
+from scripts.scrapers import gcp_catalog
+
+
+def sku(sku_id: str) -> dict:
+    return {
+        "sku_id": sku_id,
+        "service_regions": ["europe-west3"],
+        "service_display_name": "Compute Engine",
+        "product_family": "Compute",
+        "attributes": {"description": "N1 Instance Core running in europe-west3"},
+        "prices": [
+            {
+                "purchase_option": "on_demand",
+                "unit": "hour",
+                "USD": "0.03",
+                "effective_date_start": "2024-06-01 08:00:00+00:00",
+                "start_usage_amount": "0.0",
+                "end_usage_amount": None,
+            }
+        ],
+    }
+
+
+def test_malformed_sku_skips_its_file(tmp_path):
+    malformed = sku("malformed")
+    del malformed["service_display_name"]
+    bad, good = tmp_path / "gcp-bad.json", tmp_path / "gcp-good.json"
+    bad.write_text(json.dumps({"skus": [sku("other"), malformed]}))
+    good.write_text(json.dumps({"skus": [sku("good")]}))
+
+    asyncio.run(gcp_catalog.load_all([str(bad), str(good)]))
+
+    with Session(engine) as session:
+        skus = session.exec(select(Product.sku).where(Product.vendor_name == "gcp")).all()
+    assert "good" in skus
+    # Kept for another run, the loaded file is removed.
+    assert bad.exists() and not good.exists()
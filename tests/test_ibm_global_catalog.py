@@ -0,0 +1,145 @@
+import asyncio
+import copy
+import json
+from pathlib import Path
+
+import httpx
+import pytest
+from sqlmodel import Session, select
+
+from app.db.dependencies import engine
+from app.db.models import Price, Product
+from scripts.replay_server import ReplayServer
+from scripts.scrapers import ibm_catalog
+from scripts.scrapers import ibm_global_catalog as catalog
+
+recording = json.loads(
+    (Path(__file__).parent / "fixtures" / "ibm_global_catalog.json").read_text()
+)
+
+
+def response(path: str) -> dict:
+    return next(r for r in recording["responses"] if r["path"] == path)
+
+
+@pytest.fixture
+def replay(monkeypatch):
+    def start(rec=recording):
+        server = ReplayServer(rec).__enter__()
+        servers.append(server)
+        monkeypatch.setattr(catalog, "base_url", f"{server.url}/api/v1")
+        return server
+
+    servers = []
+    # Small pages so the recording covers pagination.
+    monkeypatch.setattr(catalog, "page_size", 2)
+    yield start
+    for server in servers:
+        server.__exit__()
+
+
+def test_client_retries_and_pages(replay):
+    server = replay()
+
+    async def fetch():
+        async with httpx.AsyncClient() as http_client:
+            client = catalog.CatalogClient(http_client)
+            services = await client.services("kind:service active:true")
+            # Repeated requests are served from the first fetch.
+            await client.services("kind:service active:true")
+            missing = await client.pricing("dep-vpc-eu-de")
+            # Pricing is read once, so it isn't kept for the rest of the crawl.
+            assert not any("/pricing" in url for url in client.responses)
+            return services, missing
+
+    services, missing = asyncio.run(fetch())
+
+    assert [s["name"] for s in services] == [
+        "is.instance",
+        "dns-svcs",
+        "containers-kubernetes",
+    ]
+    assert missing is None
+    # The 429 was retried, then the second page fetched once.
+    assert [query.get("_offset") for path, query in server.requests if path == "/api/v1"] == [
+        "0",
+        "0",
+        "2",
+    ]
+
+
+def test_crawl_counts_skipped_nodes():
+    roots = [catalog.Node(entry={"id": i, "name": i}, service={}) for i in "abc"]
+
+    async def expand(node: catalog.Node):
+        if node.entry["id"] == "b":
+            raise RuntimeError("broken")
+        return []
+
+    assert asyncio.run(catalog.crawl(roots, expand)) == 1
+
+
+def test_parse_pricing():
+    node = catalog.Node(
+        entry=response("/api/v1/plan-vpc-standard/deployment")["body"]["resources"][0],
+        service=recording["responses"][1]["body"]["resources"][0],
+        plan=response("/api/v1/svc-vpc/plan")["body"]["resources"][0],
+    )
+    pricing = response("/api/v1/dep-vpc-us-south/pricing")["body"]
+
+    product, prices = catalog.parse_pricing(node, pricing, product_family="service")
+
+    assert product.vendor_name == "ibm"
+    assert product.sku == "plan-vpc-standard"
+    assert product.region == "us-south"
+    assert product.service == "Virtual Server for VPC"
+    assert product.attributes["plan_display_name"] == "Standard"
+    # Only USA amounts are kept, one price per tier.
+    assert [(p.usd, p.start_usage_amount, p.end_usage_amount) for p in prices] == [
+        ("0.05", "0.0", "1000"),
+        ("0.04", "1000", "999999999"),
+    ]
+    assert {p.unit for p in prices} == {"INSTANCE_HOURS"}
+    assert len({p.price_hash for p in prices}) == 2
+
+
+def test_scrape_writes_priced_deployments(replay):
+    replay()
+
+    asyncio.run(ibm_catalog.scrape())
+
+    with Session(engine) as session:
+        products = session.execute(
+            select(Product.product_hash, Product.region, Product.product_family).where(
+                Product.sku == "plan-vpc-standard"
+            )
+        ).all()
+        prices = session.exec(
+            select(Price.usd).where(Price.product_hash == products[0].product_hash)
+        ).all()
+    # The eu-de deployment has no pricing recorded.
+    assert [p.region for p in products] == ["us-south"]
+    # From the service's category tag.
+    assert products[0].product_family == "Compute"
+    assert sorted(prices) == ["0.04", "0.05"]
+
+
+def test_product_family_falls_back_to_kind():
+    assert ibm_catalog.product_family({"kind": "service", "tags": ["dns"]}) == "service"
+
+
+def test_scrape_fails_when_entries_are_skipped(replay):
+    broken = copy.deepcopy(recording)
+    for r in broken["responses"]:
+        if r["path"] == "/api/v1/svc-dns/plan":
+            r["status"] = 400
+    replay(broken)
+
+    with pytest.raises(RuntimeError, match="Skipped 1 IBM catalog entries"):
+        asyncio.run(ibm_catalog.scrape())
+
+    # What was crawled is still written.
+    with Session(engine) as session:
+        assert session.exec(
+            select(Product.region).where(Product.sku == "plan-vpc-standard")
+        ).all() == ["us-south"]
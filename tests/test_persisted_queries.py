@@ -0,0 +1,40 @@
+import hashlib
+
+from fastapi.testclient import TestClient
+
+from app.api.caching import PersistedQueryStore, max_persisted_query_length
+from app.main import app
+
+query = '{ products(filter: {vendorName: "gcp"}) { sku } }'
+
+
+def sha256(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def test_store_keeps_only_queries():
+    store = PersistedQueryStore()
+    assert store.add(sha256(query), query)
+    assert store.get(sha256(query)) == query
+    for document in ["{ products(", "mutation { x }", "{ a }" + " " * max_persisted_query_length]:
+        assert not store.add(sha256(document), document)
+        assert store.get(sha256(document)) is None
+
+
+def test_client_queries_expire():
+    store = PersistedQueryStore(ttl=0)
+    store.add(sha256(query), query)
+    assert store.get(sha256(query)) is None
+
+
+def test_register_and_get():
+    client = TestClient(app)
+    extensions = f'{{"persistedQuery": {{"version": 1, "sha256Hash": "{sha256(query)}"}}}}'
+    response = client.get("/v1/products/graphql", params={"extensions": extensions})
+    assert response.json()["errors"][0]["extensions"]["code"] == "PERSISTED_QUERY_NOT_FOUND"
+    response = client.get(
+        "/v1/products/graphql", params={"query": query, "extensions": extensions}
+    )
+    assert "errors" not in response.json()
+    response = client.get("/v1/products/graphql", params={"extensions": extensions})
+    assert "errors" not in response.json()
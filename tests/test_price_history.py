@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, delete, select
+
+from app import settings
+from app.catalog import record_price_changes
+from app.db.dependencies import engine
+from app.db.models import Price, PriceVersion, Product
+from app.main import app
+
+first_run = datetime(2024, 1, 1, tzinfo=timezone.utc)
+second_run = datetime(2024, 2, 1, tzinfo=timezone.utc)
+
+
+def price(price_hash: str, usd: str) -> Price:
+    return Price(
+        price_hash=price_hash,
+        product_hash="history",
+        vendor_name="history",
+        purchase_option="on_demand",
+        unit="h",
+        usd=usd,
+        effective_start_date="2024-01-01",
+    )
+
+
+@pytest.fixture(autouse=True)
+def no_rate_limit(monkeypatch):
+    # A few asOf queries per test are over the anonymous budget.
+    monkeypatch.setattr(settings, "rate_limit_backend", "off")
+
+
+@pytest.fixture(scope="module")
+def client():
+    with Session(engine) as session:
+        session.exec(
+            delete(PriceVersion).where(PriceVersion.vendor_name == "history")  # type: ignore
+        )
+        session.exec(delete(Price).where(Price.product_hash == "history"))  # type: ignore
+        session.exec(delete(Product).where(Product.product_hash == "history"))  # type: ignore
+        session.add(
+            Product(
+                product_hash="history",
+                sku="s",
+                vendor_name="history",
+                service="Compute",
+            )
+        )
+        session.add(price("changed", "0.5"))
+        session.add(price("removed", "1.0"))
+        session.commit()
+        assert record_price_changes(session, "history", first_run) == (0, 2)
+
+        session.get(Price, "changed").usd = "0.6"  # type: ignore
+        session.delete(session.get(Price, "removed"))
+        session.commit()
+        # Both versions of the first run are closed, the changed price gets a new one.
+        assert record_price_changes(session, "history", second_run) == (2, 1)
+        # Nothing changed since.
+        assert record_price_changes(session, "history", second_run) == (0, 0)
+    return TestClient(app)
+
+
+def prices(client: TestClient, as_of: datetime | None = None) -> list:
+    argument = f', asOf: "{as_of.isoformat()}"' if as_of else ""
+    response = client.post(
+        "/v1/products/graphql",
+        json={
+            "query": f'{{ products(filter: {{vendorName: "history"}}{argument}) '
+            "{ prices { usd } } }"
+        },
+    )
+    body = response.json()
+    assert "errors" not in body, body
+    return sorted(p["usd"] for p in body["data"]["products"][0]["prices"])
+
+
+def test_versions_of_changed_and_removed_prices(client):
+    with Session(engine) as session:
+        versions = session.exec(
+            select(PriceVersion.price_hash, PriceVersion.usd, PriceVersion.valid_to)
+            .where(PriceVersion.vendor_name == "history")
+            .order_by(PriceVersion.price_hash, PriceVersion.valid_from)
+        ).all()
+    assert [(v.price_hash, v.usd, v.valid_to is None) for v in versions] == [
+        ("changed", "0.5", False),
+        ("changed", "0.6", True),
+        ("removed", "1.0", False),
+    ]
+
+
+def test_as_of(client):
+    assert prices(client) == ["0.6"]
+    assert prices(client, first_run + timedelta(days=1)) == ["0.5", "1.0"]
+    assert prices(client, second_run) == ["0.6"]
+
+
+def test_as_of_before_the_first_version(client):
+    assert prices(client, first_run - timedelta(seconds=1)) == []
@@ -0,0 +1,55 @@
+import pytest
+from fastapi.testclient import TestClient
+from sqlmodel import Session, delete
+
+from app.db.dependencies import engine
+from app.db.models import Price, Product
+from app.main import app
+
+
+@pytest.fixture(scope="module")
+def client():
+    with Session(engine) as session:
+        session.exec(delete(Price))  # type: ignore
+        session.exec(delete(Product))  # type: ignore
+        session.add(
+            Product(product_hash="p1", sku="s1", vendor_name="gcp", service="Compute")
+        )
+        session.add(
+            Price(
+                price_hash="p1-on-demand",
+                product_hash="p1",
+                vendor_name="gcp",
+                purchase_option="on_demand",
+                unit="h",
+                usd="0.5",
+                effective_start_date="2024-01-01",
+            )
+        )
+        session.commit()
+    return TestClient(app)
+
+
+def query(client: TestClient, fields: str) -> dict:
+    response = client.post(
+        "/v1/products/graphql",
+        json={"query": f'{{ products(filter: {{vendorName: "gcp"}}) {{ {fields} }} }}'},
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert "errors" not in body, body
+    return body["data"]["products"]
+
+
+def test_prices_only(client):
+    assert query(client, "prices { usd }") == [{"prices": [{"usd": "0.5"}]}]
+
+
+def test_product_hash_only(client):
+    assert query(client, "productHash") == [{"productHash": "p1"}]
+
+
+def test_selected_columns(client):
+    assert query(client, 'sku attributes(keys: ["x"]) prices { unit }') == [
+        {"sku": "s1", "attributes": {}, "prices": [{"unit": "h"}]}
+    ]
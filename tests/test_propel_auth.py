@@ -0,0 +1,128 @@
+import importlib
+import threading
+import time
+
+from http.server import ThreadingHTTPServer
+
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from propelauth_py import UnauthorizedException
+
+from app.propel.auth import LocalAuth
+from scripts import fake_propel
+
+# app.propel exports the auth instance under the module's name.
+auth_module = importlib.import_module("app.propel.auth")
+
+
+def new_key() -> rsa.RSAPrivateKey:
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+class KeyServer(fake_propel.Handler):
+    fetches = 0
+
+    def do_GET(self):
+        type(self).fetches += 1
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def propel():
+    key = new_key()
+    KeyServer.pem = fake_propel.public_pem(key)
+    KeyServer.fetches = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeyServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield url, key
+    server.shutdown()
+    server.server_close()
+
+
+def mint(key, url: str, minutes: int = 60, user_id: str = "user_1") -> str:
+    return fake_propel.mint_token(key, user_id, f"{user_id}@example.com", url, minutes)
+
+
+def bearer(token: str) -> HTTPAuthorizationCredentials:
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+
+def test_validated_tokens_are_cached(propel, monkeypatch):
+    url, key = propel
+    local = LocalAuth(url, "test")
+    token = mint(key, url)
+    assert local.validate(token).user_id == "user_1"
+
+    checks = []
+    validate = local.key.validate
+    monkeypatch.setattr(local.key, "validate", lambda t: checks.append(t) or validate(t))
+    assert local.require_user(bearer(token)).email == "user_1@example.com"
+    assert checks == []
+    assert KeyServer.fetches == 1
+
+
+def test_tokens_are_dropped_from_the_cache_when_they_expire(propel, monkeypatch):
+    url, key = propel
+    local = LocalAuth(url, "test")
+    token = mint(key, url, minutes=1)
+    local.validate(token)
+    checks = []
+    validate = local.key.validate
+    monkeypatch.setattr(local.key, "validate", lambda t: checks.append(t) or validate(t))
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    # Checked again, which passes since PyJWT reads the real clock.
+    local.validate(token)
+    assert checks == [token]
+
+
+def test_expired_tokens_are_rejected(propel):
+    url, key = propel
+    local = LocalAuth(url, "test")
+    # Past the 60s of leeway.
+    token = mint(key, url, minutes=-5)
+    with pytest.raises(HTTPException) as e:
+        local.require_user(bearer(token))
+    assert e.value.status_code == 401
+    assert local.optional_user(bearer(token)) is None
+
+
+def test_key_is_refreshed_after_rotation(propel, monkeypatch):
+    url, key = propel
+    monkeypatch.setattr(auth_module, "key_refresh_interval", 0)
+    local = LocalAuth(url, "test")
+    assert local.validate(mint(key, url, user_id="before")).user_id == "before"
+
+    rotated = new_key()
+    KeyServer.pem = fake_propel.public_pem(rotated)
+    assert local.validate(mint(rotated, url, user_id="after")).user_id == "after"
+    assert KeyServer.fetches == 2
+
+
+def test_forged_tokens_are_rejected(propel):
+    url, key = propel
+    local = LocalAuth(url, "test")
+    local.validate(mint(key, url))
+    with pytest.raises(UnauthorizedException):
+        local.validate(mint(new_key(), url, user_id="admin"))
+    # Claims changed after signing.
+    header, payload, signature = mint(key, url).split(".")
+    _, other_payload, _ = mint(key, url, user_id="admin").split(".")
+    with pytest.raises(UnauthorizedException):
+        local.validate(f"{header}.{other_payload}.{signature}")
+    # Within key_refresh_interval, forged tokens don't fetch the key again.
+    assert KeyServer.fetches == 1
+
+
+def test_key_endpoint_errors_are_503():
+    local = LocalAuth("http://127.0.0.1:9", "test")
+    for dependency in (local.require_user, local.optional_user):
+        with pytest.raises(HTTPException) as e:
+            dependency(bearer("token"))
+        assert e.value.status_code == 503
@@ -0,0 +1,44 @@
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+from app import settings
+from app.main import app
+from app.ratelimit.graphql import client_ip
+
+
+def request(forwarded: str | None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded else []
+    return Request({"type": "http", "headers": headers, "client": ("10.0.0.1", 1234)})
+
+
+def test_client_ip_is_appended_by_trusted_proxy():
+    assert client_ip(request("203.0.113.7"), hops=1) == "203.0.113.7"
+    # Whatever the client sent comes before the entry of the proxy.
+    assert client_ip(request("1.2.3.4, 203.0.113.7"), hops=1) == "203.0.113.7"
+    assert client_ip(request("1.2.3.4, 203.0.113.7, 10.1.1.1"), hops=2) == "203.0.113.7"
+    assert client_ip(request("203.0.113.7"), hops=2) == "203.0.113.7"
+    assert client_ip(request("1.2.3.4"), hops=0) == "10.0.0.1"
+    assert client_ip(request(None), hops=1) == "10.0.0.1"
+
+
+def test_anonymous_budget_is_capped_at_bucket_capacity():
+    # Each unfiltered products field is estimated at 11, over the 50 tokens of
+    # the anonymous bucket but within QUERY_COST_BUDGET.
+    fields = " ".join(f"p{i}: products(filter: {{}}) {{ sku }}" for i in range(5))
+    response = TestClient(app).post("/v1/products/graphql", json={"query": f"{{ {fields} }}"})
+    body = response.json()
+    assert body["errors"][0]["extensions"]["code"] == "QUERY_TOO_EXPENSIVE"
+    assert body["extensions"]["cost"]["budget"] == 50
+    assert "retry-after" not in response.headers
+
+
+def test_rate_limiting_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "rate_limit_backend", "off")
+    client = TestClient(app)
+    # 10 of these are over the 50 tokens of the anonymous bucket.
+    for _ in range(10):
+        response = client.post(
+            "/v1/products/graphql", json={"query": "{ products(filter: {}) { sku } }"}
+        )
+        assert response.status_code == 200
+        assert "ratelimit-remaining" not in response.headers
@@ -0,0 +1,37 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from app.db.routing import ReadRouter
+
+
+def select_one(session) -> int:
+    return session.exec(text("SELECT 1")).scalar_one()
+
+
+@pytest.fixture
+def router(tmp_path) -> ReadRouter:
+    primary = create_engine(f"sqlite:///{tmp_path}/primary.db")
+    # Fails to connect, the directory doesn't exist.
+    replica = create_engine(f"sqlite:///{tmp_path}/missing/replica.db")
+    router = ReadRouter(primary, replica, max_lag=30, check_interval=60)
+    # As if the last check found the replica healthy.
+    router.use_replica = True
+    router._next_check = time.monotonic() + 60
+    return router
+
+
+def test_failed_replica_read_retries_on_primary(router):
+    assert router.engine() is router.replica
+    assert router.read(select_one) == 1
+    assert not router.use_replica
+    assert router.engine() is router.primary
+
+
+def test_failed_primary_read_raises(router):
+    router.use_replica = False
+    router.primary = create_engine("sqlite:////nonexistent/primary.db")
+    with pytest.raises(OperationalError):
+        router.read(select_one)
@@ -0,0 +1,37 @@
+import asyncio
+
+from app.db.models import Product
+from scripts import scrape
+from scripts.pipeline import BatchedDbSink
+
+
+def product(sku: str) -> Product:
+    return Product(
+        product_hash=f"scrape-test-{sku}",
+        sku=sku,
+        vendor_name="gcp",
+        region="europe-west3",
+        service="Compute Engine",
+        product_family="Compute",
+        attributes={},
+    )
+
+
+def test_catalog_updated_once_per_vendor_that_wrote_rows(monkeypatch):
+    updated = []
+    monkeypatch.setattr(scrape, "catalog_updated", lambda *args: updated.append(args))
+
+    async def writes(sku: str):
+        await asyncio.to_thread(BatchedDbSink().write, [product(sku)])
+
+    async def nothing():
+        pass
+
+    configs = [
+        scrape.ScraperConfig("aws", "bulk", nothing),
+        scrape.ScraperConfig("gcp", "catalog", lambda: writes("catalog")),
+        scrape.ScraperConfig("gcp", "machine-types", lambda: writes("machine-type")),
+    ]
+
+    assert asyncio.run(scrape.run_scrapers(configs))
+    assert updated == [("gcp", "gcp:catalog,gcp:machine-types")]
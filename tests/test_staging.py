@@ -0,0 +1,135 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import inspect
+from sqlmodel import Session, delete, select
+
+from app.db.dependencies import engine
+from app.db.models import Price, Product
+from scripts.pipeline import BatchedDbSink
+from scripts.scrape import ScraperConfig, run_scrapers
+from scripts.scrapers import gcp_machine_types
+from scripts.staging import StagedLoad
+
+
+def compute_sku(name: str, description: str, usd: str) -> list:
+    return [
+        Product(
+            product_hash=name,
+            sku=name,
+            vendor_name="gcp",
+            region="us-central1",
+            service="Compute Engine",
+            product_family="Compute",
+            attributes={"description": description},
+        ),
+        Price(
+            price_hash=f"{name}-price",
+            product_hash=name,
+            vendor_name="gcp",
+            purchase_option="on_demand",
+            unit="h",
+            usd=usd,
+            effective_start_date="2024-01-01",
+        ),
+    ]
+
+
+def catalog_scraper(core_usd: str):
+    async def scrape():
+        rows = compute_sku("core", "N1 Predefined Instance Core running in Americas", core_usd)
+        rows += compute_sku("ram", "N1 Predefined Instance Ram running in Americas", "0.5")
+        BatchedDbSink().write(rows)
+
+    return scrape
+
+
+class Regions:
+    def list(self, project):
+        return [SimpleNamespace(name="us-central1", zones=["zones/us-central1-a"])]
+
+
+class MachineTypes:
+    def list(self, project, zone):
+        return [SimpleNamespace(name="n1-standard-2", guest_cpus=2, memory_mb=4096)]
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    monkeypatch.setattr(gcp_machine_types.compute, "RegionsClient", Regions)
+    monkeypatch.setattr(gcp_machine_types.compute, "MachineTypesClient", MachineTypes)
+    with Session(engine) as session:
+        session.exec(delete(Price))  # type: ignore
+        session.exec(delete(Product))  # type: ignore
+        session.commit()
+    BatchedDbSink().write(compute_sku("core", "N1 Predefined Instance Core", "1.0"))
+
+
+def test_sink_upserts_live_rows(catalog):
+    # Within a batch the last row with a key wins, and existing rows are updated.
+    BatchedDbSink().write(
+        compute_sku("core", "N1 Predefined Instance Core", "2.0")
+        + compute_sku("core", "N1 Predefined Instance Core", "3.0")
+    )
+
+    with Session(engine) as session:
+        assert session.exec(select(Price.usd).where(Price.product_hash == "core")).all() == [
+            "3.0"
+        ]
+
+
+def staging_tables() -> list[str]:
+    return [t for t in inspect(engine).get_table_names() if t.startswith(("product_", "price_"))]
+
+
+def machine_type_prices() -> list[str]:
+    with Session(engine) as session:
+        stmt = (
+            select(Price.purchase_option, Price.usd)
+            .join(Product)
+            .where(Product.product_family == "Compute Instance")
+        )
+        return list(session.exec(stmt).all())  # type: ignore
+
+
+def test_machine_types_priced_from_staged_catalog(catalog):
+    scrapers = [
+        ScraperConfig("gcp", "catalog", catalog_scraper("2.0")),
+        ScraperConfig("gcp", "machine-types", gcp_machine_types.scrape),
+    ]
+    assert asyncio.run(run_scrapers(scrapers, staged=True))
+    # 2 CPUs at 2.0 and 4 GB at 0.5 from the staged SKUs, not the live 1.0.
+    assert machine_type_prices() == [("on_demand", "6.0")]
+    assert staging_tables() == []
+
+
+def test_live_writes_fail_staged_load(catalog):
+    async def writes_live():
+        with Session(engine) as session:
+            session.add(Product(product_hash="direct", sku="x", vendor_name="gcp", service="X"))
+            session.commit()
+
+    scrapers = [
+        ScraperConfig("gcp", "catalog", catalog_scraper("2.0")),
+        ScraperConfig("gcp", "direct", writes_live),
+    ]
+    assert not asyncio.run(run_scrapers(scrapers, staged=True))
+    with Session(engine) as session:
+        assert session.get(Product, "direct") is None
+        assert session.get(Price, "core-price").usd == "1.0"  # type: ignore
+    assert staging_tables() == []
+
+
+def test_failed_swap_drops_staging_tables(catalog, monkeypatch):
+    def fail():
+        raise RuntimeError("lock timeout")
+
+    load = StagedLoad("gcp")
+    monkeypatch.setattr(load, "_replace", fail)
+    load.create()
+    with load.active():
+        asyncio.run(catalog_scraper("2.0")())
+    with pytest.raises(RuntimeError):
+        load.finish()
+    assert staging_tables() == []
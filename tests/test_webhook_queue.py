@@ -0,0 +1,36 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from sqlmodel import Session
+
+from app.db.dependencies import engine
+from app.db.models import WebhookEvent, WebhookStatus
+from app.webhooks.queue import WebhookQueue, record_event
+
+
+def test_duplicate_delivery_is_processed_once():
+    calls = []
+
+    def process(payload, db, services):
+        calls.append(payload)
+        # Long enough for the other worker to take the duplicate meanwhile.
+        time.sleep(0.1)
+
+    async def deliver_twice():
+        queue = WebhookQueue(
+            engine, SimpleNamespace(), {"test": process}, workers=2, max_attempts=1
+        )
+        await queue.start()
+        for _ in range(2):
+            with Session(engine) as db:
+                if record_event(db, "test", "evt_1", "test.event", {"n": 1}):
+                    queue.enqueue("test", "evt_1")
+        await queue.join()
+        await queue.stop()
+
+    asyncio.run(deliver_twice())
+    assert calls == [{"n": 1}]
+    with Session(engine) as db:
+        event = db.get(WebhookEvent, ("test", "evt_1"))
+        assert event is not None and event.status == WebhookStatus.DONE